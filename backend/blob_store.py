@@ -0,0 +1,115 @@
+"""
+Content-addressed storage for uploaded files.
+
+Uploads are streamed to disk in fixed-size chunks and hashed on the fly. The
+bytes are stored once per SHA-256 under ``<root>/blobs/<aa>/<hash>``; a
+``blobs`` document keeps a reference count, and every upload gets its own
+``uploads`` metadata document (owner, original name, type, size, hash).
+Identical files uploaded many times therefore share a single blob on disk.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+from datetime import datetime
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class BlobStore:
+    def __init__(self, db, root, chunk_size=CHUNK_SIZE):
+        self.db = db
+        self.root = root
+        self.chunk_size = chunk_size
+        self.blob_dir = os.path.join(root, 'blobs')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def blob_path(self, content_hash):
+        return os.path.join(self.blob_dir, content_hash[:2], content_hash)
+
+    def _spool(self, stream):
+        """Copy a stream to a temp file chunk by chunk, returning (temp path, sha256, size)"""
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=self.tmp_dir, delete=False) as tmp:
+            try:
+                for chunk in iter(lambda: stream.read(self.chunk_size), b''):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+            except Exception:
+                os.unlink(tmp.name)
+                raise
+        return tmp.name, digest.hexdigest(), size
+
+    def save(self, file_storage, user_id, name):
+        """
+        Store an uploaded file and record its metadata.
+
+        Args:
+            file_storage: The Werkzeug ``FileStorage`` from ``request.files``
+            user_id (ObjectId): Owner of the upload
+            name (str): Sanitized original file name
+
+        Returns:
+            dict: The upload metadata, including ``id``, ``content_hash``, ``path`` and ``size``
+        """
+        tmp_path, content_hash, size = self._spool(file_storage.stream)
+        path = self.blob_path(content_hash)
+
+        # Take the reference before touching the file so a concurrent release can't delete it under us
+        result = self.db.blobs.update_one(
+            {"_id": content_hash},
+            {
+                "$inc": {"refcount": 1},
+                "$setOnInsert": {"size": size, "created_at": datetime.now()}
+            },
+            upsert=True
+        )
+
+        if result.upserted_id is not None or not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        else:
+            os.unlink(tmp_path)
+            logger.info(f"Deduplicated upload {name} ({size} bytes) onto existing blob {content_hash[:12]}")
+
+        upload = {
+            "user_id": user_id,
+            "name": name,
+            "type": file_storage.content_type,
+            "size": size,
+            "content_hash": content_hash,
+            "path": path,
+            "created_at": datetime.now()
+        }
+        upload_id = self.db.uploads.insert_one(upload).inserted_id
+        upload['id'] = str(upload_id)
+        del upload['_id']
+        return upload
+
+    def release(self, upload_id):
+        """Delete an upload's metadata and drop its blob once no upload references it"""
+        upload = self.db.uploads.find_one_and_delete({"_id": upload_id})
+        if upload is None:
+            return False
+
+        blob = self.db.blobs.find_one_and_update(
+            {"_id": upload['content_hash']},
+            {"$inc": {"refcount": -1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if blob is not None and blob.get('refcount', 0) <= 0:
+            if self.db.blobs.delete_one({"_id": blob['_id'], "refcount": {"$lte": 0}}).deleted_count:
+                try:
+                    os.unlink(self.blob_path(blob['_id']))
+                except FileNotFoundError:
+                    pass
+                logger.info(f"Removed unreferenced blob {blob['_id'][:12]}")
+        return True
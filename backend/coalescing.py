@@ -0,0 +1,183 @@
+"""
+Coalescing of identical in-flight completion streams.
+
+When a request arrives with the same prompt fingerprint as a generation that
+is still running, it attaches to that generation instead of starting another
+API call. One producer thread drives the upstream stream and buffers its
+deltas; every subscriber replays the buffer from the start and then follows
+along, so late joiners see the full response. Subscribers do their own
+persistence. The producer belongs to no request, so a subscriber that
+disconnects never stalls the others. Once every subscriber has gone, the
+upstream call is closed.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.result = None
+        self.subscribers = 0
+        self.condition = threading.Condition()
+
+    def publish(self, chunk):
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self.condition:
+            self.done = True
+            self.result = result
+            self.error = error
+            self.condition.notify_all()
+
+
+class Subscription:
+    """
+    Iterates over one generation's deltas; ``result`` holds the producer's return value once exhausted.
+
+    The subscription is registered when it is created, so callers must ``close()`` it (iterating to the
+    end does too); closing an iterator from ``poll`` that was never advanced would not run its cleanup.
+    """
+
+    def __init__(self, coalescer, key, flight, shared):
+        self._coalescer = coalescer
+        self._key = key
+        self._flight = flight
+        self._closed = False
+        # Whether this request joined a generation started by another one
+        self.shared = shared
+
+    @property
+    def result(self):
+        return self._flight.result
+
+    def __iter__(self):
+        return self.poll()
+
+    def close(self):
+        """Unsubscribe; the upstream call is cancelled once no subscriber is left. Safe to call repeatedly"""
+        with self._coalescer._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._coalescer._unsubscribe(self._key, self._flight)
+
+    def poll(self, timeout=None):
+        """
+        Iterate over the deltas, yielding None whenever a wait for the next one times out.
+
+        Args:
+            timeout: Callable returning the longest wait in seconds (None to wait indefinitely), asked before each wait
+        """
+        flight = self._flight
+        position = 0
+        try:
+            while True:
+                with flight.condition:
+                    while position >= len(flight.chunks) and not flight.done:
+                        wait = timeout() if timeout else None
+                        if wait is not None and wait <= 0:
+                            break
+                        flight.condition.wait(wait)
+                    chunks = flight.chunks[position:]
+                    done = flight.done
+                    error = flight.error
+                if not chunks and not done:
+                    yield None
+                    continue
+                position += len(chunks)
+                yield from chunks
+                if done and position >= len(flight.chunks):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self.close()
+
+
+class StreamCoalescer:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.joined = 0
+
+    def stream(self, key, start):
+        """
+        Subscribe to the generation for ``key``, starting it with ``start()`` if none is running.
+
+        Args:
+            key (str): Prompt fingerprint; requests with equal keys share one generation
+            start: Callable returning an iterator of deltas (its return value becomes ``result``)
+
+        Returns:
+            Subscription: Iterable of the generation's deltas
+        """
+        with self._lock:
+            flight = self._flights.get(key) if self.enabled else None
+            shared = flight is not None
+            if flight is None:
+                flight = _Flight()
+                if self.enabled:
+                    self._flights[key] = flight
+                self.started += 1
+            else:
+                self.joined += 1
+            flight.subscribers += 1
+
+        if shared:
+            logger.info(f"Attached to in-flight generation {key[:12]} ({flight.subscribers} subscribers)")
+        else:
+            threading.Thread(target=self._produce, args=(key, flight, start), name='coalesced-stream', daemon=True).start()
+        return Subscription(self, key, flight, shared)
+
+    def _produce(self, key, flight, start):
+        iterator = None
+        try:
+            iterator = iter(start())
+            while True:
+                try:
+                    chunk = next(iterator)
+                except StopIteration as stop:
+                    flight.finish(result=stop.value)
+                    return
+                flight.publish(chunk)
+                if flight.subscribers == 0:
+                    # Nobody is listening any more: stop paying for the generation
+                    flight.finish(error=RuntimeError("generation cancelled"))
+                    return
+        except Exception as e:
+            flight.finish(error=e)
+        finally:
+            if iterator is not None and hasattr(iterator, 'close'):
+                iterator.close()
+            self._retire(key, flight)
+
+    def _retire(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _unsubscribe(self, key, flight):
+        with self._lock:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and self._flights.get(key) is flight:
+                # Don't let new requests join a generation that is about to be cancelled
+                del self._flights[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'in_flight': len(self._flights),
+                'started': self.started,
+                'joined': self.joined
+            }
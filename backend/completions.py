@@ -0,0 +1,205 @@
+"""
+Resilient access to the chat completion API.
+
+``CompletionGateway`` wraps the completion backend (see ``backend.llm``) used
+by the routes and the summarizer. It applies per-call timeouts (the whole
+response for regular calls, the gap between chunks for streams) and retries
+429, 408/409 and 5xx responses and connection errors with jittered
+exponential backoff, honouring ``Retry-After``. It also counts in-flight calls and the time until response
+headers arrive, which includes waiting for a pooled connection, so
+``/healthz`` can report them without calling the API. Backends disable the
+SDK's own retries so failed calls are not retried twice.
+"""
+import logging
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+import httpx
+import openai
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {408, 409, 429}
+LATENCY_SAMPLES = 512
+
+
+def create_http_client(max_connections=100, max_keepalive=20, connect_timeout=5.0, read_timeout=60.0,
+                       pool_timeout=10.0):
+    """Build the pooled HTTP client handed to the OpenAI SDK (``http_client=``)"""
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout, pool=pool_timeout)
+    )
+
+
+def retry_after_seconds(response):
+    """Parse ``retry-after-ms`` / ``Retry-After`` (seconds or HTTP date) from a response, or None"""
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _GatewayStream:
+    """
+    A streamed response that releases its in-flight slot exactly once: when
+    iteration ends, fails, or ``close()`` is called, even before the first chunk.
+    """
+
+    def __init__(self, gateway, response):
+        self._gateway = gateway
+        self._response = response
+        self._iterator = None
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        try:
+            if self._iterator is None:
+                self._iterator = iter(self._response)
+            return next(self._iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        with self._gateway._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._gateway.in_flight -= 1
+        self._response.close()
+
+
+class CompletionGateway:
+    def __init__(self, backend, max_retries=3, backoff_base=0.5, backoff_max=20.0, max_retry_after=60.0,
+                 connect_timeout=5.0, read_timeout=60.0, stream_timeout=30.0, pool_timeout=10.0):
+        """
+        Args:
+            backend: A completion backend (``backend.create`` takes chat completion arguments), or None
+            max_retries (int): Retries after the first attempt
+            backoff_base (float): Base delay in seconds, doubled per attempt
+            backoff_max (float): Upper bound of the backoff delay
+            max_retry_after (float): Give up instead of waiting when the server asks for a longer pause
+            connect_timeout (float): Seconds to establish a connection
+            read_timeout (float): Seconds to wait for a complete non-streamed response
+            stream_timeout (float): Seconds to wait between chunks of a streamed response
+            pool_timeout (float): Seconds to wait for a free pooled connection
+        """
+        self.backend = backend
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout, pool=pool_timeout)
+        self.stream_timeout = httpx.Timeout(stream_timeout, connect=connect_timeout, pool=pool_timeout)
+        self._lock = threading.Lock()
+        self._header_ms = deque(maxlen=LATENCY_SAMPLES)
+        self.in_flight = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    @property
+    def model(self):
+        return self.backend.model if self.backend is not None else None
+
+    def _retry_delay(self, error, attempt):
+        """Seconds to wait before retrying ``error``, or None if it should not be retried"""
+        retry_after = None
+        if isinstance(error, openai.APIStatusError):
+            if error.status_code not in RETRYABLE_STATUS and error.status_code < 500:
+                return None
+            retry_after = retry_after_seconds(error.response)
+        elif not isinstance(error, openai.APIConnectionError):
+            return None
+
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            # A little jitter on top so throttled workers don't retry in lockstep
+            return retry_after + random.uniform(0, self.backoff_base)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def create(self, **kwargs):
+        """
+        Call ``chat.completions.create`` with timeouts and retries.
+
+        Only opening the call is retried; once a stream has started, errors
+        propagate to the caller. Streams are returned wrapped so the in-flight
+        count and the connection are released when iteration ends.
+        """
+        stream = kwargs.get('stream', False)
+        kwargs.setdefault('timeout', self.stream_timeout if stream else self.timeout)
+
+        with self._lock:
+            self.in_flight += 1
+            self.requests += 1
+        started = time.monotonic()
+        try:
+            attempt = 0
+            while True:
+                try:
+                    response = self.backend.create(**kwargs)
+                    break
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt) if attempt < self.max_retries else None
+                    if delay is None:
+                        raise
+                    attempt += 1
+                    with self._lock:
+                        self.retries += 1
+                    logger.warning(f"Completion call failed ({type(e).__name__}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                    time.sleep(delay)
+        except Exception:
+            with self._lock:
+                self.in_flight -= 1
+                self.failures += 1
+            raise
+
+        with self._lock:
+            self._header_ms.append((time.monotonic() - started) * 1000)
+        if stream:
+            return _GatewayStream(self, response)
+        with self._lock:
+            self.in_flight -= 1
+        return response
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._header_ms)
+            return {
+                'enabled': self.enabled,
+                'backend': self.backend.name if self.backend is not None else None,
+                'in_flight': self.in_flight,
+                'requests': self.requests,
+                'retries': self.retries,
+                'failures': self.failures,
+                'time_to_headers_ms': {
+                    'p50': round(latencies[len(latencies) // 2], 2) if latencies else None,
+                    'p99': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 2) if latencies else None,
+                    'samples': len(latencies)
+                }
+            }
@@ -0,0 +1,120 @@
+"""
+Token-budgeted context window assembly.
+
+Instead of replaying a conversation's full history on every turn, the prompt
+is built from the system message, the latest user message and as many of the
+most recent turns as fit in a configurable token budget. Tokens are counted
+locally with tiktoken when it is installed, falling back to a character-based
+estimate otherwise.
+"""
+import logging
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - optional dependency
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENCODING = 'o200k_base'  # gpt-4o family
+
+# Per-message framing overhead of the chat format, and the tokens priming the reply
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# Used when tiktoken is not available
+CHARS_PER_TOKEN = 4
+
+
+class TokenCounter:
+    def __init__(self, encoding_name=DEFAULT_ENCODING):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                logger.warning(f"Could not load tokenizer '{encoding_name}', estimating tokens from length: {str(e)}")
+        else:
+            logger.warning("tiktoken is not installed, estimating tokens from length")
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return -(-len(text) // CHARS_PER_TOKEN)
+
+    def count_message(self, message):
+        return TOKENS_PER_MESSAGE + self.count(message.get('role')) + self.count(message.get('content'))
+
+    def truncate(self, text, max_tokens):
+        """Cut text down to at most ``max_tokens`` tokens"""
+        if max_tokens <= 0:
+            return ''
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            return text if len(tokens) <= max_tokens else self.encoding.decode(tokens[:max_tokens])
+        return text[:max_tokens * CHARS_PER_TOKEN]
+
+
+class ContextWindowBuilder:
+    def __init__(self, budget, counter=None):
+        self.budget = budget
+        self.counter = counter or TokenCounter()
+
+    def build(self, system_message, recent_history, latest_message, summary=None):
+        """
+        Assemble the prompt for one completion.
+
+        The system prompt and the latest user message are always included.
+        History is walked newest first and added until the next turn would go
+        over budget; that turn and everything older drops out, so the same
+        history and budget always produce the same window.
+
+        Args:
+            system_message (str): The system prompt
+            recent_history (iterable): Chat-format messages, newest first; consumed lazily
+            latest_message (str): The user message being answered
+            summary (str): Running summary of the turns older than ``recent_history``
+
+        Returns:
+            dict: ``messages`` in chat order, their ``token_count`` and how many history turns were ``included``
+        """
+        system = {"role": "system", "content": system_message}
+        latest = {"role": "user", "content": latest_message}
+
+        used = TOKENS_PER_REPLY + self.counter.count_message(system)
+
+        summary_message = None
+        if summary:
+            summary_message = {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+            used += self.counter.count_message(summary_message)
+        latest_tokens = self.counter.count_message(latest)
+
+        # A single oversized message is cut down rather than failing the API call
+        if used + latest_tokens > self.budget:
+            overhead = TOKENS_PER_MESSAGE + self.counter.count('user')
+            latest['content'] = self.counter.truncate(latest_message, self.budget - used - overhead)
+            latest_tokens = self.counter.count_message(latest)
+            logger.warning(f"Latest message truncated to fit the {self.budget} token context budget")
+        used += latest_tokens
+
+        kept = []
+        for message in recent_history:
+            tokens = self.counter.count_message(message)
+            if used + tokens > self.budget:
+                break
+            kept.append((message, tokens))
+            used += tokens
+
+        kept.reverse()
+        # Don't open the window on an assistant reply whose question was dropped
+        while kept and kept[0][0]['role'] == 'assistant':
+            used -= kept.pop(0)[1]
+
+        preamble = [system, summary_message] if summary_message else [system]
+        return {
+            'messages': preamble + [message for message, _ in kept] + [latest],
+            'token_count': used,
+            'included': len(kept)
+        }
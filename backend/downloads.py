@@ -0,0 +1,82 @@
+"""
+Download responses for stored uploads.
+
+``send_upload`` serves an upload whose ownership the route has already
+checked. Range requests, ``If-Range`` and conditional GETs are answered by
+Werkzeug's ``send_file``, with the content hash as a strong ETag so a
+re-download of an unchanged file is a 304 and a dropped connection resumes
+where it stopped. Whole-file responses go through the server's
+``wsgi.file_wrapper``; gunicorn implements it with ``sendfile``, so the bytes
+never pass through Python.
+
+With an offload mode the app only sends headers and the fronting proxy
+streams the file (and handles ranges) itself:
+
+- ``x-accel``: nginx ``X-Accel-Redirect`` to an ``internal`` location that
+  aliases the upload folder, e.g. ``location /protected-uploads/ { internal;
+  alias /app/uploads/; }``
+- ``x-sendfile``: Apache mod_xsendfile / lighttpd ``X-Sendfile`` with the
+  absolute path
+"""
+import os
+from urllib.parse import quote
+
+from flask import Response, request, send_file
+
+OFFLOAD_MODES = ('x-accel', 'x-sendfile')
+CACHE_CONTROL = 'private, no-cache'
+
+
+def _disposition(name):
+    """Inline Content-Disposition with an RFC 5987 encoded name"""
+    ascii_name = name.encode('ascii', 'ignore').decode().replace('"', '') or 'download'
+    return f"inline; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(name)}"
+
+
+def send_upload(path, name, mimetype=None, content_hash=None, upload_root=None, offload=None,
+                accel_prefix='/protected-uploads/'):
+    """
+    Build the download response for one stored file.
+
+    Args:
+        path (str): Location of the file on disk
+        name (str): File name shown to the user
+        mimetype (str): Content type recorded at upload time
+        content_hash (str): SHA-256 of the content, used as the ETag when known
+        upload_root (str): Upload folder, which ``accel_prefix`` maps to in the proxy
+        offload (str): None to send the file from the app, or one of ``OFFLOAD_MODES``
+        accel_prefix (str): Internal nginx location for ``x-accel``
+
+    Returns:
+        Response: The download (200, 206, 304 or 416)
+    """
+    path = os.path.abspath(path)
+    mimetype = mimetype or 'application/octet-stream'
+
+    if offload in OFFLOAD_MODES:
+        response = Response(mimetype=mimetype)
+        if content_hash:
+            response.set_etag(content_hash)
+            if request.if_none_match.contains_weak(content_hash):
+                response.status_code = 304
+                response.headers['Cache-Control'] = CACHE_CONTROL
+                return response
+        if offload == 'x-accel':
+            relative = os.path.relpath(path, os.path.abspath(upload_root)).replace(os.sep, '/')
+            response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + quote(relative)
+        else:
+            response.headers['X-Sendfile'] = path
+        response.headers['Content-Disposition'] = _disposition(name)
+    else:
+        response = send_file(
+            path,
+            mimetype=mimetype,
+            download_name=name,
+            conditional=True,
+            etag=content_hash or True
+        )
+
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    # Uploaded HTML/SVG must not be sniffed into something the browser executes
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
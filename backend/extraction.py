@@ -0,0 +1,222 @@
+"""
+Background text extraction for office documents and PDFs.
+
+PDF, DOCX, XLSX and PPTX uploads are converted to text off the request path.
+Each job runs in its own child process (at most ``max_workers`` at a time)
+with an address-space cap and a wall-clock timeout, so one huge spreadsheet
+can neither stall a request worker nor take the server's memory with it.
+Results and job status are written to the extracted-text cache, where the
+prompt builders pick them up once they are ready, and large texts are chunked
+into the retrieval index as soon as they are available.
+"""
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from backend.text_cache import MAX_STORED_CHARS, STATUS_DONE, STATUS_PENDING
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_KINDS = {
+    '.pdf': 'pdf',
+    '.docx': 'docx',
+    '.xlsx': 'xlsx',
+    '.pptx': 'pptx'
+}
+
+STATUS_FAILED = 'failed'
+STATUS_TIMEOUT = 'timeout'
+
+
+def document_kind(name):
+    """Return the extractor kind for a file name, or None if it is not a supported document"""
+    return DOCUMENT_KINDS.get(os.path.splitext(name.lower())[1])
+
+
+def _extract_pdf(path):
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    return "\n\n".join(page.extract_text() or '' for page in reader.pages)
+
+
+def _extract_docx(path):
+    import docx
+    document = docx.Document(path)
+    parts = [paragraph.text for paragraph in document.paragraphs]
+    for table in document.tables:
+        for row in table.rows:
+            parts.append("\t".join(cell.text for cell in row.cells))
+    return "\n".join(parts)
+
+
+def _extract_xlsx(path):
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    parts = []
+    size = 0
+    for sheet in workbook.worksheets:
+        parts.append(f"# Sheet: {sheet.title}")
+        for row in sheet.iter_rows(values_only=True):
+            line = ",".join('' if value is None else str(value) for value in row)
+            parts.append(line)
+            size += len(line) + 1
+            if size > MAX_STORED_CHARS:
+                return "\n".join(parts)
+    return "\n".join(parts)
+
+
+def _extract_pptx(path):
+    from pptx import Presentation
+    presentation = Presentation(path)
+    parts = []
+    for number, slide in enumerate(presentation.slides, start=1):
+        parts.append(f"# Slide {number}")
+        for shape in slide.shapes:
+            if shape.has_text_frame:
+                parts.append(shape.text_frame.text)
+    return "\n".join(parts)
+
+
+EXTRACTORS = {
+    'pdf': _extract_pdf,
+    'docx': _extract_docx,
+    'xlsx': _extract_xlsx,
+    'pptx': _extract_pptx
+}
+
+
+def _extract_in_child(conn, path, kind, memory_limit_bytes):
+    """Child process entry point: extract one document and send (status, text, error) back"""
+    try:
+        if resource is not None and memory_limit_bytes:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit_bytes, memory_limit_bytes))
+        text = EXTRACTORS[kind](path)
+        conn.send((STATUS_DONE, text[:MAX_STORED_CHARS], None))
+    except MemoryError:
+        conn.send((STATUS_FAILED, None, 'memory limit exceeded'))
+    except Exception as e:
+        conn.send((STATUS_FAILED, None, f"{type(e).__name__}: {str(e)}"))
+    finally:
+        conn.close()
+
+
+class ExtractionService:
+    def __init__(self, text_cache, retriever=None, index_min_chars=10000, max_workers=2, timeout=60, memory_limit_mb=512):
+        self.text_cache = text_cache
+        self.retriever = retriever
+        self.index_min_chars = index_min_chars
+        self.timeout = timeout
+        self.memory_limit_bytes = memory_limit_mb * 1024 * 1024
+        # Threads only wait on the child processes, which do the actual work
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='extraction')
+        self._context = multiprocessing.get_context('spawn')
+
+    def process_upload(self, path, name, content_type, content_hash):
+        """
+        Make an upload's text available to the prompt builders.
+
+        Plain text files are extracted inline; documents are queued for the
+        worker pool and marked pending until their job finishes.
+
+        Returns:
+            str: The content hash of the file
+        """
+        kind = document_kind(name)
+        if kind is None:
+            content_hash = self.text_cache.extract_and_store(path, name, content_type, content_hash=content_hash)
+            entry = self.text_cache.get(content_hash)
+            self._index(content_hash, entry['text'] if entry else None)
+            return content_hash
+
+        if self.text_cache.mark_pending(content_hash, name, path):
+            self._submit(content_hash, path, kind)
+        return content_hash
+
+    def _submit(self, content_hash, path, kind):
+        logger.info(f"Queued {kind} extraction for {content_hash[:12]}")
+        return self._executor.submit(self._run, content_hash, path, kind)
+
+    def _run(self, content_hash, path, kind):
+        started = datetime.now()
+        parent_conn, child_conn = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_extract_in_child,
+            args=(child_conn, path, kind, self.memory_limit_bytes),
+            daemon=True
+        )
+
+        started_process = False
+        try:
+            process.start()
+            started_process = True
+            child_conn.close()
+
+            if parent_conn.poll(self.timeout):
+                status, text, error = parent_conn.recv()
+            else:
+                status, text, error = STATUS_TIMEOUT, None, f"extraction took longer than {self.timeout}s"
+        except EOFError:
+            # The child died without reporting, e.g. killed for exceeding the memory cap
+            status, text, error = STATUS_FAILED, None, None
+        except Exception as e:
+            status, text, error = STATUS_FAILED, None, str(e)
+        finally:
+            # is_alive/join raise on a process that never started
+            if started_process:
+                if process.is_alive():
+                    process.kill()
+                process.join(1)
+            else:
+                child_conn.close()
+            parent_conn.close()
+
+        if status == STATUS_FAILED and error is None:
+            error = f"extraction process exited with code {process.exitcode}"
+
+        self.text_cache.put(content_hash, text, status=status, error=error)
+        self._index(content_hash, text)
+        elapsed = (datetime.now() - started).total_seconds()
+        if status == STATUS_DONE:
+            logger.info(f"Extracted {len(text)} chars from {kind} {content_hash[:12]} in {elapsed:.1f}s")
+        else:
+            logger.warning(f"Extraction of {kind} {content_hash[:12]} {status} after {elapsed:.1f}s: {error}")
+        return status
+
+    def _index(self, content_hash, text):
+        """Chunk large texts into the retrieval index; small ones are sent whole"""
+        if self.retriever is None or not text or len(text) <= self.index_min_chars:
+            return
+        try:
+            self.retriever.index(content_hash, text)
+        except Exception as e:
+            logger.error(f"Error indexing {content_hash[:12]}: {str(e)}")
+
+    def lookup_file(self, file_info):
+        """
+        Return the extracted-text entry for a message's file info.
+
+        Jobs left pending by a worker that went away are queued again once
+        they are older than twice the job timeout. Documents cached without
+        text before they were routed here are queued for extraction.
+        """
+        entry = self.text_cache.lookup_file(file_info)
+        if entry and entry.get('status') == STATUS_DONE and entry.get('text') is None:
+            name = entry.get('name') or file_info.get('name', '')
+            path = entry.get('path') or file_info.get('path', '')
+            kind = document_kind(name)
+            if kind and path and self.text_cache.mark_pending(entry['content_hash'], name, path):
+                self._submit(entry['content_hash'], path, kind)
+                entry = dict(entry, status=STATUS_PENDING)
+        elif entry and entry.get('status') == STATUS_PENDING:
+            stale_before = datetime.now() - timedelta(seconds=self.timeout * 2)
+            kind = document_kind(entry.get('name') or file_info.get('name', ''))
+            if kind and self.text_cache.requeue_if_stale(entry['content_hash'], stale_before):
+                self._submit(entry['content_hash'], entry.get('path') or file_info.get('path', ''), kind)
+        return entry
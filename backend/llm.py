@@ -0,0 +1,156 @@
+"""
+Pluggable chat completion backends.
+
+Every completion goes through ``CompletionGateway``, which calls
+``backend.create(**kwargs)`` with chat completion arguments. The backend
+fills in its own model, and the result is shaped like the OpenAI SDK's:
+``choices[0].message`` / ``usage`` for regular calls, and an iterable of
+``choices[0].delta`` chunks with ``close()`` for streams.
+
+- ``azure``: Azure OpenAI deployment (default)
+- ``openai``: any OpenAI-compatible HTTP server (vLLM, Ollama, a proxy, or
+  ``benchmarks.fake_completion_server`` at ``<endpoint>/v1``)
+- ``fake``: in-process deterministic generator with configurable TTFT,
+  inter-token delay and error rates, for benchmarking throughput and tail
+  latency offline without spending quota
+"""
+import hashlib
+import random
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+FAKE_WORDS = ("the assistant reviewed your question and here is a concise answer covering the main points "
+              "with a few practical next steps for the team to consider").split()
+FAKE_REQUEST = httpx.Request('POST', 'http://fake-llm.invalid/v1/chat/completions')
+
+
+class AzureBackend:
+    name = 'azure'
+
+    def __init__(self, endpoint, api_key, deployment, api_version="2024-12-01-preview", http_client=None):
+        # Retries are handled by the completion gateway
+        self.client = openai.AzureOpenAI(
+            api_key=api_key,
+            api_version=api_version,
+            azure_endpoint=endpoint,
+            max_retries=0,
+            http_client=http_client
+        )
+        self.model = deployment
+
+    def create(self, **kwargs):
+        kwargs.setdefault('model', self.model)
+        return self.client.chat.completions.create(**kwargs)
+
+
+class OpenAICompatibleBackend:
+    name = 'openai'
+
+    def __init__(self, base_url, model, api_key=None, http_client=None):
+        self.client = openai.OpenAI(
+            base_url=base_url,
+            # Local servers usually ignore the key, but the SDK requires one
+            api_key=api_key or 'not-needed',
+            max_retries=0,
+            http_client=http_client
+        )
+        self.model = model
+
+    def create(self, **kwargs):
+        kwargs.setdefault('model', self.model)
+        return self.client.chat.completions.create(**kwargs)
+
+
+class FakeBackend:
+    """Deterministic local stand-in for the completion API"""
+    name = 'fake'
+
+    def __init__(self, ttft_ms=300, token_delay_ms=30, tokens=100, error_rate=0.0, rate_limit_rate=0.0,
+                 stream_error_rate=0.0, seed=0, model='fake-model'):
+        """
+        Args:
+            ttft_ms (float): Delay before the first token (the whole response without streaming)
+            token_delay_ms (float): Delay between streamed tokens
+            tokens (int): Number of tokens per response
+            error_rate (float): Fraction of calls failing with a 500 before any token
+            rate_limit_rate (float): Fraction of calls rejected with a 429 and ``Retry-After: 1``
+            stream_error_rate (float): Fraction of streams that break off halfway
+            seed (int): Seed for the error injection, so runs are reproducible
+            model (str): Model name reported in responses
+        """
+        self.ttft = ttft_ms / 1000
+        self.token_delay = token_delay_ms / 1000
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.stream_error_rate = stream_error_rate
+        self.model = model
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _roll(self):
+        with self._lock:
+            return self._random.random()
+
+    def _reply_tokens(self, messages):
+        # The same prompt always yields the same reply
+        prompt = messages[-1]['content'] if messages else ''
+        offset = int(hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8], 16)
+        return [FAKE_WORDS[(offset + i) % len(FAKE_WORDS)] + ' ' for i in range(self.tokens)]
+
+    def _usage(self, messages, completion_tokens):
+        prompt_tokens = sum(len(message['content']) for message in messages) // 4
+        return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                               total_tokens=prompt_tokens + completion_tokens)
+
+    def _inject_errors(self):
+        roll = self._roll()
+        if roll < self.rate_limit_rate:
+            raise openai.RateLimitError(
+                "fake backend rate limit",
+                response=httpx.Response(429, headers={'retry-after': '1'}, request=FAKE_REQUEST),
+                body=None
+            )
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise openai.InternalServerError(
+                "fake backend error",
+                response=httpx.Response(500, request=FAKE_REQUEST),
+                body=None
+            )
+
+    def create(self, messages, stream=False, model=None, **kwargs):
+        self._inject_errors()
+        tokens = self._reply_tokens(messages)
+        completion_id = f"fake-{uuid.uuid4().hex[:12]}"
+        if stream:
+            return self._stream(completion_id, tokens, break_off=self._roll() < self.stream_error_rate)
+
+        time.sleep(self.ttft + self.token_delay * max(0, len(tokens) - 1))
+        return SimpleNamespace(
+            id=completion_id,
+            model=self.model,
+            choices=[SimpleNamespace(message=SimpleNamespace(role='assistant', content=''.join(tokens)),
+                                     finish_reason='stop')],
+            usage=self._usage(messages, len(tokens))
+        )
+
+    def _stream(self, completion_id, tokens, break_off=False):
+        time.sleep(self.ttft)
+        for position, token in enumerate(tokens):
+            if position:
+                time.sleep(self.token_delay)
+            if break_off and position == len(tokens) // 2:
+                raise openai.APIConnectionError(message="fake backend stream interrupted", request=FAKE_REQUEST)
+            yield SimpleNamespace(
+                id=completion_id,
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=token), finish_reason=None)]
+            )
+        yield SimpleNamespace(
+            id=completion_id,
+            choices=[SimpleNamespace(delta=SimpleNamespace(content=None), finish_reason='stop')]
+        )
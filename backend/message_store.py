@@ -0,0 +1,247 @@
+"""
+Message storage for conversations.
+
+Messages live in their own ``messages`` collection, one document per message,
+keyed by ``(conversation_id, seq)``. The parent conversation document only
+keeps a ``message_count`` counter that is used to hand out sequence numbers,
+so conversations no longer grow toward the 16 MB BSON limit and reads can
+page through history instead of loading all of it.
+"""
+import logging
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+PREVIEW_LENGTH = 50
+
+# ``status`` of an assistant reply that is still being generated, or that stopped before it finished
+STATUS_STREAMING = 'streaming'
+STATUS_INTERRUPTED = 'interrupted'
+INTERRUPTED_NOTE = "[This reply was cut off before it finished.]"
+
+
+def make_preview(text):
+    """Build the sidebar preview for a conversation from its first message"""
+    text = text or 'New conversation'
+    return text[:PREVIEW_LENGTH] + ('...' if len(text) > PREVIEW_LENGTH else '')
+
+
+def prompt_text(message):
+    """
+    Text a stored message contributes to prompts and summaries.
+
+    A reply that is still streaming contributes nothing yet. An interrupted
+    reply was seen by the user, so its partial text is kept, marked as cut off.
+
+    Returns:
+        str: The text, or None if the message should be left out
+    """
+    status = message.get('status')
+    text = message.get('text') or ''
+    if status == STATUS_STREAMING:
+        return None
+    if status == STATUS_INTERRUPTED:
+        return f"{text}\n\n{INTERRUPTED_NOTE}" if text else None
+    return text
+
+
+def _stale_cutoffs(max_age):
+    # checkpoint_at is local time; a reply's timestamp is a UTC ISO string
+    return (datetime.now() - timedelta(seconds=max_age),
+            (datetime.utcnow() - timedelta(seconds=max_age)).isoformat())
+
+
+def is_stale_reply(message, max_age):
+    """
+    Whether a reply is still marked streaming although its generation has stopped writing to it.
+
+    A live generation checkpoints its text every few seconds; a reply that was last
+    checkpointed (or, never checkpointed, created) more than ``max_age`` seconds ago
+    belongs to a worker that died before it could finalize it.
+    """
+    if message.get('status') != STATUS_STREAMING:
+        return False
+    checkpointed_before, created_before = _stale_cutoffs(max_age)
+    if message.get('checkpoint_at'):
+        return message['checkpoint_at'] < checkpointed_before
+    return bool(message.get('timestamp')) and message['timestamp'] < created_before
+
+
+def serialize_message(doc):
+    """Strip storage-only fields so a message document can be sent to the client"""
+    message = dict(doc)
+    message.pop('_id', None)
+    message.pop('conversation_id', None)
+    return message
+
+
+class MessageStore:
+    def __init__(self, db):
+        self.db = db
+
+    def append(self, conversation_filter, messages, extra_set=None):
+        """
+        Append messages to a conversation.
+
+        Sequence numbers are reserved with a single atomic ``$inc`` on the
+        conversation, which doubles as the ownership check: if
+        ``conversation_filter`` matches nothing, nothing is written.
+
+        Args:
+            conversation_filter (dict): Filter identifying the conversation (should include user_id)
+            messages (list): Message dicts to store, in order
+            extra_set (dict): Additional fields to ``$set`` on the conversation
+
+        Returns:
+            list: The stored messages with their ``seq``, or None if the conversation was not found
+        """
+        count = len(messages)
+        update = {"$inc": {"message_count": count}}
+        if extra_set:
+            update["$set"] = extra_set
+
+        conversation = self.db.conversations.find_one_and_update(
+            conversation_filter,
+            update,
+            projection={"message_count": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if conversation is None:
+            return None
+
+        first_seq = conversation['message_count'] - count
+        docs = []
+        for offset, message in enumerate(messages):
+            doc = dict(message)
+            doc['conversation_id'] = conversation['_id']
+            doc['seq'] = first_seq + offset
+            docs.append(doc)
+
+        if docs:
+            self.db.messages.insert_many(docs, ordered=True)
+
+        # The sidebar preview is the first message of the conversation
+        if first_seq == 0 and docs:
+            self.db.conversations.update_one(
+                {"_id": conversation['_id']},
+                {"$set": {"preview": make_preview(docs[0].get('text'))}}
+            )
+
+        return [serialize_message(doc) for doc in docs]
+
+    def page(self, conversation_id, limit=DEFAULT_PAGE_SIZE, before=None):
+        """
+        Return a window of the most recent messages, oldest first.
+
+        Args:
+            conversation_id (ObjectId): The conversation to read
+            limit (int): Maximum number of messages to return; None returns every message before the cursor
+            before (int): Only return messages with a seq lower than this cursor
+
+        Returns:
+            dict: ``messages``, ``has_more`` and the ``before`` cursor for the next older page
+        """
+        if limit is not None:
+            limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        query = {"conversation_id": conversation_id}
+        if before is not None:
+            query["seq"] = {"$lt": int(before)}
+
+        docs = list(
+            self.db.messages.find(query)
+            .sort("seq", DESCENDING)
+            .limit(limit + 1 if limit else 0)
+        )
+        has_more = limit is not None and len(docs) > limit
+        docs = docs[:limit]
+        docs.reverse()
+
+        return {
+            'messages': [serialize_message(doc) for doc in docs],
+            'has_more': has_more,
+            'before': docs[0]['seq'] if has_more and docs else None
+        }
+
+    def since(self, conversation_id, since_seq, limit=MAX_PAGE_SIZE):
+        """
+        Return the messages added after ``since_seq``, oldest first.
+
+        Lets a client that already holds a conversation catch up on new
+        messages instead of downloading the whole window again.
+
+        Returns:
+            dict: ``messages``, ``has_more`` (more remain after this batch) and ``seq``,
+            the seq of the last message returned (``since_seq`` if there was nothing new)
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        docs = list(
+            self.db.messages.find({"conversation_id": conversation_id, "seq": {"$gt": int(since_seq)}})
+            .sort("seq", ASCENDING)
+            .limit(limit + 1)
+        )
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+
+        return {
+            'messages': [serialize_message(doc) for doc in docs],
+            'has_more': has_more,
+            'seq': docs[-1]['seq'] if docs else int(since_seq)
+        }
+
+    def iter_recent(self, conversation_id, after=None, batch_size=DEFAULT_PAGE_SIZE):
+        """
+        Iterate over a conversation's messages newest first.
+
+        Messages are fetched lazily in batches, so a consumer that stops early
+        (e.g. once a token budget is spent) never loads the older history.
+        ``after`` stops the iteration at messages with a seq greater than it,
+        e.g. the last seq already covered by the conversation summary.
+        """
+        before = None
+        while True:
+            query = {"conversation_id": conversation_id}
+            if before is not None or after is not None:
+                query["seq"] = {}
+                if before is not None:
+                    query["seq"]["$lt"] = before
+                if after is not None:
+                    query["seq"]["$gt"] = after
+            docs = list(self.db.messages.find(query).sort("seq", DESCENDING).limit(batch_size))
+            for doc in docs:
+                yield serialize_message(doc)
+            if len(docs) < batch_size:
+                return
+            before = docs[-1]['seq']
+
+    def interrupt_stale(self, max_age, error='generation lost'):
+        """
+        Mark replies left streaming by a dead worker as interrupted (see ``is_stale_reply``).
+
+        Args:
+            max_age (float): Seconds without a checkpoint after which a streaming reply is stale
+            error (str): Stored on the interrupted replies
+
+        Returns:
+            int: Number of replies marked
+        """
+        checkpointed_before, created_before = _stale_cutoffs(max_age)
+        result = self.db.messages.update_many(
+            {"status": STATUS_STREAMING, "$or": [
+                {"checkpoint_at": {"$lt": checkpointed_before}},
+                {"checkpoint_at": {"$exists": False}, "timestamp": {"$lt": created_before}}
+            ]},
+            {"$set": {"status": STATUS_INTERRUPTED, "error": error}, "$unset": {"checkpoint_at": ""}}
+        )
+        return result.modified_count
+
+    def upload_ids(self, conversation_id):
+        """Return the IDs of uploads attached to messages in a conversation"""
+        return self.db.messages.distinct("file.upload_id", {"conversation_id": conversation_id})
+
+    def delete(self, conversation_id):
+        """Delete all messages belonging to a conversation"""
+        return self.db.messages.delete_many({"conversation_id": conversation_id}).deleted_count
@@ -0,0 +1,141 @@
+"""
+Prometheus metrics for the API.
+
+Every Flask route is timed by ``instrument_app`` (one histogram observation
+per request, labelled by URL rule rather than raw path so cardinality stays
+bounded). Mongo commands are timed by a pymongo command listener, completion
+timings come from the telemetry hook, response cache hits are counted with
+the tokens they saved, and SSE responses are counted while they are open.
+
+With several gunicorn workers, ``PROMETHEUS_MULTIPROC_DIR`` must point to an
+empty directory before the app is imported (``gunicorn.conf.py`` takes care
+of this). Each worker then writes its samples to memory-mapped files there,
+and ``/metrics`` aggregates them across workers on scrape.
+"""
+import os
+import time
+
+from flask import g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+                               generate_latest, multiprocess)
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+TOKEN_RATE_BUCKETS = (5, 10, 20, 40, 60, 80, 100, 150, 200, 400)
+SIZE_BUCKETS = (1024, 16 * 1024, 128 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time to produce the response (headers for streams)',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS
+)
+MONGO_COMMAND_DURATION = Histogram(
+    'mongo_command_duration_seconds', 'MongoDB command round trips',
+    ['command', 'outcome'], buckets=MONGO_BUCKETS
+)
+COMPLETION_TTFT = Histogram(
+    'completion_ttft_seconds', 'Time to the first token of a completion',
+    ['route', 'source'], buckets=LATENCY_BUCKETS
+)
+COMPLETION_DURATION = Histogram(
+    'completion_duration_seconds', 'Time to the last token of a completion',
+    ['route', 'source'], buckets=LATENCY_BUCKETS
+)
+COMPLETION_TOKEN_RATE = Histogram(
+    'completion_tokens_per_second', 'Completion tokens streamed per second after the first token',
+    ['route'], buckets=TOKEN_RATE_BUCKETS
+)
+COMPLETION_ERRORS = Counter('completion_errors_total', 'Completions that failed or were abandoned', ['route'])
+SSE_STREAMS = Gauge(
+    'sse_streams_open', 'Server-sent event responses currently streaming',
+    ['route'], multiprocess_mode='livesum'
+)
+RESPONSE_CACHE_HITS = Counter('response_cache_hits_total', 'Completions answered from the response cache', ['route'])
+RESPONSE_CACHE_TOKENS_SAVED = Counter(
+    'response_cache_tokens_saved_total', 'Prompt and completion tokens cache hits did not send to the API', ['route']
+)
+RESPONSE_CACHE_HIT_LATENCY = Histogram(
+    'response_cache_hit_duration_seconds', 'End-to-end time of requests answered from the response cache',
+    ['route'], buckets=LATENCY_BUCKETS
+)
+UPLOAD_BYTES = Counter('upload_bytes_total', 'Bytes received in file uploads')
+UPLOAD_SIZE = Histogram('upload_size_bytes', 'Size of uploaded files', buckets=SIZE_BUCKETS)
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """pymongo listener observing the duration of every command"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND_DURATION.labels(event.command_name, 'ok').observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        MONGO_COMMAND_DURATION.labels(event.command_name, 'error').observe(event.duration_micros / 1e6)
+
+
+def instrument_app(app):
+    """Time every request with before/after hooks"""
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            REQUEST_LATENCY.labels(request.method, route, str(response.status_code)).observe(time.perf_counter() - started)
+        return response
+
+
+def observe_completion(route, latency_ms, ttft_ms, completion_tokens, cached=False, coalesced=False, error=None):
+    """Record the timings of one completion (called from the telemetry hook)"""
+    if error:
+        COMPLETION_ERRORS.labels(route).inc()
+        return
+    source = 'cache' if cached else ('coalesced' if coalesced else 'api')
+    COMPLETION_TTFT.labels(route, source).observe(ttft_ms / 1000)
+    COMPLETION_DURATION.labels(route, source).observe(latency_ms / 1000)
+    generating_seconds = (latency_ms - ttft_ms) / 1000
+    if source == 'api' and completion_tokens and generating_seconds > 0:
+        COMPLETION_TOKEN_RATE.labels(route).observe(completion_tokens / generating_seconds)
+
+
+def observe_cache_hit(route, tokens, latency_ms):
+    """Record a completion answered from the response cache and the tokens it saved"""
+    RESPONSE_CACHE_HITS.labels(route).inc()
+    RESPONSE_CACHE_TOKENS_SAVED.labels(route).inc(tokens)
+    RESPONSE_CACHE_HIT_LATENCY.labels(route).observe(latency_ms / 1000)
+
+
+def observe_upload(size):
+    UPLOAD_BYTES.inc(size)
+    UPLOAD_SIZE.observe(size)
+
+
+def track_stream(route, stream):
+    """Wrap an SSE generator so it counts as open while it is being consumed"""
+    gauge = SSE_STREAMS.labels(route)
+    gauge.inc()
+    try:
+        yield from stream
+    finally:
+        gauge.dec()
+
+
+def render_metrics():
+    """
+    Render all metrics in the Prometheus text format.
+
+    Returns:
+        tuple: (body, content type)
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
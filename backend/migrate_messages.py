@@ -0,0 +1,90 @@
+"""
+One-shot migration from embedded ``conversations.messages`` arrays to the
+``messages`` collection.
+
+Usage:
+    python -m backend.migrate_messages [--dry-run]
+
+The migration is idempotent: messages are upserted on ``(conversation_id, seq)``
+and the embedded array is only removed once its messages have been written,
+so an interrupted run can simply be started again. Conversations that already
+received messages through the new storage layer before being migrated keep
+those messages; the legacy ones are placed before them with negative seqs.
+"""
+import argparse
+import logging
+import os
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+from backend.message_store import make_preview
+from backend.schema import backfill_listing_fields, ensure_indexes
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def migrate_conversation(db, conversation, dry_run=False):
+    """Move the embedded messages of one conversation. Returns the number of messages moved."""
+    legacy_messages = conversation.get('messages') or []
+    message_count = conversation.get('message_count', 0)
+
+    # Legacy messages always precede anything written by the new code
+    first_seq = 0 if message_count == 0 else -len(legacy_messages)
+
+    operations = []
+    for offset, message in enumerate(legacy_messages):
+        doc = dict(message)
+        doc['conversation_id'] = conversation['_id']
+        doc['seq'] = first_seq + offset
+        operations.append(UpdateOne(
+            {"conversation_id": conversation['_id'], "seq": doc['seq']},
+            {"$setOnInsert": doc},
+            upsert=True
+        ))
+
+    if dry_run:
+        return len(operations)
+
+    if operations:
+        db.messages.bulk_write(operations, ordered=False)
+
+    update = {"$unset": {"messages": ""}}
+    if message_count == 0:
+        update["$set"] = {"message_count": len(legacy_messages)}
+    if legacy_messages and not conversation.get('preview'):
+        update.setdefault("$set", {})["preview"] = make_preview(legacy_messages[0].get('text'))
+
+    db.conversations.update_one({"_id": conversation['_id']}, update)
+    return len(operations)
+
+
+def migrate(db, dry_run=False):
+    ensure_indexes(db)
+
+    conversations = db.conversations.find({"messages": {"$exists": True}})
+    migrated_conversations = 0
+    migrated_messages = 0
+
+    for conversation in conversations:
+        moved = migrate_conversation(db, conversation, dry_run=dry_run)
+        migrated_conversations += 1
+        migrated_messages += moved
+        logger.info(f"{'Would migrate' if dry_run else 'Migrated'} {moved} messages for conversation {conversation['_id']}")
+
+    if not dry_run:
+        backfill_listing_fields(db)
+
+    logger.info(f"Done: {migrated_messages} messages across {migrated_conversations} conversations")
+    return migrated_conversations, migrated_messages
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Move embedded conversation messages into the messages collection")
+    parser.add_argument('--dry-run', action='store_true', help="Only report what would be migrated")
+    args = parser.parse_args()
+
+    mongo_client = MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017/sumersault"))
+    migrate(mongo_client.get_default_database(), dry_run=args.dry_run)
@@ -0,0 +1,57 @@
+"""
+Opaque keyset cursors for paginated listings.
+
+A cursor carries the sort key of the last item on a page; the next page is
+the items strictly after it in sort order. Unlike skip/offset paging, this
+stays an index range scan no matter how deep the client pages.
+"""
+import base64
+import json
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+
+def encode_cursor(pinned, updated_at, conversation_id):
+    payload = {
+        'p': bool(pinned),
+        'u': updated_at.isoformat() if updated_at else None,
+        'i': str(conversation_id)
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by ``encode_cursor``.
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        updated_at = datetime.fromisoformat(payload['u']) if payload['u'] else None
+        return bool(payload['p']), updated_at, ObjectId(payload['i'])
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {str(e)}")
+
+
+def conversations_after(cursor):
+    """
+    Build the filter selecting conversations after a cursor in the sidebar order
+    (pinned first, then most recently updated, ``_id`` as the tie-breaker).
+    """
+    pinned, updated_at, conversation_id = decode_cursor(cursor)
+    later_in_segment = {"$or": [
+        {"updated_at": {"$lt": updated_at}},
+        {"updated_at": updated_at, "_id": {"$lt": conversation_id}}
+    ]}
+
+    if pinned:
+        # Remaining pinned conversations, then every unpinned one
+        return {"$or": [
+            {"pinned": True, **later_in_segment},
+            {"pinned": {"$ne": True}}
+        ]}
+    return {"pinned": {"$ne": True}, **later_in_segment}
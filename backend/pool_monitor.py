@@ -0,0 +1,103 @@
+"""
+Connection pool instrumentation for the Mongo client.
+
+``MongoPoolMonitor`` is registered as a pymongo event listener and keeps
+counters in memory: connections open and checked out, requests waiting for a
+connection, and how long recent checkouts waited. ``/healthz`` reads these
+counters, so a probe never costs a round trip to the database.
+"""
+import threading
+import time
+from collections import deque
+
+from pymongo import monitoring
+
+# Number of recent checkouts the wait-time figures are computed over
+WAIT_SAMPLES = 512
+
+
+class MongoPoolMonitor(monitoring.ConnectionPoolListener):
+    def __init__(self, samples=WAIT_SAMPLES):
+        self._lock = threading.Lock()
+        # Checkout start and completion events are published on the requesting thread
+        self._local = threading.local()
+        self._waits_ms = deque(maxlen=samples)
+        self.open_connections = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def _finish_wait(self):
+        started = getattr(self._local, 'started', None)
+        self._local.started = None
+        if started is None:
+            return None
+        return (time.monotonic() - started) * 1000
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections -= 1
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+
+    def connection_check_out_failed(self, event):
+        self._finish_wait()
+        with self._lock:
+            self.waiting -= 1
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        wait_ms = self._finish_wait()
+        with self._lock:
+            self.waiting -= 1
+            self.checked_out += 1
+            self.checkouts += 1
+            if wait_ms is not None:
+                self._waits_ms.append(wait_ms)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits_ms)
+            return {
+                'open_connections': self.open_connections,
+                'checked_out': self.checked_out,
+                'waiting': self.waiting,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'pool_clears': self.pool_clears,
+                'checkout_wait_ms': {
+                    'p50': round(waits[len(waits) // 2], 2) if waits else None,
+                    'p99': round(waits[min(len(waits) - 1, int(len(waits) * 0.99))], 2) if waits else None,
+                    'max': round(waits[-1], 2) if waits else None,
+                    'samples': len(waits)
+                }
+            }
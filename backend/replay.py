@@ -0,0 +1,262 @@
+"""
+Replay buffers for resumable server-sent event streams.
+
+Every streamed reply is a generation with its own ID. The generation runs on
+a thread of its own and appends each frame it produces to the replay store,
+which numbers the frames 1, 2, 3... The HTTP response only follows the
+store and sends every frame as ``id: <generation>:<n>``. When a connection
+drops, the client reconnects with ``Last-Event-ID``. It receives the frames
+after ``n`` and then follows the still-running generation; the upstream
+completion is not restarted.
+
+Each generation keeps at most ``max_frames`` frames and is forgotten ``ttl``
+seconds after it finishes. ``ReplayStore`` keeps the buffers in process
+memory, so a reconnect must reach the same worker. ``RedisReplayStore``
+(needs the ``redis`` package, enabled with ``REPLAY_REDIS_URL``) keeps them in
+Redis streams, so any worker can resume any generation.
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Followers refresh their "seen" mark this often while waiting for frames
+HEARTBEAT_SECONDS = 1.0
+
+
+def parse_event_id(value):
+    """
+    Split a ``Last-Event-ID`` value.
+
+    Returns:
+        tuple: (generation ID or None, event number), or (None, None) if the value is malformed
+    """
+    generation_id, _, number = (value or '').strip().rpartition(':')
+    try:
+        return generation_id or None, int(number)
+    except ValueError:
+        return None, None
+
+
+def event_stream(store, generation_id, after=0):
+    """SSE frames of a generation after event ``after``, following it until it finishes"""
+    for event_id, payload in store.follow(generation_id, after):
+        yield f"id: {generation_id}:{event_id}\ndata: {payload}\n\n"
+
+
+class _Buffer:
+    def __init__(self, owner, max_frames):
+        self.owner = owner
+        self.frames = deque(maxlen=max_frames)
+        self.last_id = 0
+        self.done = False
+        self.finished_at = None
+        self.seen = time.monotonic()
+        self.condition = threading.Condition()
+
+
+class ReplayStore:
+    """In-process replay buffers"""
+    backend = 'memory'
+
+    def __init__(self, max_frames=4096, ttl=300, max_generations=10000):
+        """
+        Args:
+            max_frames (int): Frames kept per generation; older ones can no longer be replayed
+            ttl (float): Seconds a finished generation stays resumable
+            max_generations (int): Buffers kept at most; the oldest finished ones are dropped first
+        """
+        self.max_frames = max_frames
+        self.ttl = ttl
+        self.max_generations = max_generations
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        now = time.monotonic()
+        for generation_id, buffer in list(self._buffers.items()):
+            if buffer.done and now - buffer.finished_at > self.ttl:
+                del self._buffers[generation_id]
+        if len(self._buffers) >= self.max_generations:
+            finished = sorted((b.finished_at, g) for g, b in self._buffers.items() if b.done)
+            for _, generation_id in finished[:len(self._buffers) - self.max_generations + 1]:
+                del self._buffers[generation_id]
+
+    def create(self, generation_id, owner):
+        with self._lock:
+            self._expire()
+            self._buffers[generation_id] = _Buffer(owner, self.max_frames)
+
+    def append(self, generation_id, payload):
+        """Add a frame; returns its event number"""
+        buffer = self._buffers[generation_id]
+        with buffer.condition:
+            buffer.last_id += 1
+            buffer.frames.append((buffer.last_id, payload))
+            buffer.condition.notify_all()
+            return buffer.last_id
+
+    def finish(self, generation_id):
+        buffer = self._buffers[generation_id]
+        with buffer.condition:
+            buffer.done = True
+            buffer.finished_at = time.monotonic()
+            buffer.condition.notify_all()
+
+    def owner(self, generation_id):
+        buffer = self._buffers.get(generation_id)
+        return buffer.owner if buffer else None
+
+    def available(self, generation_id, after):
+        """Whether every frame after ``after`` can still be replayed"""
+        buffer = self._buffers.get(generation_id)
+        if buffer is None:
+            return False
+        with buffer.condition:
+            return after >= buffer.last_id or not buffer.frames or buffer.frames[0][0] <= after + 1
+
+    def follow(self, generation_id, after=0):
+        """
+        Yield (event number, payload) after ``after``, waiting for new frames until the generation finishes.
+
+        Stops early if frames the follower has not seen were evicted: the client then reconnects, gets a
+        410 from ``available`` and catches up from the stored message instead of receiving a reply with a gap.
+        """
+        buffer = self._buffers.get(generation_id)
+        if buffer is None:
+            return
+        position = after
+        while True:
+            with buffer.condition:
+                buffer.seen = time.monotonic()
+                if buffer.last_id <= position:
+                    if buffer.done:
+                        return
+                    buffer.condition.wait(HEARTBEAT_SECONDS)
+                    continue
+                # Event numbers are consecutive, so the first unseen frame is found by offset
+                first = buffer.frames[0][0]
+                if first > position + 1:
+                    return
+                frames = list(itertools.islice(buffer.frames, max(0, position + 1 - first), None))
+            for frame in frames:
+                yield frame
+            position = frames[-1][0]
+
+    def idle_seconds(self, generation_id):
+        """Seconds since a client last followed the generation"""
+        buffer = self._buffers.get(generation_id)
+        return time.monotonic() - buffer.seen if buffer else float('inf')
+
+    def stats(self):
+        with self._lock:
+            buffers = list(self._buffers.values())
+        return {
+            'backend': self.backend,
+            'generations': len(buffers),
+            'running': sum(1 for buffer in buffers if not buffer.done),
+            'frames': sum(len(buffer.frames) for buffer in buffers)
+        }
+
+
+class RedisReplayStore:
+    """Replay buffers in Redis streams, shared by all workers"""
+    backend = 'redis'
+
+    def __init__(self, url, max_frames=4096, ttl=300, prefix='sumersault:replay:'):
+        import redis
+
+        self.redis = redis.Redis.from_url(url)
+        self.max_frames = max_frames
+        self.ttl = int(ttl)
+        self.prefix = prefix
+
+    def _keys(self, generation_id):
+        return f"{self.prefix}{generation_id}", f"{self.prefix}{generation_id}:meta"
+
+    def create(self, generation_id, owner):
+        _, meta = self._keys(generation_id)
+        with self.redis.pipeline() as pipe:
+            pipe.hset(meta, mapping={'owner': owner, 'seen': time.time(), 'last': 0})
+            pipe.expire(meta, self.ttl)
+            pipe.execute()
+
+    def _add(self, generation_id, fields):
+        stream, meta = self._keys(generation_id)
+        number = self.redis.hincrby(meta, 'last', 1)
+        with self.redis.pipeline() as pipe:
+            # Explicit IDs keep the stream's order identical to the event numbers
+            pipe.xadd(stream, fields, id=f"0-{number}", maxlen=self.max_frames, approximate=True)
+            # Refreshed on every frame, so only finished (or stuck) generations expire
+            pipe.expire(stream, self.ttl)
+            pipe.expire(meta, self.ttl)
+            pipe.execute()
+        return number
+
+    def append(self, generation_id, payload):
+        return self._add(generation_id, {'d': payload})
+
+    def finish(self, generation_id):
+        _, meta = self._keys(generation_id)
+        self.redis.hset(meta, 'done', 1)
+        self._add(generation_id, {'end': 1})
+
+    def owner(self, generation_id):
+        _, meta = self._keys(generation_id)
+        owner = self.redis.hget(meta, 'owner')
+        return owner.decode() if owner is not None else None
+
+    def available(self, generation_id, after):
+        stream, meta = self._keys(generation_id)
+        last = self.redis.hget(meta, 'last')
+        if last is None:
+            return False
+        if after >= int(last):
+            return True
+        first = self.redis.xrange(stream, count=1)
+        return not first or int(first[0][0].decode().split('-')[1]) <= after + 1
+
+    def follow(self, generation_id, after=0):
+        stream, meta = self._keys(generation_id)
+        cursor = f"0-{after}"
+        position = after
+        while True:
+            self.redis.hset(meta, 'seen', time.time())
+            result = self.redis.xread({stream: cursor}, count=100, block=int(HEARTBEAT_SECONDS * 1000))
+            if not result:
+                if not self.redis.exists(meta):
+                    return
+                continue
+            for entry_id, fields in result[0][1]:
+                number = int(entry_id.decode().split('-')[1])
+                if number > position + 1:
+                    # Trimmed before this follower read it; see ``ReplayStore.follow``
+                    return
+                cursor = entry_id
+                position = number
+                if b'end' in fields:
+                    return
+                yield number, fields[b'd'].decode()
+
+    def idle_seconds(self, generation_id):
+        _, meta = self._keys(generation_id)
+        seen = self.redis.hget(meta, 'seen')
+        return time.time() - float(seen) if seen is not None else float('inf')
+
+    def stats(self):
+        return {'backend': self.backend}
+
+
+def create_replay_store(redis_url=None, **kwargs):
+    """Build the replay store: shared through Redis when configured and available, otherwise in process"""
+    if redis_url:
+        try:
+            return RedisReplayStore(redis_url, **kwargs)
+        except ImportError:
+            logger.warning("redis is not installed, replay buffers stay in process")
+        except Exception as e:
+            logger.error(f"Could not connect the replay store to Redis, replay buffers stay in process: {str(e)}")
+    return ReplayStore(**kwargs)
@@ -0,0 +1,133 @@
+"""
+Opt-in cache of completion responses for repeated prompts.
+
+Many users ask the same questions with the same (generic) system prompt. When
+enabled, a completion is stored under a hash of the normalized prompt: model,
+generation parameters and every message actually sent, i.e. the system
+prompt, the budget-trimmed history and the user's message. A later request
+that would send the same prompt is answered from the cache instead of calling
+the API.
+
+Entries are scoped: users only share answers with colleagues of the same
+company (derived from ``User.company``); users without a company only hit
+their own entries. While the cache is enabled the app sends a company-level
+system prompt, without the user's name, job title or department, so that
+colleagues' prompts match and no cached answer is addressed to one person. The cache is a per-worker LRU bounded by entry count and
+text size, and entries expire after ``ttl`` seconds.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+WHITESPACE = re.compile(r"\s+")
+LATENCY_SAMPLES = 512
+
+
+def normalize_content(text):
+    """Collapse whitespace and case so trivially different prompts share an entry"""
+    return WHITESPACE.sub(' ', text or '').strip().casefold()
+
+
+def cache_scope(company, user_id):
+    """Company-wide scope when the user belongs to one, otherwise private to the user"""
+    return f"company:{company.casefold()}" if company else f"user:{user_id}"
+
+
+class ResponseCache:
+    def __init__(self, enabled=False, ttl=3600, max_entries=1000, max_bytes=16 * 1024 * 1024):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._hit_ms = deque(maxlen=LATENCY_SAMPLES)
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+
+    def make_key(self, scope, model, messages, params):
+        """
+        Hash a prompt into a cache key.
+
+        Args:
+            scope (str): Sharing scope from ``cache_scope``
+            model (str): Model or deployment name
+            messages (list): The chat messages that would be sent
+            params (dict): Generation parameters (max_tokens, temperature, ...)
+        """
+        payload = {
+            'scope': scope,
+            'model': model,
+            'params': params,
+            'messages': [[message['role'], normalize_content(message['content'])] for message in messages]
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._size -= len(entry['text'])
+
+    def get(self, key):
+        """
+        Look up a cached response.
+
+        Returns:
+            dict: ``text`` and ``tokens`` (prompt + completion tokens the hit saves), or None
+        """
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires'] <= now:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.tokens_saved += entry['tokens']
+            return entry
+
+    def put(self, key, text, tokens):
+        """Store a completed response; empty responses are not cached"""
+        if not self.enabled or not text or len(text) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = {'text': text, 'tokens': tokens, 'expires': time.monotonic() + self.ttl}
+            self._size += len(text)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def observe_hit(self, elapsed_ms):
+        """Record how long a request answered from the cache took end to end"""
+        with self._lock:
+            self._hit_ms.append(elapsed_ms)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            latencies = sorted(self._hit_ms)
+            return {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'tokens_saved': self.tokens_saved,
+                'hit_latency_ms': {
+                    'p50': round(latencies[len(latencies) // 2], 2) if latencies else None,
+                    'p99': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 2) if latencies else None,
+                    'samples': len(latencies)
+                },
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'ttl_seconds': self.ttl
+            }
@@ -0,0 +1,231 @@
+"""
+Chunk-and-retrieve for large attachments.
+
+Instead of sending the first 10K characters of a large file (or all of it),
+the extracted text is split into overlapping chunks and indexed once per
+upload. Each turn then adds only the top-k chunks most relevant to the user's
+question. Indexes are persisted as JSON next to the upload blobs and kept in
+an in-process LRU, so a query is a dictionary walk over precomputed term
+frequencies rather than a pass over the file.
+
+Scoring is pluggable: BM25 always, plus local embeddings (sentence-transformers)
+when ``RETRIEVAL_EMBEDDING_MODEL`` is set and the package is installed.
+"""
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+")
+
+# Standard BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def chunk_text(text, chunk_chars=1200, overlap=200):
+    """
+    Split text into chunks of roughly ``chunk_chars`` characters.
+
+    Paragraphs are packed together where possible; paragraphs longer than a
+    chunk are cut with ``overlap`` characters repeated between pieces.
+    """
+    chunks = []
+    current = ''
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) > chunk_chars:
+            if current:
+                chunks.append(current)
+                current = ''
+            step = chunk_chars - overlap
+            for start in range(0, len(paragraph), step):
+                chunks.append(paragraph[start:start + chunk_chars])
+                if start + chunk_chars >= len(paragraph):
+                    break
+        elif len(current) + len(paragraph) + 2 > chunk_chars:
+            chunks.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class BM25Backend:
+    name = 'bm25'
+
+    def build(self, chunks):
+        term_freqs = [Counter(tokenize(chunk)) for chunk in chunks]
+        lengths = [sum(tf.values()) for tf in term_freqs]
+        doc_freqs = Counter()
+        for tf in term_freqs:
+            doc_freqs.update(tf.keys())
+        return {
+            'tf': [dict(tf) for tf in term_freqs],
+            'lengths': lengths,
+            'df': dict(doc_freqs),
+            'avgdl': (sum(lengths) / len(lengths)) if lengths else 0
+        }
+
+    def score(self, index, query):
+        terms = set(tokenize(query))
+        count = len(index['tf'])
+        scores = [0.0] * count
+        avgdl = index['avgdl'] or 1
+        for term in terms:
+            df = index['df'].get(term)
+            if not df:
+                continue
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            for position, tf in enumerate(index['tf']):
+                freq = tf.get(term)
+                if freq:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * index['lengths'][position] / avgdl)
+                    scores[position] += idf * freq * (BM25_K1 + 1) / (freq + norm)
+        return scores
+
+
+class EmbeddingBackend:
+    """Dense retrieval with a local sentence-transformers model"""
+    name = 'embedding'
+
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+
+    def _embed(self, texts):
+        return self.model.encode(texts, normalize_embeddings=True).tolist()
+
+    def build(self, chunks):
+        return {'vectors': self._embed(chunks) if chunks else []}
+
+    def score(self, index, query):
+        query_vector = self._embed([query])[0]
+        return [sum(a * b for a, b in zip(query_vector, vector)) for vector in index['vectors']]
+
+
+def _normalize(scores):
+    top = max(scores) if scores else 0
+    return [score / top for score in scores] if top > 0 else [0.0] * len(scores)
+
+
+class ChunkRetriever:
+    def __init__(self, index_dir, backends=None, chunk_chars=1200, overlap=200, cache_size=64):
+        self.index_dir = index_dir
+        self.backends = backends or [BM25Backend()]
+        self.chunk_chars = chunk_chars
+        self.overlap = overlap
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(index_dir, exist_ok=True)
+
+    def _index_path(self, content_hash):
+        return os.path.join(self.index_dir, content_hash[:2], f"{content_hash}.json")
+
+    def _remember(self, content_hash, index):
+        with self._lock:
+            self._cache[content_hash] = index
+            self._cache.move_to_end(content_hash)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def index(self, content_hash, text):
+        """Chunk and index one file's text, persisting the index; returns the index"""
+        chunks = chunk_text(text, self.chunk_chars, self.overlap)
+        index = {
+            'version': INDEX_VERSION,
+            'chunks': chunks,
+            'backends': {backend.name: backend.build(chunks) for backend in self.backends}
+        }
+
+        path = self._index_path(content_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, path)
+
+        self._remember(content_hash, index)
+        logger.info(f"Indexed {len(chunks)} chunks for {content_hash[:12]}")
+        return index
+
+    def _load(self, content_hash, text=None):
+        with self._lock:
+            index = self._cache.get(content_hash)
+            if index is not None:
+                self._cache.move_to_end(content_hash)
+                return index
+
+        try:
+            with open(self._index_path(content_hash), 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            index = None
+
+        # Indexes built with a different backend set are rebuilt from the text
+        if index is None or set(index.get('backends', {})) != {backend.name for backend in self.backends}:
+            return self.index(content_hash, text) if text is not None else None
+
+        self._remember(content_hash, index)
+        return index
+
+    def search(self, content_hash, query, k=4, text=None):
+        """
+        Return the ``k`` chunks of a file most relevant to ``query``, in document order.
+
+        Args:
+            content_hash (str): The file's content hash
+            query (str): The user's question
+            k (int): Number of chunks to return
+            text (str): The file's text, used to build the index if it does not exist yet
+
+        Returns:
+            list: Dicts with ``position``, ``total``, ``text`` and ``score``; empty if the file is not indexed
+        """
+        index = self._load(content_hash, text)
+        if not index or not index['chunks']:
+            return []
+
+        chunks = index['chunks']
+        combined = [0.0] * len(chunks)
+        if query and query.strip():
+            for backend in self.backends:
+                for position, score in enumerate(_normalize(backend.score(index['backends'][backend.name], query))):
+                    combined[position] += score
+
+        # With no matching terms this keeps the first chunks, i.e. the head of the file
+        ranked = sorted(range(len(chunks)), key=lambda position: (-combined[position], position))[:k]
+        return [{
+            'position': position,
+            'total': len(chunks),
+            'text': chunks[position],
+            'score': round(combined[position], 4)
+        } for position in sorted(ranked)]
+
+
+def create_retriever(index_dir, embedding_model=None, **kwargs):
+    """Build a retriever with BM25, adding local embeddings when a model is configured and available"""
+    backends = [BM25Backend()]
+    if embedding_model:
+        try:
+            backends.append(EmbeddingBackend(embedding_model))
+        except ImportError:
+            logger.warning("sentence-transformers is not installed, retrieval uses BM25 only")
+        except Exception as e:
+            logger.error(f"Could not load embedding model '{embedding_model}', retrieval uses BM25 only: {str(e)}")
+    return ChunkRetriever(index_dir, backends=backends, **kwargs)
@@ -0,0 +1,262 @@
+"""
+Index declarations and query-plan checks for the Mongo collections.
+
+Every index the routes rely on is declared here and created idempotently at
+boot with ``ensure_indexes``. ``QUERY_SHAPES`` lists the queries the routes
+issue (with placeholder values); the check mode explains each one and fails
+if any of them would scan a whole collection.
+
+Usage:
+    python -m backend.schema            # create missing indexes
+    python -m backend.schema --check    # create them, then verify every query shape
+"""
+import argparse
+import logging
+import os
+import sys
+
+from bson.objectid import ObjectId
+from dotenv import load_dotenv
+from pymongo import ASCENDING, DESCENDING, IndexModel, MongoClient, UpdateOne
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Lookups by _id (load_user, conversation ownership checks on (_id, user_id),
+# file_texts, blobs) are served by the built-in _id index and need no entry here.
+INDEXES = {
+    'users': [
+        # microsoft_auth and ensure_admin_exists look users up by email
+        IndexModel(
+            [("email", ASCENDING)],
+            name="email_unique",
+            unique=True,
+            partialFilterExpression={"email": {"$type": "string"}}
+        ),
+        # ensure_admin_exists checks whether any admin exists
+        IndexModel([("role", ASCENDING)], name="role")
+    ],
+    'conversations': [
+        # Sidebar listing: pinned first, then most recently updated, _id as the tie-breaker
+        IndexModel(
+            [("user_id", ASCENDING), ("pinned", DESCENDING), ("updated_at", DESCENDING), ("_id", DESCENDING)],
+            name="user_sidebar"
+        )
+    ],
+    'messages': [
+        IndexModel([("conversation_id", ASCENDING), ("seq", ASCENDING)], name="conversation_seq", unique=True),
+        # The stale reply sweep; only replies still streaming are indexed
+        IndexModel(
+            [("status", ASCENDING)],
+            name="streaming_replies",
+            partialFilterExpression={"status": "streaming"}
+        )
+    ],
+    'uploads': [
+        # Downloads resolve a content hash to an upload owned by the current user
+        IndexModel([("user_id", ASCENDING), ("content_hash", ASCENDING)], name="user_content_hash")
+    ]
+}
+
+_user_id = ObjectId()
+_conversation_id = ObjectId()
+_hash = '0' * 64
+
+# (name, collection, command) for every query the routes issue, with placeholder values.
+# Updates and deletes are checked through the find on their filter, which has the same plan.
+# The admin user listing reads the whole users collection by design and is left out.
+QUERY_SHAPES = [
+    ('load_user', 'users', {'find': 'users', 'filter': {"_id": _user_id}}),
+    ('user_by_email', 'users', {'find': 'users', 'filter': {"email": "user@example.com"}}),
+    ('admin_exists', 'users', {'find': 'users', 'filter': {"role": "admin"}, 'limit': 1}),
+    ('conversation_by_owner', 'conversations', {
+        'find': 'conversations',
+        'filter': {"_id": _conversation_id, "user_id": _user_id}
+    }),
+    ('sidebar', 'conversations', {
+        'find': 'conversations',
+        'filter': {"user_id": _user_id},
+        'sort': {"pinned": -1, "updated_at": -1, "_id": -1},
+        'projection': {"preview": 1, "title": 1, "pinned": 1, "updated_at": 1},
+        'limit': 51
+    }),
+    ('sidebar_next_page', 'conversations', {
+        'find': 'conversations',
+        'filter': {"user_id": _user_id, "pinned": {"$ne": True}, "$or": [
+            {"updated_at": {"$lt": _conversation_id.generation_time}},
+            {"updated_at": _conversation_id.generation_time, "_id": {"$lt": _conversation_id}}
+        ]},
+        'sort': {"pinned": -1, "updated_at": -1, "_id": -1},
+        'limit': 51
+    }),
+    ('sidebar_next_page_pinned', 'conversations', {
+        'find': 'conversations',
+        'filter': {"user_id": _user_id, "$or": [
+            {"pinned": True, "$or": [
+                {"updated_at": {"$lt": _conversation_id.generation_time}},
+                {"updated_at": _conversation_id.generation_time, "_id": {"$lt": _conversation_id}}
+            ]},
+            {"pinned": {"$ne": True}}
+        ]},
+        'sort': {"pinned": -1, "updated_at": -1, "_id": -1},
+        'limit': 51
+    }),
+    ('message_page', 'messages', {
+        'find': 'messages',
+        'filter': {"conversation_id": _conversation_id, "seq": {"$lt": 100}},
+        'sort': {"seq": -1},
+        'limit': 51
+    }),
+    ('summary_batch', 'messages', {
+        'find': 'messages',
+        'filter': {"conversation_id": _conversation_id, "seq": {"$gt": 10, "$lt": 100}},
+        'sort': {"seq": 1},
+        'limit': 40
+    }),
+    ('messages_since', 'messages', {
+        'find': 'messages',
+        'filter': {"conversation_id": _conversation_id, "seq": {"$gt": 10}},
+        'sort': {"seq": 1},
+        'limit': 201
+    }),
+    ('recent_after_summary', 'messages', {
+        'find': 'messages',
+        'filter': {"conversation_id": _conversation_id, "seq": {"$lt": 100, "$gt": 10}},
+        'sort': {"seq": -1},
+        'limit': 50
+    }),
+    ('stale_replies', 'messages', {
+        'find': 'messages',
+        'filter': {"status": "streaming", "$or": [
+            {"checkpoint_at": {"$lt": _conversation_id.generation_time}},
+            {"checkpoint_at": {"$exists": False}, "timestamp": {"$lt": "2024-01-01T00:00:00"}}
+        ]}
+    }),
+    ('conversation_uploads', 'messages', {
+        'distinct': 'messages',
+        'key': 'file.upload_id',
+        'query': {"conversation_id": _conversation_id}
+    }),
+    ('upload_by_owner', 'uploads', {'find': 'uploads', 'filter': {"_id": ObjectId(), "user_id": _user_id}}),
+    ('download_by_hash', 'uploads', {'find': 'uploads', 'filter': {"content_hash": _hash, "user_id": _user_id}}),
+    ('user_conversation_ids', 'conversations', {
+        'find': 'conversations',
+        'filter': {"user_id": _user_id},
+        'projection': {"_id": 1}
+    }),
+    ('legacy_attachment', 'messages', {
+        'find': 'messages',
+        'filter': {"conversation_id": {"$in": [_conversation_id]}, "file.path": "uploads/legacy.txt"},
+        'limit': 1
+    }),
+    ('file_text', 'file_texts', {'find': 'file_texts', 'filter': {"_id": _hash}}),
+    ('file_text_requeue', 'file_texts', {
+        'find': 'file_texts',
+        'filter': {"_id": _hash, "status": "pending", "queued_at": {"$lt": _conversation_id.generation_time}}
+    }),
+    ('blob', 'blobs', {'find': 'blobs', 'filter': {"_id": _hash}})
+]
+
+
+def ensure_indexes(db):
+    """
+    Create every declared index that does not exist yet.
+
+    A collection whose indexes cannot be built (e.g. duplicate emails blocking
+    the unique index) is logged and skipped so the app can still start.
+
+    Returns:
+        list: Names of the indexes that are in place
+    """
+    names = []
+    for collection, models in INDEXES.items():
+        try:
+            names.extend(db[collection].create_indexes(models))
+        except OperationFailure as e:
+            logger.error(f"Could not create indexes on {collection}: {str(e)}")
+    return names
+
+
+def backfill_listing_fields(db):
+    """
+    Give every conversation the fields the sidebar sorts and pages on.
+
+    Conversations created before ``pinned`` and ``updated_at`` existed lack
+    them. A missing value sorts apart from ``false`` or from any date, and the
+    keyset cursor in ``backend.pagination`` cannot step across that boundary,
+    so such conversations would be skipped or repeated between pages. Safe to
+    run on every boot: once backfilled, nothing matches.
+
+    Returns:
+        int: Number of conversations updated
+    """
+    try:
+        updated = db.conversations.update_many({"pinned": None}, {"$set": {"pinned": False}}).modified_count
+        operations = [
+            # The app stores naive local times; the _id timestamp is the creation time when nothing else is
+            UpdateOne({"_id": conversation['_id']}, {"$set": {"updated_at": conversation.get('created_at') or
+                       conversation['_id'].generation_time.astimezone().replace(tzinfo=None)}})
+            for conversation in db.conversations.find({"updated_at": None}, projection={"created_at": 1})
+        ]
+        if operations:
+            updated += db.conversations.bulk_write(operations, ordered=False).modified_count
+    except PyMongoError as e:
+        logger.error(f"Could not backfill conversation listing fields: {str(e)}")
+        return 0
+    if updated:
+        logger.info(f"Backfilled pinned/updated_at on {updated} conversations")
+    return updated
+
+
+def _plan_stages(plan):
+    """Collect every ``stage`` name in an explain output, whatever its nesting"""
+    stages = set()
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.add(plan['stage'])
+        for value in plan.values():
+            stages |= _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            stages |= _plan_stages(item)
+    return stages
+
+
+def check_query_plans(db):
+    """
+    Explain every query shape and report the ones that scan a whole collection.
+
+    Returns:
+        list: ``(name, stages)`` for each shape whose winning plan contains a COLLSCAN
+    """
+    failures = []
+    for name, collection, command in QUERY_SHAPES:
+        explained = db.command({'explain': command, 'verbosity': 'queryPlanner'})
+        planner = explained.get('queryPlanner', explained)
+        stages = _plan_stages(planner.get('winningPlan', planner))
+        if 'COLLSCAN' in stages:
+            failures.append((name, sorted(stages)))
+            logger.error(f"{name} ({collection}): collection scan, plan stages {sorted(stages)}")
+        else:
+            logger.info(f"{name} ({collection}): ok, plan stages {sorted(stages)}")
+    return failures
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Create the Mongo indexes and verify the routes' query plans")
+    parser.add_argument('--check', action='store_true', help="Fail if any route query falls back to a collection scan")
+    args = parser.parse_args()
+
+    mongo_client = MongoClient(os.environ.get("MONGO_URI", "mongodb://localhost:27017/sumersault"))
+    database = mongo_client.get_default_database()
+    logger.info(f"Indexes in place: {', '.join(ensure_indexes(database))}")
+    backfill_listing_fields(database)
+
+    if args.check:
+        failed = check_query_plans(database)
+        if failed:
+            logger.error(f"{len(failed)} of {len(QUERY_SHAPES)} query shapes scan a whole collection")
+            sys.exit(1)
+        logger.info(f"All {len(QUERY_SHAPES)} query shapes are index-backed")
@@ -0,0 +1,290 @@
+"""
+Precompressed, content-hashed serving of the React build.
+
+``python -m backend.static_assets`` (run after ``npm run build``, which does
+it automatically) turns ``static/react-build`` into ``static/dist``:
+
+- files referenced from an HTML page are copied under a content-hashed name
+  (``bundle.js`` -> ``bundle.3f2a9c1e.js``) and the page is rewritten to match
+- every compressible file gets ``.gz`` (and, with the ``brotli`` package,
+  ``.br``) variants, written once at build time
+- ``manifest.json`` records each file's hash, content type and variants, plus
+  the size and mtime of the sources it was built from
+
+``StaticAssets`` serves from the manifest: it picks the best variant for the
+request's ``Accept-Encoding``, sends hashed files with a one-year immutable
+``Cache-Control`` and everything else with ``no-cache``, and answers
+``If-None-Match`` with 304 from the in-memory manifest without touching the
+file. When there is no manifest, or the sources changed since it was built,
+files are served from the build directory as before.
+
+Usage:
+    python -m backend.static_assets [--source static/react-build] [--output static/dist]
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+from flask import Response, request, send_file, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+HASH_LENGTH = 8
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+# Smaller files are not worth a Content-Encoding round trip
+MIN_COMPRESS_BYTES = 256
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml',
+                      'image/svg+xml', 'application/wasm', 'font/ttf', 'font/otf')
+# Preference order when the client accepts several encodings
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# src="..." / href="..." references to local files in HTML pages
+ASSET_REFERENCE = re.compile(r'''(\b(?:src|href)\s*=\s*["'])([^"'#?]+)(["'])''', re.IGNORECASE)
+
+
+def hashed_name(name, digest):
+    """``js/bundle.js`` -> ``js/bundle.<hash>.js``"""
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{digest[:HASH_LENGTH]}{ext}"
+
+
+def _is_local_reference(target):
+    return not (target.startswith(('/', '//', 'data:')) or re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*:', target))
+
+
+def _source_files(source):
+    files = []
+    for directory, _, names in os.walk(source):
+        for name in names:
+            path = os.path.join(directory, name)
+            files.append(os.path.relpath(path, source).replace(os.sep, '/'))
+    return sorted(files)
+
+
+def _source_state(source, names):
+    """Size and mtime of each source file, to detect builds newer than the manifest"""
+    state = {}
+    for name in names:
+        stat = os.stat(os.path.join(source, name))
+        state[name] = [stat.st_size, stat.st_mtime_ns]
+    return state
+
+
+def _write_variants(path, data, mimetype):
+    """Write the precompressed variants of ``data`` next to ``path``; returns {encoding: filename}"""
+    if len(data) < MIN_COMPRESS_BYTES or not mimetype.startswith(COMPRESSIBLE_TYPES):
+        return {}
+    variants = {}
+    compressed = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressed['br'] = brotli.compress(data, quality=11)
+    for encoding, suffix in ENCODINGS:
+        payload = compressed.get(encoding)
+        # Keep a variant only if it saves a meaningful amount
+        if payload is not None and len(payload) < len(data) * 0.9:
+            with open(path + suffix, 'wb') as f:
+                f.write(payload)
+            variants[encoding] = os.path.basename(path) + suffix
+    return variants
+
+
+def build(source, output):
+    """
+    Build the hashed, precompressed copy of ``source`` in ``output``.
+
+    Args:
+        source (str): Directory of the webpack build
+        output (str): Directory to (re)create
+
+    Returns:
+        dict: The manifest that was written
+    """
+    names = [name for name in _source_files(source) if name != MANIFEST_NAME]
+    contents = {}
+    for name in names:
+        with open(os.path.join(source, name), 'rb') as f:
+            contents[name] = f.read()
+    digests = {name: hashlib.sha256(data).hexdigest() for name, data in contents.items()}
+
+    # Files referenced from HTML pages get hashed names so they can be cached forever
+    pages = [name for name in names if name.endswith(('.html', '.htm'))]
+    referenced = set()
+    renamed = {}
+    for page in pages:
+        base = os.path.dirname(page)
+        for match in ASSET_REFERENCE.finditer(contents[page].decode('utf-8')):
+            target = match.group(2)
+            resolved = os.path.normpath(os.path.join(base, target)).replace(os.sep, '/')
+            if _is_local_reference(target) and resolved in contents and resolved not in pages:
+                referenced.add(resolved)
+    for name in referenced:
+        renamed[name] = hashed_name(name, digests[name])
+
+    def rewrite(match, base):
+        target = match.group(2)
+        resolved = os.path.normpath(os.path.join(base, target)).replace(os.sep, '/')
+        if not _is_local_reference(target) or resolved not in renamed:
+            return match.group(0)
+        new_target = os.path.relpath(renamed[resolved], base or '.').replace(os.sep, '/')
+        return f"{match.group(1)}{new_target}{match.group(3)}"
+
+    for page in pages:
+        base = os.path.dirname(page)
+        html = ASSET_REFERENCE.sub(lambda match: rewrite(match, base), contents[page].decode('utf-8'))
+        contents[page] = html.encode('utf-8')
+        digests[page] = hashlib.sha256(contents[page]).hexdigest()
+
+    parent = os.path.dirname(os.path.abspath(output))
+    staging = tempfile.mkdtemp(prefix='.static-build-', dir=parent)
+    # mkdtemp creates the directory private; a front proxy must be able to read it
+    os.chmod(staging, 0o755)
+    assets = {}
+    try:
+        for name in names:
+            served = renamed.get(name, name)
+            path = os.path.join(staging, served)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(contents[name])
+            mimetype = mimetypes.guess_type(served)[0] or 'application/octet-stream'
+            assets[served] = {
+                'hash': digests[name],
+                'size': len(contents[name]),
+                'content_type': mimetype,
+                'immutable': name in renamed,
+                'encodings': _write_variants(path, contents[name], mimetype)
+            }
+
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'sources': _source_state(source, names),
+            'assets': assets
+        }
+        with open(os.path.join(staging, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+        # Swap the finished build in, so a crash never leaves a half-written output
+        if os.path.isdir(output):
+            shutil.rmtree(output)
+        os.rename(staging, output)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return manifest
+
+
+class StaticAssets:
+    def __init__(self, source, output):
+        """
+        Args:
+            source (str): Directory of the webpack build, served directly as a fallback
+            output (str): Directory written by ``build``
+        """
+        self.source = source
+        self.output = output
+        self.assets = {}
+        self.load()
+
+    def load(self):
+        """Load the manifest, unless it is missing or older than the sources it was built from"""
+        self.assets = {}
+        try:
+            with open(os.path.join(self.output, MANIFEST_NAME)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            logger.info("No static asset manifest, serving the React build uncompressed (run python -m backend.static_assets)")
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read the static asset manifest: {str(e)}")
+            return
+
+        sources = manifest.get('sources', {})
+        try:
+            current = _source_state(self.source, _source_files(self.source))
+        except OSError:
+            current = {}
+        current.pop(MANIFEST_NAME, None)
+        if manifest.get('version') != MANIFEST_VERSION or current != sources:
+            logger.warning("Static asset manifest is out of date with the React build, serving the build directly; "
+                           "run python -m backend.static_assets")
+            return
+
+        self.assets = manifest['assets']
+        logger.info(f"Serving {len(self.assets)} precompressed static assets from {self.output}")
+
+    def _negotiate(self, asset):
+        """Best encoding the client accepts that has a precompressed variant, or None for identity"""
+        for encoding, _ in ENCODINGS:
+            if encoding in asset['encodings'] and request.accept_encodings[encoding]:
+                return encoding
+        return None
+
+    def serve(self, path):
+        """Response for ``path`` (relative to the site root)"""
+        asset = self.assets.get(path)
+        if asset is None:
+            return send_from_directory(self.source, path)
+
+        encoding = self._negotiate(asset)
+        etag = f"{asset['hash'][:16]}-{encoding or 'identity'}"
+        headers = {
+            'Cache-Control': IMMUTABLE_CACHE_CONTROL if asset['immutable'] else REVALIDATE_CACHE_CONTROL
+        }
+        if asset['encodings']:
+            headers['Vary'] = 'Accept-Encoding'
+
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304, headers=headers)
+            response.set_etag(etag)
+            return response
+
+        filename = asset['encodings'][encoding] if encoding else os.path.basename(path)
+        response = send_file(
+            os.path.join(self.output, os.path.dirname(path), filename),
+            mimetype=asset['content_type'],
+            conditional=False,
+            etag=False
+        )
+        response.headers.update(headers)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        return response
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Precompress and content-hash the React build")
+    parser.add_argument('--source', default=os.path.join(root, 'static', 'react-build'))
+    parser.add_argument('--output', default=os.path.join(root, 'static', 'dist'))
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.source):
+        logger.error(f"{args.source} does not exist; run npm run build in frontend/ first")
+        sys.exit(1)
+    if brotli is None:
+        logger.warning("brotli is not installed, writing gzip variants only")
+    built = build(args.source, args.output)
+    for name, asset in sorted(built['assets'].items()):
+        variants = ', '.join(f"{encoding} {os.path.getsize(os.path.join(args.output, os.path.dirname(name), file))}"
+                             for encoding, file in asset['encodings'].items())
+        logger.info(f"{name}: {asset['size']} bytes{' (immutable)' if asset['immutable'] else ''}"
+                    f"{f'; {variants}' if variants else ''}")
+    logger.info(f"Wrote {len(built['assets'])} assets and {MANIFEST_NAME} to {args.output}")
@@ -0,0 +1,157 @@
+"""
+Rolling conversation summaries.
+
+Turns that have fallen out of the recent window are folded into a running
+summary stored on the conversation document (``summary``, plus ``summary_seq``,
+the seq of the last message folded in). Each refresh only sends the previous
+summary and the turns added since ``summary_seq`` to the model, so the summary
+is extended incrementally instead of being regenerated from the full history.
+Prompts are then built from ``summary + turns after summary_seq``.
+
+A refresh stops before the first reply that is still streaming, so a reply
+is only folded in once its final text is stored. A streaming reply whose
+generation has stopped checkpointing (its worker died) is folded in as
+interrupted instead, so it can't hold the summary back for good.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from pymongo import ASCENDING
+
+from backend.message_store import STATUS_INTERRUPTED, STATUS_STREAMING, is_stale_reply, prompt_text
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Update the existing summary with the new turns. Keep facts, decisions, names, numbers, "
+    "file names and open questions; drop pleasantries. Reply with the updated summary only."
+)
+
+# Each turn is clipped before summarization so one huge message can't blow the request
+MAX_TURN_CHARS = 2000
+
+
+class ConversationSummarizer:
+    def __init__(self, db, completions, model, keep_recent=12, min_batch=6, max_batch=40, max_tokens=400,
+                 stale_reply_seconds=300):
+        """
+        Args:
+            db: The Mongo database holding ``conversations`` and ``messages``
+            completions: The completion gateway (``completions.create`` takes chat completion arguments); None disables summaries
+            model (str): Model or deployment name used for summarization
+            keep_recent (int): Number of most recent messages always left out of the summary
+            min_batch (int): Minimum number of unsummarized messages before a refresh calls the model
+            max_batch (int): Maximum number of messages folded in by a single refresh
+            max_tokens (int): Token limit for the generated summary
+            stale_reply_seconds (float): Seconds without a checkpoint after which a streaming reply counts as interrupted
+        """
+        self.db = db
+        self.completions = completions
+        self.model = model
+        self.keep_recent = keep_recent
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.max_tokens = max_tokens
+        self.stale_reply_seconds = stale_reply_seconds
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='summarizer')
+
+    @property
+    def enabled(self):
+        return self.completions is not None
+
+    def _format_turns(self, messages):
+        lines = []
+        for message in messages:
+            text = prompt_text(message)
+            if text is None:
+                continue
+            speaker = 'User' if message.get('sender') == 'user' else 'Assistant'
+            text = text[:MAX_TURN_CHARS]
+            if message.get('file'):
+                text += f" [attached file: {message['file'].get('name', 'unnamed-file')}]"
+            lines.append(f"{speaker}: {text}")
+        return "\n\n".join(lines)
+
+    def summarize(self, previous_summary, messages):
+        """Fold ``messages`` into ``previous_summary`` with one completion call"""
+        prompt = (
+            f"Existing summary:\n{previous_summary or '(none yet)'}\n\n"
+            f"New turns:\n{self._format_turns(messages)}"
+        )
+        response = self.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                {"role": "user", "content": prompt}
+            ],
+            stream=False,
+            max_tokens=self.max_tokens,
+            temperature=0
+        )
+        return (response.choices[0].message.content or '').strip()
+
+    def refresh(self, conversation_id):
+        """
+        Fold turns that left the recent window into the stored summary.
+
+        Returns:
+            bool: Whether the summary was updated
+        """
+        if not self.enabled:
+            return False
+
+        conversation = self.db.conversations.find_one(
+            {"_id": conversation_id},
+            projection={"summary": 1, "summary_seq": 1, "message_count": 1}
+        )
+        if not conversation:
+            return False
+
+        summary_seq = conversation.get('summary_seq')
+        cutoff = conversation.get('message_count', 0) - self.keep_recent
+
+        query = {"conversation_id": conversation_id, "seq": {"$lt": cutoff}}
+        if summary_seq is not None:
+            query["seq"]["$gt"] = summary_seq
+        pending = []
+        for message in self.db.messages.find(query).sort("seq", ASCENDING).limit(self.max_batch):
+            if message.get('status') == STATUS_STREAMING:
+                if not is_stale_reply(message, self.stale_reply_seconds):
+                    # Folding past it would leave its final text out of the summary for good
+                    break
+                # Its generation is gone; fold in what was checkpointed, as the sweep will mark it
+                message = dict(message, status=STATUS_INTERRUPTED)
+            pending.append(message)
+
+        if len(pending) < self.min_batch:
+            return False
+
+        summary = self.summarize(conversation.get('summary'), pending)
+
+        # Only apply if nobody else folded these turns in the meantime
+        result = self.db.conversations.update_one(
+            {"_id": conversation_id, "summary_seq": summary_seq},
+            {"$set": {
+                "summary": summary,
+                "summary_seq": pending[-1]['seq'],
+                "summarized_at": datetime.now()
+            }}
+        )
+        if result.modified_count:
+            logger.info(f"Summarized {len(pending)} messages of conversation {conversation_id} (through seq {pending[-1]['seq']})")
+        return bool(result.modified_count)
+
+    def refresh_in_background(self, conversation_id):
+        """Schedule a refresh off the request path"""
+        if not self.enabled:
+            return None
+        return self._executor.submit(self._safe_refresh, conversation_id)
+
+    def _safe_refresh(self, conversation_id):
+        try:
+            return self.refresh(conversation_id)
+        except Exception as e:
+            logger.error(f"Error summarizing conversation {conversation_id}: {str(e)}")
+            return False
@@ -0,0 +1,143 @@
+"""
+Structured telemetry for completion calls.
+
+Every completion produces exactly one JSON record: route, model, latency,
+time to first token, tokens, finish reason, prompt/response sizes and whether
+it was served from the cache or shared with another request. Records are
+handed to a bounded queue and written by a ``QueueListener`` thread, so the
+request thread never blocks on log I/O. When the queue is full, records are
+dropped and counted instead of blocking. Prompt and response bodies are
+attached to only a sampled fraction of records, truncated, which keeps log
+volume proportional to the number of calls rather than to their size.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+TELEMETRY_LOGGER = 'sumersault.telemetry'
+
+
+class TelemetryFormatter(logging.Formatter):
+    """Render a record's ``telemetry`` dict as one JSON line"""
+
+    def format(self, record):
+        payload = getattr(record, 'telemetry', None)
+        if payload is None:
+            return super().format(record)
+        return json.dumps(
+            {'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(), **payload},
+            default=str,
+            ensure_ascii=False
+        )
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue handler that drops records instead of blocking or raising when the queue is full"""
+
+    def __init__(self, record_queue):
+        super().__init__(record_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # The listener thread does the JSON formatting; only hand over the fields it needs
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+
+class CompletionTelemetry:
+    def __init__(self, payload_sample_rate=0.01, payload_chars=500, queue_size=10000, handler=None):
+        """
+        Args:
+            payload_sample_rate (float): Fraction of records that include prompt and response bodies
+            payload_chars (int): Maximum characters of each sampled body
+            queue_size (int): Records buffered for the writer thread before new ones are dropped
+            handler (logging.Handler): Where records are written (stderr by default)
+        """
+        self.payload_sample_rate = payload_sample_rate
+        self.payload_chars = payload_chars
+        self.records = 0
+
+        handler = handler or logging.StreamHandler(sys.stderr)
+        handler.setFormatter(TelemetryFormatter())
+        self._handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+        self._listener = QueueListener(self._handler.queue, handler, respect_handler_level=False)
+        self._listener.start()
+        atexit.register(self.close)
+
+        self.logger = logging.getLogger(TELEMETRY_LOGGER)
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.addHandler(self._handler)
+
+    def record(self, route, model, latency_ms, ttft_ms=None, prompt_tokens=None, completion_tokens=None,
+               tokens_estimated=False, finish_reason=None, prompt_chars=0, history_messages=None, response_chars=0,
+               cached=False, coalesced=False, error=None, prompt=None, response=None):
+        """
+        Emit the record for one completion.
+
+        Args:
+            route (str): Endpoint that produced the completion
+            model (str): Model or deployment name
+            latency_ms (float): Time from the start of the call to the last token
+            ttft_ms (float): Time to the first token (equal to ``latency_ms`` without streaming)
+            prompt_tokens (int): Prompt tokens, from the API's usage or estimated
+            completion_tokens (int): Completion tokens, from the API's usage or estimated
+            tokens_estimated (bool): Whether the token counts were estimated locally
+            finish_reason (str): The API's finish reason
+            prompt_chars (int): Size of the prompt messages
+            history_messages (int): Number of earlier turns that fit in the context window
+            response_chars (int): Size of the response
+            cached (bool): Served from the response cache
+            coalesced (bool): Shared an in-flight generation started by another request
+            error (str): Error description if the call failed
+            prompt (str): Prompt body, attached only to sampled records
+            response (str): Response body, attached only to sampled records
+        """
+        self.records += 1
+        telemetry = {
+            'event': 'completion',
+            'route': route,
+            'model': model,
+            'latency_ms': round(latency_ms, 1),
+            'ttft_ms': round(ttft_ms, 1) if ttft_ms is not None else None,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'tokens_estimated': tokens_estimated,
+            'finish_reason': finish_reason,
+            'prompt_chars': prompt_chars,
+            'history_messages': history_messages,
+            'response_chars': response_chars,
+            'cached': cached,
+            'coalesced': coalesced,
+            'error': error
+        }
+        if self.payload_sample_rate and random.random() < self.payload_sample_rate:
+            telemetry['prompt'] = (prompt or '')[-self.payload_chars:]
+            telemetry['response'] = (response or '')[:self.payload_chars]
+        self.logger.info('completion', extra={'telemetry': telemetry})
+
+    def close(self):
+        """Flush queued records and stop the writer thread"""
+        if self._listener._thread is not None:
+            self._listener.stop()
+
+    def stats(self):
+        return {
+            'records': self.records,
+            'dropped': self._handler.dropped,
+            'queued': self._handler.queue.qsize(),
+            'payload_sample_rate': self.payload_sample_rate
+        }
@@ -0,0 +1,257 @@
+"""
+Extracted-text cache for uploaded files.
+
+Text is extracted once, when a file is uploaded, and stored in the
+``file_texts`` collection keyed by the SHA-256 of the file's bytes. Prompt
+builders read it back through an in-process LRU (bounded by the total size of
+the cached text) instead of re-opening every attachment in the conversation
+on every turn.
+
+Entries carry a ``status``: plain text is extracted inline and is ``done``
+right away, while documents handed to the background extraction service stay
+``pending`` until their job finishes (or ends ``failed``/``timeout``). Only
+finished entries are kept in the in-process LRU, so a pending entry is always
+re-read from Mongo and picks up a result written by another worker.
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+TEXT_EXTENSIONS = ('.txt', '.md', '.csv', '.json', '.py', '.js', '.html', '.css', '.c', '.cpp', '.h',
+                   '.xml', '.java', '.rb', '.php')
+
+# Keep stored documents well below the 16 MB BSON limit
+MAX_STORED_CHARS = 1_000_000
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+STATUS_PENDING = 'pending'
+STATUS_DONE = 'done'
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_text_file(name, content_type):
+    return bool(content_type and content_type.startswith('text/')) or name.lower().endswith(TEXT_EXTENSIONS)
+
+
+def extract_text(path, name, content_type):
+    """Return the text content of a file, or None if it is not a text file"""
+    if not is_text_file(name, content_type):
+        return None
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        return f.read(MAX_STORED_CHARS)
+
+
+class ExtractedTextCache:
+    def __init__(self, db, max_bytes=32 * 1024 * 1024, max_paths=4096):
+        self.db = db
+        self.max_bytes = max_bytes
+        self.max_paths = max_paths
+        self._entries = OrderedDict()
+        self._size = 0
+        # Files uploaded before content hashes existed are looked up by path
+        self._path_hashes = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    def _entry_size(self, entry):
+        return len(entry.get('text') or '') + 64
+
+    def _remember(self, content_hash, entry):
+        if entry.get('status') == STATUS_PENDING:
+            return
+        with self._lock:
+            if content_hash in self._entries:
+                self._size -= self._entry_size(self._entries.pop(content_hash))
+            self._entries[content_hash] = entry
+            self._size += self._entry_size(entry)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= self._entry_size(evicted)
+
+    def get(self, content_hash):
+        """
+        Look up extracted text by content hash.
+
+        Returns:
+            dict: The cache entry with ``text`` (None for non-text files or unfinished jobs) and ``status``,
+            or None if nothing was extracted
+        """
+        with self._lock:
+            entry = self._entries.get(content_hash)
+            if entry is not None:
+                self._entries.move_to_end(content_hash)
+                self.hits += 1
+                return entry
+
+        doc = self.db.file_texts.find_one({"_id": content_hash})
+        if doc is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        entry = self._entry(content_hash, doc)
+        with self._lock:
+            self.store_hits += 1
+        self._remember(content_hash, entry)
+        return entry
+
+    def _entry(self, content_hash, doc):
+        return {
+            'content_hash': content_hash,
+            'text': doc.get('text'),
+            'name': doc.get('name'),
+            'path': doc.get('path'),
+            'status': doc.get('status', STATUS_DONE),
+            'error': doc.get('error')
+        }
+
+    def put(self, content_hash, text, name=None, status=STATUS_DONE, error=None):
+        fields = {
+            "text": text,
+            "chars": len(text) if text is not None else 0,
+            "status": status,
+            "error": error,
+            "completed_at": datetime.now()
+        }
+        if name is not None:
+            fields["name"] = name
+        doc = self.db.file_texts.find_one_and_update(
+            {"_id": content_hash},
+            {"$set": fields, "$setOnInsert": {"created_at": datetime.now()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        entry = self._entry(content_hash, doc)
+        self._remember(content_hash, entry)
+        return entry
+
+    def mark_pending(self, content_hash, name, path):
+        """
+        Record that a file's text will be extracted in the background.
+
+        An entry without text that is not pending already (e.g. a document stored
+        by the inline extractor, which skips non-text files) is claimed as well.
+
+        Returns:
+            bool: True if the caller should queue the job, False if the hash already has text or a job
+        """
+        result = self.db.file_texts.update_one(
+            {"_id": content_hash},
+            {"$setOnInsert": {
+                "name": name,
+                "path": path,
+                "status": STATUS_PENDING,
+                "created_at": datetime.now(),
+                "queued_at": datetime.now()
+            }},
+            upsert=True
+        )
+        if result.upserted_id is not None:
+            return True
+
+        # The upsert leaves existing entries alone, so claim a textless one explicitly
+        result = self.db.file_texts.update_one(
+            {"_id": content_hash, "text": None, "status": {"$ne": STATUS_PENDING}},
+            {"$set": {
+                "name": name,
+                "path": path,
+                "status": STATUS_PENDING,
+                "error": None,
+                "queued_at": datetime.now()
+            }}
+        )
+        if not result.modified_count:
+            return False
+        with self._lock:
+            entry = self._entries.pop(content_hash, None)
+            if entry is not None:
+                self._size -= self._entry_size(entry)
+        return True
+
+    def requeue_if_stale(self, content_hash, stale_before):
+        """Claim a pending job queued before ``stale_before`` so it can be submitted again"""
+        result = self.db.file_texts.update_one(
+            {"_id": content_hash, "status": STATUS_PENDING, "queued_at": {"$lt": stale_before}},
+            {"$set": {"queued_at": datetime.now()}}
+        )
+        return bool(result.modified_count)
+
+    def extract_and_store(self, path, name, content_type, content_hash=None):
+        """
+        Extract a file's text once and cache it under its content hash.
+
+        Returns:
+            str: The content hash of the file
+        """
+        content_hash = content_hash or file_sha256(path)
+        if self.get(content_hash) is None:
+            try:
+                text = extract_text(path, name, content_type)
+            except Exception as e:
+                logger.error(f"Error extracting text from {name}: {str(e)}")
+                text = None
+            self.put(content_hash, text, name)
+        return content_hash
+
+    def lookup_file(self, file_info):
+        """
+        Return the extracted-text entry for a message's file info.
+
+        Uses the stored ``content_hash`` when present; older attachments without
+        one are hashed and extracted on first use and then found by path.
+
+        Returns:
+            dict: The cache entry (see ``get``)
+
+        Raises:
+            FileNotFoundError: If the file has no cached text and is missing on disk
+        """
+        content_hash = file_info.get('content_hash')
+        if content_hash:
+            entry = self.get(content_hash)
+            if entry is not None:
+                return entry
+
+        path = file_info.get('path', '')
+        with self._lock:
+            content_hash = self._path_hashes.get(path)
+        if content_hash is None:
+            if not os.path.exists(path):
+                raise FileNotFoundError(path)
+            content_hash = self.extract_and_store(path, file_info.get('name', ''), file_info.get('type', ''))
+            with self._lock:
+                self._path_hashes[path] = content_hash
+                while len(self._path_hashes) > self.max_paths:
+                    self._path_hashes.popitem(last=False)
+
+        return self.get(content_hash)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.store_hits + self.misses
+            return {
+                'hits': self.hits,
+                'store_hits': self.store_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes
+            }
@@ -0,0 +1,70 @@
+"""
+In-process cache for the user objects Flask-Login loads on every request.
+
+Without it, ``load_user`` costs one ``users`` lookup per authenticated
+request, including static assets and SSE calls. Entries live for ``ttl``
+seconds in a bounded LRU. Writes in this process invalidate them explicitly;
+writes made by another worker are picked up once the entry expires, so a
+role change takes effect everywhere within ``ttl`` seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class UserCache:
+    def __init__(self, loader, ttl=30, max_entries=10000):
+        """
+        Args:
+            loader: Callable taking a user ID string and returning the user object, or None
+            ttl (float): Seconds an entry is served before it is reloaded
+            max_entries (int): Maximum number of cached users
+        """
+        self.loader = loader
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, user_id):
+        """Return the cached user, loading it on a miss or after expiry. Unknown users are not cached."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        user = self.loader(user_id)
+        if user is not None:
+            with self._lock:
+                self._entries[user_id] = (now + self.ttl, user)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id):
+        """Drop a user after their document was written, so the next request reloads it"""
+        with self._lock:
+            if self._entries.pop(str(user_id), None) is not None:
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                # Every hit is a users lookup that did not go to Mongo
+                'mongo_reads_saved': self.hits,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'ttl_seconds': self.ttl
+            }
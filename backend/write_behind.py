@@ -0,0 +1,280 @@
+"""
+Write-behind persistence for streamed replies.
+
+A streaming route stores the user message and an empty assistant message
+(``status: 'streaming'``) before generation starts. Every later write goes
+through ``WriteBehindWriter``: the partial text is checkpointed while the
+stream runs, and the final text replaces it when the stream ends. A stream
+cut short by a disconnect or an error keeps its partial text with
+``status: 'interrupted'``, so the turn can be inspected or retried.
+
+A background thread collects pending updates and writes them as one
+unordered ``bulk_write`` per collection. It flushes at most ``flush_interval``
+seconds after the first pending update, or sooner once ``max_batch`` are
+queued. Concurrent streams therefore share round trips instead of each
+issuing its own. Updates to the same document are coalesced: a newer
+checkpoint replaces one that has not been written yet. ``close`` drains the
+queue. It runs at interpreter exit and from gunicorn's ``worker_exit`` hook,
+so a worker that shuts down does not lose queued writes. Replies still
+generating at that point are finalized as interrupted first: their
+generation threads die with the process. A worker that is killed outright
+leaves them streaming, which ``MessageStore.interrupt_stale`` cleans up.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, ExecutionTimeout, PyMongoError
+
+from backend.message_store import STATUS_INTERRUPTED
+
+logger = logging.getLogger(__name__)
+
+TRANSIENT_ERRORS = (ConnectionFailure, ExecutionTimeout)
+
+
+class WriteBehindWriter:
+    def __init__(self, db, flush_interval=0.25, max_batch=500, max_pending=10000, max_retries=5):
+        """
+        Args:
+            db: The pymongo database
+            flush_interval (float): Longest time, in seconds, an update waits before it is written
+            max_batch (int): Updates written per flush; a full batch is flushed right away
+            max_pending (int): Queued updates before callers block until the queue drains
+            max_retries (int): Attempts for a batch that fails with a connection error before it is dropped
+        """
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        # key -> (collection, UpdateOne); re-assigning a key keeps its place in the queue
+        self._pending = OrderedDict()
+        self._first_pending_at = None
+        self._condition = threading.Condition()
+        self._closed = False
+        # Set once the writer thread has drained the queue and stopped
+        self._drained = False
+        # Checkpoints of replies still generating; close() interrupts them
+        self._checkpoints = set()
+        self.queued = 0
+        self.coalesced = 0
+        self.written = 0
+        self.batches = 0
+        self.retries = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def update(self, collection, filter, update, key=None):
+        """
+        Queue an update.
+
+        Args:
+            collection (str): Collection name
+            filter (dict): Update filter
+            update (dict): Update document; it must be idempotent, since a batch may be retried
+            key: Identity of the target document; a pending update with the same key is replaced
+        """
+        operation = UpdateOne(filter, update)
+        key = key if key is not None else (collection, object())
+        with self._condition:
+            if self._drained:
+                # Shut down: nobody will flush any more, so write through. While the queue is still
+                # draining, updates are queued instead, so a retried older update can't overwrite them
+                try:
+                    self.db[collection].bulk_write([operation])
+                    self.written += 1
+                except PyMongoError as e:
+                    self.dropped += 1
+                    logger.error(f"Dropped write-behind update on {collection} during shutdown: {str(e)}")
+                return
+            while len(self._pending) >= self.max_pending and key not in self._pending and not self._closed:
+                self._condition.wait()
+            if key in self._pending:
+                self.coalesced += 1
+            if not self._pending:
+                self._first_pending_at = time.monotonic()
+            self._pending[key] = (collection, operation)
+            self.queued += 1
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._condition.notify_all()
+
+    def _next_batch(self):
+        """Wait until a batch is due and take it off the queue; None once closed and drained"""
+        with self._condition:
+            while True:
+                if self._pending:
+                    wait = self._first_pending_at + self.flush_interval - time.monotonic()
+                    if self._closed or wait <= 0 or len(self._pending) >= self.max_batch:
+                        break
+                    self._condition.wait(wait)
+                elif self._closed:
+                    self._drained = True
+                    return None
+                else:
+                    self._condition.wait()
+
+            batch = []
+            while self._pending and len(batch) < self.max_batch:
+                key, (collection, operation) = self._pending.popitem(last=False)
+                batch.append((key, collection, operation))
+            self._first_pending_at = time.monotonic() if self._pending else None
+            # Room in the queue again
+            self._condition.notify_all()
+            return batch
+
+    def _requeue(self, items):
+        """Put failed updates back at the front, unless a newer update for the same document arrived"""
+        with self._condition:
+            for key, collection, operation in reversed(items):
+                if key not in self._pending:
+                    self._pending[key] = (collection, operation)
+                    self._pending.move_to_end(key, last=False)
+            if self._pending and self._first_pending_at is None:
+                self._first_pending_at = time.monotonic()
+
+    def _write(self, batch):
+        """Write one batch; returns the updates that failed with a transient error"""
+        by_collection = OrderedDict()
+        for item in batch:
+            by_collection.setdefault(item[1], []).append(item)
+
+        failed = []
+        for collection, items in by_collection.items():
+            try:
+                self.db[collection].bulk_write([operation for _, _, operation in items], ordered=False)
+                self.written += len(items)
+            except BulkWriteError as e:
+                # Per-document errors (validation, duplicates) won't succeed on retry
+                errors = e.details.get('writeErrors', [])
+                self.written += len(items) - len(errors)
+                self.dropped += len(errors)
+                for error in errors[:5]:
+                    logger.error(f"Dropped write-behind update on {collection}: {error.get('errmsg')}")
+            except TRANSIENT_ERRORS as e:
+                logger.warning(f"Write-behind flush to {collection} failed, will retry: {str(e)}")
+                failed.extend(items)
+            except Exception as e:
+                # Anything else is not worth retrying, but must not kill the writer thread
+                self.dropped += len(items)
+                logger.error(f"Dropped {len(items)} write-behind updates on {collection}: {str(e)}")
+        return failed
+
+    def _run(self):
+        attempts = 0
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            failed = self._write(batch)
+            self.batches += 1
+            if not failed:
+                attempts = 0
+                continue
+
+            attempts += 1
+            if attempts > self.max_retries:
+                self.dropped += len(failed)
+                logger.error(f"Dropped {len(failed)} write-behind updates after {self.max_retries} retries")
+                attempts = 0
+                continue
+            self.retries += 1
+            self._requeue(failed)
+            time.sleep(min(5.0, 0.1 * 2 ** attempts))
+
+    def close(self, timeout=10.0):
+        """Interrupt replies still generating, flush everything that is queued and stop the writer thread"""
+        with self._condition:
+            if self._closed:
+                return
+            open_checkpoints = list(self._checkpoints)
+        for checkpoint in open_checkpoints:
+            checkpoint.interrupt('worker shut down')
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(f"Write-behind queue not drained after {timeout}s, {len(self._pending)} updates pending")
+
+    def stats(self):
+        with self._condition:
+            return {
+                'pending': len(self._pending),
+                'oldest_pending_ms': round((time.monotonic() - self._first_pending_at) * 1000, 1)
+                if self._first_pending_at is not None else None,
+                'queued': self.queued,
+                'coalesced': self.coalesced,
+                'written': self.written,
+                'batches': self.batches,
+                'retries': self.retries,
+                'dropped': self.dropped
+            }
+
+
+class MessageCheckpoint:
+    """Persists the text of one streamed assistant message through a ``WriteBehindWriter``"""
+
+    def __init__(self, writer, conversation_id, seq, interval=2.0):
+        """
+        Args:
+            writer (WriteBehindWriter): Queue for the writes
+            conversation_id (ObjectId): Conversation holding the message
+            seq (int): The message's seq
+            interval (float): Minimum seconds between checkpoints of the partial text
+        """
+        self.writer = writer
+        self.conversation_id = conversation_id
+        self.filter = {"conversation_id": conversation_id, "seq": seq}
+        self.key = ('messages', conversation_id, seq)
+        self.interval = interval
+        self.text = ''
+        self._last_at = time.monotonic()
+        self._last_length = 0
+        with writer._condition:
+            writer._checkpoints.add(self)
+
+    def progress(self, text):
+        """Checkpoint the partial text if the interval has passed since the last one"""
+        self.text = text
+        now = time.monotonic()
+        if now - self._last_at < self.interval or len(text) == self._last_length:
+            return
+        self._last_at = now
+        self._last_length = len(text)
+        self.writer.update('messages', self.filter, {"$set": {"text": text, "checkpoint_at": datetime.now()}},
+                           key=self.key)
+
+    def finish(self, text, status=None, error=None):
+        """
+        Write the final text.
+
+        Args:
+            text (str): The complete (or partial) reply
+            status (str): None for a complete reply, otherwise kept on the message (e.g. ``'interrupted'``)
+            error (str): What cut the stream short, if anything
+        """
+        update = {"$set": {"text": text}, "$unset": {"checkpoint_at": ""}}
+        if status:
+            update["$set"]["status"] = status
+            if error:
+                update["$set"]["error"] = error
+        else:
+            update["$unset"]["status"] = ""
+        self.writer.update('messages', self.filter, update, key=self.key)
+        self.writer.update('conversations', {"_id": self.conversation_id}, {"$set": {"updated_at": datetime.now()}},
+                           key=('conversations', self.conversation_id))
+        with self.writer._condition:
+            self.writer._checkpoints.discard(self)
+
+    def interrupt(self, error):
+        """Finish with the latest partial text, kept as interrupted"""
+        self.finish(self.text, status=STATUS_INTERRUPTED, error=error)
@@ -0,0 +1,369 @@
+"""
+End-to-end benchmark for the chat API.
+
+Boots the Flask app in-process with the fake completion backend
+(``LLM_BACKEND=fake``) and an in-memory MongoDB stand-in (mongomock), or a
+real MongoDB with ``--mongo-uri``. Authentication is bypassed by writing the
+Flask-Login session for a seeded user, as the OAuth callback would. For each
+conversation size it seeds a conversation with that many messages, then
+drives a weighted mix of operations through the Flask test client:
+
+- ``new_conversation``: ``GET /api/conversation`` without an ID
+- ``open_conversation``: ``GET /api/conversation?id=...``
+- ``send_message``: ``POST /api/message`` (non-streamed)
+- ``stream``: ``POST /api/chat/stream``, read to the final frame
+- ``sidebar``: ``GET /api/conversations``
+- ``upload``: ``POST /api/upload`` with a small text file
+
+and reports p50/p95/p99 latency per operation, overall throughput and the
+process's memory. Everything runs in one process, so the memory figures are
+those of a single worker.
+
+Results can be saved as a baseline and later runs compared against it; the
+comparison exits non-zero when a p95 latency or the throughput regresses by
+more than the tolerance. Baselines are only comparable on the same machine.
+
+Usage:
+    python -m benchmarks.e2e
+    python -m benchmarks.e2e --save benchmarks/baseline.json
+    python -m benchmarks.e2e --compare benchmarks/baseline.json --tolerance 0.25
+    python -m benchmarks.e2e --mongo-uri mongodb://localhost:27017/sumersault_bench --concurrency 8
+
+Requires ``mongomock`` unless ``--mongo-uri`` is given.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_EMAIL = 'bench@example.com'
+SIZES = (10, 100, 1000)
+PERCENTILES = (50, 95, 99)
+
+# Relative frequency of each operation in the mix
+MIX = {
+    'new_conversation': 5,
+    'open_conversation': 20,
+    'send_message': 15,
+    'stream': 20,
+    'sidebar': 30,
+    'upload': 10
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def rss_mb():
+    """Current resident set size of this process, in MB"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def load_app(args):
+    """Import ``main`` configured for benchmarking; must run before anything else imports it"""
+    os.environ['LLM_BACKEND'] = 'fake'
+    os.environ['FAKE_LLM_TTFT_MS'] = str(args.ttft_ms)
+    os.environ['FAKE_LLM_TOKEN_DELAY_MS'] = str(args.token_delay_ms)
+    os.environ['FAKE_LLM_TOKENS'] = str(args.tokens)
+    # Every prompt is distinct, but keep the cache and background summaries out of the numbers
+    os.environ.setdefault('RESPONSE_CACHE_ENABLED', '0')
+    os.environ.setdefault('SUMMARY_ENABLED', '0')
+    os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+
+    if args.mongo_uri:
+        os.environ['MONGO_URI'] = args.mongo_uri
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("mongomock is required for the in-memory database (pip install mongomock), or pass --mongo-uri")
+        import flask_pymongo
+        flask_pymongo.MongoClient = lambda *client_args, **client_kwargs: mongomock.MongoClient()
+        # Newer pymongo passes sort= to bulk updates, which mongomock's bulk builder doesn't accept yet
+        add_update = mongomock.collection.BulkOperationBuilder.add_update
+        mongomock.collection.BulkOperationBuilder.add_update = (
+            lambda self, *update_args, sort=None, **update_kwargs: add_update(self, *update_args, **update_kwargs)
+        )
+
+    # Uploads are written relative to the working directory; keep them out of the checkout
+    os.chdir(tempfile.mkdtemp(prefix='sumersault-bench-'))
+    sys.path.insert(0, PROJECT_ROOT)
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    import main
+    if main.mongo is None:
+        sys.exit("MongoDB is not available; check --mongo-uri")
+    return main
+
+
+def seed_user(main):
+    db = main.mongo.db
+    db.users.delete_many({"email": BENCH_EMAIL})
+    return db.users.insert_one({
+        "email": BENCH_EMAIL,
+        "name": "Benchmark",
+        "role": "user",
+        "created_at": datetime.now()
+    }).inserted_id
+
+
+def seed_conversation(main, user_id, size, batch=500):
+    """Create a conversation holding ``size`` alternating user/assistant messages"""
+    conversation_id = main.mongo.db.conversations.insert_one({
+        "user_id": user_id,
+        "title": f"Benchmark ({size} messages)",
+        "created_at": datetime.now(),
+        "updated_at": datetime.now(),
+        "message_count": 0,
+        "pinned": False
+    }).inserted_id
+
+    words = "please summarize the quarterly numbers and list the open action items for the team".split()
+    for start in range(0, size, batch):
+        messages = [{
+            'id': f"seed-{size}-{i}",
+            'text': ' '.join(words[(i + j) % len(words)] for j in range(40)),
+            'sender': 'user' if i % 2 == 0 else 'bot',
+            'timestamp': datetime.now().isoformat()
+        } for i in range(start, min(size, start + batch))]
+        main.message_store.append({"_id": conversation_id, "user_id": user_id}, messages)
+    return str(conversation_id)
+
+
+def cleanup(main, user_id):
+    db = main.mongo.db
+    conversation_ids = [c['_id'] for c in db.conversations.find({"user_id": user_id}, projection={"_id": 1})]
+    db.messages.delete_many({"conversation_id": {"$in": conversation_ids}})
+    db.conversations.delete_many({"user_id": user_id})
+    db.uploads.delete_many({"user_id": user_id})
+    db.users.delete_one({"_id": user_id})
+
+
+def logged_in_client(main, user_id):
+    """Test client carrying the Flask-Login session of the seeded user"""
+    client = main.app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+def run_operation(client, operation, conversation_id, n):
+    """Perform one operation; returns True if the response looked successful"""
+    if operation == 'new_conversation':
+        response = client.get('/api/conversation')
+    elif operation == 'open_conversation':
+        response = client.get(f'/api/conversation?id={conversation_id}')
+    elif operation == 'send_message':
+        response = client.post('/api/message', data={
+            'conversation_id': conversation_id,
+            'message': f"Benchmark question {n}: what changed since last week?"
+        })
+    elif operation == 'stream':
+        response = client.post('/api/chat/stream', json={
+            'conversation_id': conversation_id,
+            'message': f"Benchmark stream {n}: walk me through the plan"
+        })
+        body = response.get_data()
+        return response.status_code == 200 and b'"done"' in body and b'"error"' not in body
+    elif operation == 'sidebar':
+        response = client.get('/api/conversations')
+    elif operation == 'upload':
+        content = f"benchmark upload {n}\n".encode() + b"lorem ipsum dolor sit amet\n" * 64
+        response = client.post('/api/upload', data={'file': (io.BytesIO(content), f"notes-{n}.txt")},
+                               content_type='multipart/form-data')
+    else:
+        raise ValueError(f"Unknown operation {operation}")
+    response.get_data()
+    return response.status_code == 200
+
+
+def run_size(main, user_id, size, args):
+    """Drive the operation mix against a conversation of ``size`` messages"""
+    conversation_id = seed_conversation(main, user_id, size)
+    rng = random.Random(args.seed + size)
+    operations = rng.choices(list(MIX), weights=list(MIX.values()), k=args.requests)
+    latencies = {operation: [] for operation in MIX}
+    errors = {operation: 0 for operation in MIX}
+    lock = threading.Lock()
+    position = iter(enumerate(operations))
+
+    def worker():
+        client = logged_in_client(main, user_id)
+        while True:
+            with lock:
+                item = next(position, None)
+            if item is None:
+                return
+            n, operation = item
+            started = time.perf_counter()
+            try:
+                ok = run_operation(client, operation, conversation_id, f"{size}-{n}")
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"{operation} failed: {e}")
+                ok = False
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies[operation].append(elapsed_ms)
+                if not ok:
+                    errors[operation] += 1
+
+    # One warm-up pass so first-request setup is not measured
+    warmup = logged_in_client(main, user_id)
+    for operation in MIX:
+        run_operation(warmup, operation, conversation_id, f"{size}-warmup")
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'throughput_rps': round(args.requests / elapsed, 2),
+        'rss_mb': round(rss_mb(), 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'operations': {
+            operation: {
+                'count': len(values),
+                'errors': errors[operation],
+                **{f"p{pct}_ms": round(percentile(values, pct), 2) if values else None for pct in PERCENTILES},
+                'mean_ms': round(statistics.fmean(values), 2) if values else None
+            }
+            for operation, values in latencies.items()
+        }
+    }
+
+
+def print_report(results):
+    for size, result in results.items():
+        print(f"\nconversation size {size}: {result['throughput_rps']} req/s, "
+              f"rss {result['rss_mb']} MB (peak {result['peak_rss_mb']} MB)")
+        print(f"  {'operation':<18} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for operation, stats in result['operations'].items():
+            if not stats['count']:
+                continue
+            print(f"  {operation:<18} {stats['count']:>6} {stats['errors']:>6} "
+                  f"{stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f}")
+
+
+def compare(results, baseline, tolerance, slack_ms=2.0):
+    """
+    List regressions against a saved baseline.
+
+    Args:
+        results (dict): Results of this run, keyed by conversation size
+        baseline (dict): Results of the baseline run, keyed by conversation size
+        tolerance (float): Allowed relative slowdown (0.25 = 25%)
+        slack_ms (float): Absolute p95 increase always tolerated, so sub-millisecond noise is ignored
+
+    Returns:
+        list: Human-readable regression descriptions
+    """
+    regressions = []
+    for size, result in results.items():
+        previous = baseline.get(size)
+        if previous is None:
+            continue
+        if result['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"size {size}: throughput {result['throughput_rps']} req/s "
+                               f"(baseline {previous['throughput_rps']})")
+        for operation, stats in result['operations'].items():
+            before = previous['operations'].get(operation)
+            if not before or before.get('p95_ms') is None or stats['p95_ms'] is None:
+                continue
+            if stats['p95_ms'] > before['p95_ms'] * (1 + tolerance) + slack_ms:
+                regressions.append(f"size {size}: {operation} p95 {stats['p95_ms']} ms (baseline {before['p95_ms']} ms)")
+            if stats['errors'] > before.get('errors', 0):
+                regressions.append(f"size {size}: {operation} errors {stats['errors']} (baseline {before.get('errors', 0)})")
+    return regressions
+
+
+def main_cli(args):
+    if args.compare:
+        with open(os.path.abspath(args.compare)) as f:
+            baseline = json.load(f)
+    save_path = os.path.abspath(args.save) if args.save else None
+
+    app_module = load_app(args)
+    user_id = seed_user(app_module)
+    try:
+        results = {str(size): run_size(app_module, user_id, size, args) for size in args.sizes}
+    finally:
+        cleanup(app_module, user_id)
+
+    print_report(results)
+
+    if save_path:
+        with open(save_path, 'w') as f:
+            json.dump({
+                'config': {
+                    'requests': args.requests,
+                    'concurrency': args.concurrency,
+                    'ttft_ms': args.ttft_ms,
+                    'token_delay_ms': args.token_delay_ms,
+                    'tokens': args.tokens,
+                    'mongo': 'external' if args.mongo_uri else 'mongomock',
+                    'python': platform.python_version(),
+                    'machine': f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+                    'recorded_at': datetime.now().isoformat(timespec='seconds')
+                },
+                'results': results
+            }, f, indent=2)
+            f.write('\n')
+        print(f"\nBaseline saved to {save_path}")
+
+    if args.compare:
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.compare}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nNo regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end latency/throughput benchmark of the chat API")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help="Conversation sizes in messages")
+    parser.add_argument('--requests', type=int, default=300, help="Operations per conversation size")
+    parser.add_argument('--concurrency', type=int, default=4, help="Client threads")
+    parser.add_argument('--ttft-ms', type=float, default=20)
+    parser.add_argument('--token-delay-ms', type=float, default=1)
+    parser.add_argument('--tokens', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the operation mix")
+    parser.add_argument('--mongo-uri', help="Use this MongoDB instead of mongomock (its bench data is removed afterwards)")
+    parser.add_argument('--save', metavar='PATH', help="Write the results as a baseline")
+    parser.add_argument('--compare', metavar='PATH', help="Compare against a saved baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative regression")
+    parser.add_argument('--verbose', action='store_true', help="Keep the app's info logs")
+    sys.exit(main_cli(parser.parse_args()))
@@ -0,0 +1,147 @@
+"""
+Local fake of the Azure OpenAI chat completions endpoint.
+
+Answers ``POST /openai/deployments/<deployment>/chat/completions`` (and the
+plain OpenAI ``/v1/chat/completions`` path) with a deterministic reply. Streamed
+requests get server-sent event chunks with a configurable time-to-first-token
+and inter-token delay, so the chat server can be load tested without calling
+Azure. Built on asyncio streams so it can hold thousands of open responses.
+
+Usage:
+    python -m benchmarks.fake_completion_server --port 8099 --ttft-ms 200 --token-delay-ms 20
+"""
+import argparse
+import asyncio
+import json
+import time
+
+REPLY_WORDS = ("This is a deterministic reply from the fake completion server used for "
+               "load testing the Sumersault chat backend without calling Azure OpenAI.").split()
+
+
+class FakeCompletionServer:
+    def __init__(self, host='127.0.0.1', port=0, ttft_ms=200, token_delay_ms=20, tokens=60):
+        self.host = host
+        self.port = port
+        self.ttft = ttft_ms / 1000
+        self.token_delay = token_delay_ms / 1000
+        self.tokens = tokens
+        self.active = 0
+        self.peak_active = 0
+        self.requests = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    @property
+    def endpoint(self):
+        return f"http://{self.host}:{self.port}"
+
+    def _reply_tokens(self):
+        return [REPLY_WORDS[i % len(REPLY_WORDS)] + ' ' for i in range(self.tokens)]
+
+    async def _handle(self, reader, writer):
+        self.requests += 1
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+        try:
+            request_line = await reader.readline()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            body = await reader.readexactly(int(headers.get('content-length', 0) or 0))
+            payload = json.loads(body or b'{}')
+
+            if b'/chat/completions' not in request_line:
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                return
+
+            if payload.get('stream'):
+                await self._stream(writer, payload)
+            else:
+                await self._complete(writer, payload)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.active -= 1
+            try:
+                await writer.drain()
+                writer.close()
+            except ConnectionError:
+                pass
+
+    def _chunk(self, payload, delta, finish_reason=None):
+        return {
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': payload.get('model', 'fake'),
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+        }
+
+    async def _stream(self, writer, payload):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        await asyncio.sleep(self.ttft)
+
+        for index, token in enumerate(self._reply_tokens()):
+            if index:
+                await asyncio.sleep(self.token_delay)
+            chunk = self._chunk(payload, {'role': 'assistant', 'content': token} if index == 0 else {'content': token})
+            writer.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await writer.drain()
+
+        writer.write(f"data: {json.dumps(self._chunk(payload, {}, 'stop'))}\n\n".encode())
+        writer.write(b"data: [DONE]\n\n")
+
+    async def _complete(self, writer, payload):
+        await asyncio.sleep(self.ttft + self.token_delay * (self.tokens - 1))
+        text = ''.join(self._reply_tokens())
+        body = json.dumps({
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': payload.get('model', 'fake'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': text},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': self.tokens, 'total_tokens': self.tokens}
+        }).encode()
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                     + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+
+
+async def serve_forever(args):
+    server = await FakeCompletionServer(
+        host=args.host,
+        port=args.port,
+        ttft_ms=args.ttft_ms,
+        token_delay_ms=args.token_delay_ms,
+        tokens=args.tokens
+    ).start()
+    print(f"Fake completion server listening on {server.endpoint}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve fake streamed chat completions")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--ttft-ms', type=float, default=200)
+    parser.add_argument('--token-delay-ms', type=float, default=20)
+    parser.add_argument('--tokens', type=int, default=60)
+    asyncio.run(serve_forever(parser.parse_args()))
@@ -0,0 +1,159 @@
+"""
+Micro-benchmark of SSE framing: one frame per token versus ``DeltaBatcher``.
+
+Replays a synthetic streamed reply (tokens arriving every ``--token-ms``, on a
+simulated clock, so the run is fast and repeatable) through each framing
+strategy. The resulting frames go through a Werkzeug response, as gunicorn
+would iterate it, and each frame is written to a local socket. Reported per
+streamed response:
+
+- CPU time (process time, encoding + WSGI iteration + socket writes)
+- frames, i.e. socket writes, and bytes on the wire
+- the largest delay batching added before a token was sent (simulated)
+
+Usage:
+    python -m benchmarks.sse_framing
+    python -m benchmarks.sse_framing --tokens 2000 --token-ms 5 --flush-ms 50 100 --flush-bytes 1024
+"""
+import argparse
+import json
+import random
+import socket
+import threading
+import time
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Response
+
+from backend.sse import DeltaBatcher, frame, orjson
+
+WORDS = ("the quarterly plan covers hiring budget risks and the migration of customer data to the new "
+         "platform with milestones owners and a review every two weeks so that issues surface early").split()
+
+
+def make_tokens(count, seed):
+    """Token-sized deltas, roughly what a BPE tokenizer emits for English text"""
+    rng = random.Random(seed)
+    tokens = []
+    while len(tokens) < count:
+        word = ' ' + rng.choice(WORDS)
+        # Longer words come out as two tokens
+        tokens.extend([word[:4], word[4:]] if len(word) > 7 else [word])
+    return tokens[:count]
+
+
+def per_token_frames(tokens):
+    """The previous framing: a ``json.dumps`` frame per delta, sent as it arrives"""
+    for token in tokens:
+        yield f"data: {json.dumps({'content': token})}\n\n"
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def batched_frames(tokens, token_ms, flush_ms, flush_bytes, delays):
+    """
+    Frames from ``DeltaBatcher`` on a simulated clock, flushing on timeouts the way the
+    stream routes do; the delay of every token is appended to ``delays`` (in ms).
+    """
+    clock = SimulatedClock()
+    batcher = DeltaBatcher(flush_ms, flush_bytes, clock=clock)
+    held = []
+
+    def sent(text):
+        delays.extend((clock.now - arrived) * 1000 for arrived in held)
+        held.clear()
+        return frame({'content': text})
+
+    for index, token in enumerate(tokens):
+        arrival = index * token_ms / 1000
+        # A timeout fires before this token arrives: the route flushes what is due
+        timeout = batcher.timeout()
+        while timeout is not None and clock.now + timeout < arrival:
+            clock.now += timeout
+            text = batcher.due()
+            if text:
+                yield sent(text)
+            timeout = batcher.timeout()
+        clock.now = arrival
+        held.append(arrival)
+        text = batcher.add(token)
+        if text:
+            yield sent(text)
+    text = batcher.flush()
+    if text:
+        yield sent(text)
+
+
+def drain(sock):
+    while sock.recv(1 << 16):
+        pass
+
+
+def serve(frames, environ, sock):
+    """Iterate the frames as a WSGI server would and write each to the socket; returns (writes, bytes)"""
+    response = Response(frames, mimetype='text/event-stream')
+    writes = 0
+    sent = 0
+    for chunk in response(environ, lambda status, headers: None):
+        sock.sendall(chunk)
+        writes += 1
+        sent += len(chunk)
+    return writes, sent
+
+
+def measure(name, make_frames, repeat):
+    environ = EnvironBuilder(path='/api/chat/stream', method='POST').get_environ()
+    writer, reader = socket.socketpair()
+    consumer = threading.Thread(target=drain, args=(reader,), daemon=True)
+    consumer.start()
+    try:
+        started = time.process_time()
+        for _ in range(repeat):
+            writes, sent = serve(make_frames(), environ, writer)
+        cpu_ms = (time.process_time() - started) * 1000 / repeat
+    finally:
+        writer.close()
+        consumer.join()
+        reader.close()
+    return {'strategy': name, 'cpu_ms': cpu_ms, 'frames': writes, 'bytes': sent}
+
+
+def main(args):
+    tokens = make_tokens(args.tokens, args.seed)
+    results = [measure('per-token', lambda: per_token_frames(tokens), args.repeat)]
+    for flush_ms in args.flush_ms:
+        delays = []
+        result = measure(
+            f"batched {flush_ms:g}ms/{args.flush_bytes}B",
+            lambda: batched_frames(tokens, args.token_ms, flush_ms, args.flush_bytes, delays),
+            args.repeat
+        )
+        result['max_delay_ms'] = max(delays) if delays else 0.0
+        results.append(result)
+
+    baseline = results[0]
+    print(f"{args.tokens} tokens every {args.token_ms:g} ms, {args.repeat} responses per strategy, "
+          f"encoder {'orjson' if orjson is not None else 'json'}")
+    print(f"  {'strategy':<24}{'cpu ms':>9}{'frames':>8}{'bytes':>9}{'max delay ms':>14}{'cpu':>8}{'bytes':>8}")
+    for result in results:
+        print(f"  {result['strategy']:<24}{result['cpu_ms']:>9.3f}{result['frames']:>8}{result['bytes']:>9}"
+              f"{result.get('max_delay_ms', 0.0):>14.1f}"
+              f"{result['cpu_ms'] / baseline['cpu_ms']:>7.0%} {result['bytes'] / baseline['bytes']:>7.0%}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-token SSE framing with batched frames")
+    parser.add_argument('--tokens', type=int, default=800, help="Tokens per streamed response")
+    parser.add_argument('--token-ms', type=float, default=15, help="Interval between tokens")
+    parser.add_argument('--flush-ms', type=float, nargs='+', default=[25, 50, 100], help="Batching windows to compare")
+    parser.add_argument('--flush-bytes', type=int, default=1024)
+    parser.add_argument('--repeat', type=int, default=200, help="Responses per strategy")
+    parser.add_argument('--seed', type=int, default=1)
+    main(parser.parse_args())
@@ -0,0 +1,227 @@
+"""
+Concurrency load test for ``/api/chat/stream``.
+
+Starts the fake completion server (or, with ``--backend fake``, has the app
+generate responses in-process via ``LLM_BACKEND=fake``), boots gunicorn
+against it in the requested serving mode, seeds a test user and one conversation per stream in MongoDB,
+then opens N concurrent streams with a signed session cookie and reports how
+many were in flight at once, time-to-first-token and total stream duration.
+
+Requires a reachable MongoDB (``MONGO_URI``, defaults to a local instance).
+
+Usage:
+    python -m benchmarks.stream_load --mode async --streams 300
+    python -m benchmarks.stream_load --mode sync --streams 300 --workers 2
+    python -m benchmarks.stream_load --backend fake --streams 300
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from flask import Flask
+from pymongo import MongoClient, ReturnDocument
+
+from benchmarks.fake_completion_server import FakeCompletionServer
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOADTEST_EMAIL = 'loadtest@example.com'
+
+
+def session_cookie(secret_key, user_id):
+    """Sign a Flask-Login session for the seeded user, as the login flow would"""
+    app = Flask(__name__)
+    app.secret_key = secret_key
+    serializer = app.session_interface.get_signing_serializer(app)
+    return serializer.dumps({'_user_id': str(user_id), '_fresh': True})
+
+
+def seed(db, streams):
+    user = db.users.find_one_and_update(
+        {"email": LOADTEST_EMAIL},
+        {"$setOnInsert": {"email": LOADTEST_EMAIL, "name": "Load Test", "role": "user", "created_at": datetime.now()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    conversation_ids = db.conversations.insert_many([{
+        "user_id": user['_id'],
+        "title": "Load test",
+        "created_at": datetime.now(),
+        "updated_at": datetime.now(),
+        "message_count": 0,
+        "pinned": False
+    } for _ in range(streams)]).inserted_ids
+    return user['_id'], conversation_ids
+
+
+def cleanup(db, user_id):
+    conversation_ids = [c['_id'] for c in db.conversations.find({"user_id": user_id}, projection={"_id": 1})]
+    db.messages.delete_many({"conversation_id": {"$in": conversation_ids}})
+    db.conversations.delete_many({"user_id": user_id})
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(('127.0.0.1', port)) == 0:
+                return
+        time.sleep(0.2)
+    raise RuntimeError(f"Server did not start listening on port {port}")
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0
+        self.peak = 0
+
+    def inc(self):
+        self.value += 1
+        self.peak = max(self.peak, self.value)
+
+    def dec(self):
+        self.value -= 1
+
+
+async def open_stream(port, cookie, conversation_id, gauge, timeout):
+    """Stream one chat response; returns (ttft, total) in seconds"""
+    body = f'{{"message": "Hello from the load test", "conversation_id": "{conversation_id}"}}'.encode()
+    request = (
+        "POST /api/chat/stream HTTP/1.1\r\n"
+        f"Host: 127.0.0.1:{port}\r\n"
+        f"Cookie: session={cookie}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n"
+    ).encode() + body
+
+    start = time.perf_counter()
+    ttft = None
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    gauge.inc()
+    try:
+        writer.write(request)
+        await writer.drain()
+
+        status = await asyncio.wait_for(reader.readline(), timeout)
+        if b' 200 ' not in status:
+            raise RuntimeError(f"Unexpected response: {status.decode().strip()}")
+
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if not line:
+                break
+            if line.startswith(b'data: '):
+                if b'"error"' in line:
+                    raise RuntimeError(line.decode().strip())
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                if b'"done"' in line:
+                    break
+    finally:
+        gauge.dec()
+        writer.close()
+
+    return ttft, time.perf_counter() - start
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run(args):
+    fake = None
+    if args.backend == 'server':
+        fake = await FakeCompletionServer(ttft_ms=args.ttft_ms, token_delay_ms=args.token_delay_ms, tokens=args.tokens).start()
+
+    secret_key = os.environ.get("SESSION_SECRET", "sumersault-dev-secret")
+    mongo_uri = os.environ.get("MONGO_URI", "mongodb://localhost:27017/sumersault")
+    db = MongoClient(mongo_uri).get_default_database()
+    user_id, conversation_ids = seed(db, args.streams)
+    cookie = session_cookie(secret_key, user_id)
+
+    env = dict(
+        os.environ,
+        SERVER_MODE=args.mode,
+        WEB_CONCURRENCY=str(args.workers),
+        SESSION_SECRET=secret_key,
+        MONGO_URI=mongo_uri
+    )
+    if fake is not None:
+        env.update(
+            LLM_BACKEND='azure',
+            AZURE_OPENAI_ENDPOINT=fake.endpoint,
+            AZURE_OPENAI_KEY='fake-key',
+            AZURE_OPENAI_DEPLOYMENT_NAME='fake-deployment'
+        )
+    else:
+        env.update(
+            LLM_BACKEND='fake',
+            FAKE_LLM_TTFT_MS=str(args.ttft_ms),
+            FAKE_LLM_TOKEN_DELAY_MS=str(args.token_delay_ms),
+            FAKE_LLM_TOKENS=str(args.tokens)
+        )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{args.port}', 'main:app'],
+        cwd=PROJECT_ROOT,
+        env=env
+    )
+
+    try:
+        wait_for_port(args.port)
+        gauge = Gauge()
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(open_stream(args.port, cookie, cid, gauge, args.timeout) for cid in conversation_ids),
+            return_exceptions=True
+        )
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+        if fake is not None:
+            await fake.stop()
+        cleanup(db, user_id)
+
+    completed = [r for r in results if not isinstance(r, BaseException)]
+    failures = [r for r in results if isinstance(r, BaseException)]
+    ttfts = [r[0] for r in completed if r[0] is not None]
+    totals = [r[1] for r in completed]
+
+    print(f"mode={args.mode} workers={args.workers} streams={args.streams} backend={args.backend}")
+    print(f"  completed:              {len(completed)} ({len(failures)} failed)")
+    if fake is not None:
+        print(f"  peak concurrent (app):  {fake.peak_active} upstream completions in flight")
+    print(f"  peak open client conns: {gauge.peak}")
+    print(f"  wall time:              {elapsed:.2f}s")
+    if ttfts:
+        print(f"  ttft p50/p95/max:       {statistics.median(ttfts):.3f}s / {percentile(ttfts, 95):.3f}s / {max(ttfts):.3f}s")
+    if totals:
+        print(f"  total p50/p95/max:      {statistics.median(totals):.3f}s / {percentile(totals, 95):.3f}s / {max(totals):.3f}s")
+    for failure in failures[:5]:
+        print(f"  error: {failure!r}")
+
+    return 0 if not failures else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test concurrent /api/chat/stream responses")
+    parser.add_argument('--mode', choices=['sync', 'async'], default='async')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--backend', choices=['server', 'fake'], default='server',
+                        help="server: fake HTTP completion server; fake: the app's in-process backend")
+    parser.add_argument('--streams', type=int, default=300)
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--ttft-ms', type=float, default=300)
+    parser.add_argument('--token-delay-ms', type=float, default=30)
+    parser.add_argument('--tokens', type=int, default=100)
+    parser.add_argument('--timeout', type=float, default=120)
+    sys.exit(asyncio.run(run(parser.parse_args())))
@@ -1,12 +1,17 @@
 import React, { useState, useEffect } from 'react';
 import axios from 'axios';
+import resumableReader from './streamResume';
 import ChatInterface from './components/ChatInterface';
 import Header from './components/Header';
 import Sidebar from './components/Sidebar';
 import './styles/style.css';
 
+const CONVERSATION_PAGE_SIZE = 50;
+const MESSAGE_PAGE_SIZE = 50;
+
 function App() {
   const [conversations, setConversations] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [currentConversation, setCurrentConversation] = useState(null);
   const [isLoading, setIsLoading] = useState(false);
 
@@ -14,21 +19,69 @@ function App() {
     loadConversations();
   }, []);
 
-  const loadConversations = async () => {
+  // The sidebar is paged; X-Next-Cursor points at the next page, if there is one
+  const loadConversations = async (cursor = null) => {
     try {
-      const response = await axios.get('/api/conversations');
-      setConversations(response.data);
+      const response = await axios.get('/api/conversations', {
+        // axios leaves out a null cursor
+        params: { limit: CONVERSATION_PAGE_SIZE, cursor },
+      });
+      setConversations(prev => (cursor ? [...prev, ...response.data] : response.data));
+      setNextCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       console.error('Error loading conversations:', error);
     }
   };
 
+  // Open a conversation with its most recent messages; older ones are fetched with loadOlderMessages
+  const selectConversation = async (id) => {
+    try {
+      const response = await axios.get('/api/conversation', {
+        params: { id, limit: MESSAGE_PAGE_SIZE },
+      });
+      setCurrentConversation(response.data);
+    } catch (error) {
+      console.error('Error loading conversation:', error);
+    }
+  };
+
+  const loadOlderMessages = async () => {
+    const conversation = currentConversation;
+    try {
+      const response = await axios.get('/api/conversation', {
+        params: { id: conversation.id, limit: MESSAGE_PAGE_SIZE, before: conversation.before },
+      });
+      setCurrentConversation(prev => ({
+        ...prev,
+        messages: [...response.data.messages, ...prev.messages],
+        has_more: response.data.has_more,
+        before: response.data.before,
+      }));
+    } catch (error) {
+      console.error('Error loading older messages:', error);
+    }
+  };
+
+  // Fetch messages added after the client's last known seq (e.g. from another tab)
+  const catchUp = async (conversation) => {
+    const response = await axios.get('/api/conversation', {
+      params: { id: conversation.id, since_seq: conversation.seq },
+    });
+    return {
+      ...conversation,
+      messages: [...(conversation.messages || []), ...response.data.messages],
+      seq: response.data.seq,
+    };
+  };
+
   const handleSendMessage = async (message, file = null) => {
-    if (!currentConversation) {
+    let conversation = currentConversation;
+    if (!conversation) {
       // Create new conversation if none exists
       try {
         const response = await axios.get('/api/conversation');
-        setCurrentConversation(response.data);
+        conversation = response.data;
+        setCurrentConversation(conversation);
       } catch (error) {
         console.error('Error creating conversation:', error);
         return;
@@ -37,34 +90,96 @@ function App() {
 
     setIsLoading(true);
 
+    // Show the user's message and a reply that fills in as it streams
+    const pendingId = `pending-${Date.now()}`;
+    const setReply = (changes) => setCurrentConversation(prev => ({
+      ...prev,
+      messages: prev.messages.map(msg => (msg.id === pendingId ? { ...msg, ...changes } : msg)),
+    }));
+    setCurrentConversation({
+      ...conversation,
+      messages: [
+        ...(conversation.messages || []),
+        { id: `${pendingId}-user`, text: message, sender: 'user', timestamp: new Date().toISOString() },
+        { id: pendingId, text: '', sender: 'bot', timestamp: new Date().toISOString(), streaming: true },
+      ],
+    });
+
     try {
-      const formData = new FormData();
-      formData.append('conversation_id', currentConversation.id);
-      formData.append('message', message);
+      let fileInfo = null;
       if (file) {
+        const formData = new FormData();
         formData.append('file', file);
+        const upload = await axios.post('/api/upload', formData, {
+          headers: {
+            'Content-Type': 'multipart/form-data',
+          },
+        });
+        fileInfo = { name: file.name, size: file.size, type: file.type, uploadedPath: upload.data.filename };
       }
 
-      const response = await axios.post('/api/message', formData, {
-        headers: {
-          'Content-Type': 'multipart/form-data',
-        },
+      const response = await fetch('/api/chat/stream', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          message: message || (file ? `Attached: ${file.name}` : ''),
+          conversation_id: conversation.id,
+          file: fileInfo,
+        }),
       });
+      if (!response.ok) {
+        throw new Error('Failed to get streaming response');
+      }
 
-      setCurrentConversation(response.data.conversation);
+      // Reconnects with Last-Event-ID if the connection drops while the reply is generated
+      const reader = resumableReader(response, conversation.id);
+      const decoder = new TextDecoder();
+      let text = '';
+      let done = null;
+      while (!done) {
+        const chunk = await reader.read();
+        if (chunk.done) {
+          break;
+        }
+        for (const line of decoder.decode(chunk.value).split('\n')) {
+          if (!line.startsWith('data: ')) {
+            continue;
+          }
+          const data = JSON.parse(line.slice(6));
+          if (data.error) {
+            throw new Error(data.error);
+          }
+          if (data.content) {
+            text += data.content;
+            setReply({ text });
+          }
+          if (data.done) {
+            done = data;
+          }
+        }
+      }
+      if (!done) {
+        throw new Error('Stream ended early');
+      }
+
+      // The final frame only carries the new messages; append them to the local copy
+      const { messages, seq } = done;
+      if (conversation.seq === undefined || messages[0].seq === conversation.seq + 1) {
+        setCurrentConversation({
+          ...conversation,
+          messages: [...(conversation.messages || []), ...messages],
+          seq,
+        });
+      } else {
+        // Messages were added elsewhere in between, or the reply was recovered after a lost stream:
+        // catch up, which includes this turn
+        setCurrentConversation(await catchUp(conversation));
+      }
       await loadConversations();
     } catch (error) {
       console.error('Error sending message:', error);
       // Show error in the UI instead of fallback
-      setCurrentConversation(prev => ({
-        ...prev,
-        messages: [...prev.messages, {
-          id: Date.now().toString(),
-          text: 'Sorry, I encountered an error. Please try again.',
-          sender: 'bot',
-          timestamp: new Date().toISOString()
-        }]
-      }));
+      setReply({ text: 'Sorry, I encountered an error. Please try again.', streaming: false });
     } finally {
       setIsLoading(false);
     }
@@ -76,13 +191,16 @@ function App() {
       <div className="main-content">
         <Sidebar 
           conversations={conversations}
-          currentConversation={currentConversation}
-          onSelectConversation={setCurrentConversation}
+          hasMoreConversations={nextCursor !== null}
+          onLoadMoreConversations={() => loadConversations(nextCursor)}
+          currentConversationId={currentConversation?.id}
+          onConversationSelect={selectConversation}
           onNewConversation={() => setCurrentConversation(null)}
         />
         <ChatInterface
           conversation={currentConversation}
           onSendMessage={handleSendMessage}
+          onLoadOlderMessages={loadOlderMessages}
           isLoading={isLoading}
         />
       </div>
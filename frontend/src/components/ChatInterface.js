@@ -2,7 +2,7 @@ import React, { useState, useRef, useEffect } from 'react';
 import MessageList from './MessageList';
 import MessageInput from './MessageInput';
 
-const ChatInterface = ({ conversation, isLoading, onSendMessage }) => {
+const ChatInterface = ({ conversation, isLoading, onSendMessage, onLoadOlderMessages }) => {
   const [inputMessage, setInputMessage] = useState('');
   const [isSending, setIsSending] = useState(false);
   const messageAreaRef = useRef();
@@ -37,6 +37,8 @@ const ChatInterface = ({ conversation, isLoading, onSendMessage }) => {
       <MessageList 
         messages={conversation?.messages || []} 
         isLoading={isLoading}
+        hasOlderMessages={Boolean(conversation?.has_more)}
+        onLoadOlderMessages={onLoadOlderMessages}
         ref={messageAreaRef}
       />
       <MessageInput
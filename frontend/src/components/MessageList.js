@@ -1,7 +1,7 @@
 import React from 'react';
 import ReactMarkdown from 'react-markdown';
 
-const MessageList = ({ messages, isLoading }) => {
+const MessageList = ({ messages, isLoading, hasOlderMessages, onLoadOlderMessages }) => {
   const formatTimestamp = (timestamp) => {
     return new Date(timestamp).toLocaleTimeString();
   };
@@ -12,6 +12,13 @@ const MessageList = ({ messages, isLoading }) => {
 
   return (
     <div className="message-list">
+      {/* Only the most recent messages are loaded up front */}
+      {hasOlderMessages && (
+        <button className="load-more-button" onClick={onLoadOlderMessages}>
+          <i className="fas fa-chevron-up"></i> Load older messages
+        </button>
+      )}
+
       {messages.map((message) => (
         <div key={message.id} className={`message ${message.sender}`}>
           <div className="message-content">
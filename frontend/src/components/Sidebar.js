@@ -6,7 +6,9 @@ const Sidebar = ({
   onConversationSelect, 
   onNewConversation,
   onDeleteConversation,
-  onPinConversation
+  onPinConversation,
+  hasMoreConversations,
+  onLoadMoreConversations
 }) => {
   return (
     <div className="sidebar">
@@ -108,6 +110,13 @@ const Sidebar = ({
             ))}
           </>
         )}
+
+        {/* Older conversations are fetched a page at a time */}
+        {hasMoreConversations && (
+          <button className="load-more-button" onClick={onLoadMoreConversations}>
+            <i className="fas fa-chevron-down"></i> Load more
+          </button>
+        )}
       </div>
     </div>
   );
@@ -0,0 +1,150 @@
+/*
+ * Resumable reader for /api/chat/stream responses.
+ *
+ * A drop-in for response.body.getReader(): read() resolves with complete SSE
+ * frames only. If the connection drops before the final frame, it reconnects
+ * to /api/chat/stream/<generation> with Last-Event-ID and continues where it
+ * stopped; the reply keeps generating on the server in the meantime. When the
+ * server can no longer replay the missed frames (404/410), the stored reply is
+ * fetched from /api/conversation and delivered as the remaining frames.
+ */
+var MAX_ATTEMPTS = 5;
+
+function sleep(ms) {
+  return new Promise(function (resolve) { setTimeout(resolve, ms); });
+}
+
+function dataFrame(payload) {
+  return 'data: ' + JSON.stringify(payload) + '\n\n';
+}
+
+export default function resumableReader(response, conversationId) {
+  var encoder = new TextEncoder();
+  var decoder = new TextDecoder();
+  var generationId = response.headers.get('X-Generation-Id');
+  var reader = response.body.getReader();
+  var buffer = '';
+  var lastEventId = null;
+  // Reply text handed to the caller so far, to complete it from the stored message if needed
+  var delivered = '';
+  var finished = false;
+  var attempts = 0;
+
+  // Take the complete frames off the buffer, noting the last event ID and whether the reply ended
+  function takeFrames() {
+    var end = buffer.lastIndexOf('\n\n');
+    if (end < 0) {
+      return '';
+    }
+    var frames = buffer.slice(0, end + 2);
+    buffer = buffer.slice(end + 2);
+    frames.split('\n').forEach(function (line) {
+      if (line.indexOf('id: ') === 0) {
+        lastEventId = line.slice(4);
+      } else if (line.indexOf('data: ') === 0) {
+        try {
+          var data = JSON.parse(line.slice(6));
+          if (data.content) {
+            delivered += data.content;
+          }
+          if (data.done || data.error) {
+            finished = true;
+          }
+        } catch (e) {
+          // Not JSON; passed through for the caller to ignore
+        }
+      }
+    });
+    return frames;
+  }
+
+  // The stored reply, as the frames the caller has not seen yet; waits while it is still being generated
+  async function catchUp() {
+    var message = null;
+    for (var poll = 0; poll < MAX_ATTEMPTS * 2; poll++) {
+      var stored = await fetch('/api/conversation?id=' + encodeURIComponent(conversationId));
+      if (!stored.ok) {
+        throw new Error('Stream lost');
+      }
+      var conversation = await stored.json();
+      message = (conversation.messages || []).find(function (msg) { return msg.id === generationId; });
+      if (!message || message.status !== 'streaming') {
+        break;
+      }
+      await sleep(2000);
+    }
+    if (!message || message.status === 'streaming') {
+      throw new Error('Stream lost');
+    }
+    finished = true;
+    var rest = (message.text || '').slice(delivered.length);
+    var tail = rest ? dataFrame({ content: rest }) : '';
+    if (message.status === 'interrupted') {
+      return tail + dataFrame({ error: 'The reply was interrupted' });
+    }
+    return tail + dataFrame({ done: true, messages: [message], seq: message.seq });
+  }
+
+  // Reconnect after a drop; returns closing frames when the reply had to be caught up instead
+  async function reconnect() {
+    while (true) {
+      if (!generationId || attempts >= MAX_ATTEMPTS) {
+        throw new Error('Stream lost');
+      }
+      attempts += 1;
+      await sleep(500 * Math.pow(2, attempts - 1));
+      var resumed;
+      try {
+        resumed = await fetch('/api/chat/stream/' + encodeURIComponent(generationId), {
+          headers: lastEventId ? { 'Last-Event-ID': lastEventId } : {}
+        });
+      } catch (e) {
+        // Still offline
+        continue;
+      }
+      if (resumed.status === 404 || resumed.status === 410) {
+        return catchUp();
+      }
+      if (resumed.ok) {
+        // A partial frame from the dropped connection is sent again after lastEventId
+        buffer = '';
+        reader = resumed.body.getReader();
+        return null;
+      }
+    }
+  }
+
+  async function read() {
+    while (true) {
+      var frames = takeFrames();
+      if (frames) {
+        return { done: false, value: encoder.encode(frames) };
+      }
+      if (finished) {
+        return { done: true, value: undefined };
+      }
+      var result = null;
+      try {
+        result = await reader.read();
+      } catch (e) {
+        // Connection dropped
+      }
+      if (result && !result.done) {
+        attempts = 0;
+        buffer += decoder.decode(result.value, { stream: true });
+        continue;
+      }
+      // Closed or failed before the final frame
+      var tail = await reconnect();
+      if (tail) {
+        return { done: false, value: encoder.encode(tail) };
+      }
+    }
+  }
+
+  return {
+    read: read,
+    cancel: function (reason) { return reader.cancel(reason); },
+    releaseLock: function () { reader.releaseLock(); }
+  };
+}
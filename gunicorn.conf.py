@@ -0,0 +1,69 @@
+"""
+Gunicorn settings, picked up automatically from the working directory.
+
+SERVER_MODE=sync (default) keeps the classic sync workers. SERVER_MODE=async
+switches to gevent workers: every request, including each open
+/api/chat/stream response, runs in a greenlet, so a single worker process can
+hold hundreds of concurrent streams. The gevent worker monkey-patches sockets
+before the app is imported, which makes PyMongo and the OpenAI HTTP client
+cooperative without changing any route code.
+
+Metrics are collected in prometheus_client's multiprocess mode: every worker
+writes to PROMETHEUS_MULTIPROC_DIR, which is set here before any worker
+imports the app. Unless it is configured, each server gets a fresh temporary
+directory that is removed again on shutdown, so several instances on one host
+never share or wipe each other's samples. A configured directory is emptied of
+old samples when the server starts and must not be shared between instances.
+
+When a worker exits, replies it is still generating are marked interrupted
+and its write-behind queue of streamed replies is flushed before the process
+goes away.
+"""
+import glob
+import os
+import shutil
+import tempfile
+
+server_mode = os.environ.get("SERVER_MODE", "sync")
+
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+
+# Generations can take a while; sync workers are blocked for the whole stream
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+
+if server_mode == "async":
+    worker_class = "gevent"
+    # Maximum simultaneous connections (open streams) per worker
+    worker_connections = int(os.environ.get("WORKER_CONNECTIONS", "1000"))
+
+if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    # Also recorded in the environment, since a reload (SIGHUP) reads this file again
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = os.environ["SUMERSAULT_OWNED_METRICS_DIR"] = \
+        tempfile.mkdtemp(prefix="sumersault-metrics-")
+
+
+def on_starting(server):
+    # Samples left by a previous run would be aggregated into the new one
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+        os.remove(path)
+
+
+def on_exit(server):
+    owned_metrics_dir = os.environ.get("SUMERSAULT_OWNED_METRICS_DIR")
+    if owned_metrics_dir and owned_metrics_dir == os.environ["PROMETHEUS_MULTIPROC_DIR"]:
+        shutil.rmtree(owned_metrics_dir, ignore_errors=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    import sys
+    # The app module is already loaded in the worker; don't import it just to drain it
+    app_module = sys.modules.get("main")
+    if app_module is not None and getattr(app_module, "message_writer", None) is not None:
+        app_module.message_writer.close()
@@ -3,29 +3,54 @@ import os
 import logging
 import uuid
 import time
+import threading
 from datetime import datetime
-from flask import Flask, request, jsonify, send_from_directory, session, redirect, url_for, render_template, Response
+from flask import Flask, request, jsonify, session, redirect, url_for, render_template, Response, stream_with_context
 from flask_cors import CORS
 from flask_pymongo import PyMongo
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.utils import secure_filename
-from openai import AzureOpenAI
 from authlib.integrations.flask_client import OAuth
 from dotenv import load_dotenv
 from bson.objectid import ObjectId
+from backend.message_store import STATUS_INTERRUPTED, STATUS_STREAMING, MessageStore, make_preview, prompt_text
+from backend.context_window import ContextWindowBuilder, TokenCounter
+from backend.summarizer import ConversationSummarizer
+from backend.text_cache import ExtractedTextCache
+from backend.blob_store import BlobStore
+from backend.extraction import ExtractionService, STATUS_PENDING
+from backend.retrieval import create_retriever
+from backend.pagination import encode_cursor, conversations_after
+from backend.schema import backfill_listing_fields, ensure_indexes
+from backend.user_cache import UserCache
+from backend.pool_monitor import MongoPoolMonitor
+from backend.completions import CompletionGateway, create_http_client
+from backend.llm import AzureBackend, FakeBackend, OpenAICompatibleBackend
+from backend.static_assets import StaticAssets
+from backend.downloads import send_upload
+from backend.response_cache import ResponseCache, cache_scope
+from backend.coalescing import StreamCoalescer
+from backend.write_behind import MessageCheckpoint, WriteBehindWriter
+from backend.replay import create_replay_store, event_stream, parse_event_id
+from backend.sse import DeltaBatcher, encode_json, frame
+from backend.telemetry import CompletionTelemetry
+from backend.metrics import (MongoCommandTimer, instrument_app, observe_cache_hit, observe_completion, observe_upload,
+                             render_metrics, track_stream)
 import secrets
 import urllib.parse
-import json
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
-app = Flask(__name__, static_folder='static/react-build', static_url_path='')
+# The React build is served by ``static_assets`` (precompressed, content-hashed) instead of Flask's static route
+app = Flask(__name__, static_folder=None)
 
 # Basic Flask Configuration
 CORS(app)
+# Request latency histograms for every route, exposed on /metrics
+instrument_app(app)
 app.secret_key = os.environ.get("SESSION_SECRET", "sumersault-dev-secret")
 
 # Session configuration for OAuth state management
@@ -41,21 +66,36 @@ app.config['PREFERRED_URL_SCHEME'] = 'https'
 # MongoDB Configuration
 app.config["MONGO_URI"] = os.environ.get("MONGO_URI", "mongodb://localhost:27017/sumersault")
 
+# Pool sizes and timeouts; checkouts are instrumented for /healthz
+mongo_pool_monitor = MongoPoolMonitor()
+
 try:
-    mongo = PyMongo(app)
+    mongo = PyMongo(
+        app,
+        maxPoolSize=int(os.environ.get("MONGO_MAX_POOL_SIZE", "100")),
+        minPoolSize=int(os.environ.get("MONGO_MIN_POOL_SIZE", "0")),
+        waitQueueTimeoutMS=int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000")),
+        connectTimeoutMS=int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        socketTimeoutMS=int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", "30000")),
+        serverSelectionTimeoutMS=int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        event_listeners=[mongo_pool_monitor, MongoCommandTimer()]
+    )
     logger.info(f"PyMongo initialized with URI: {app.config['MONGO_URI']}")
 
     # Test connection with a simpler approach
     try:
         # Use a simpler connection test
-        client = mongo.cx  # Get the underlying pymongo client
-        client.admin.command('ping')
+        mongo_client = mongo.cx  # Get the underlying pymongo client
+        mongo_client.admin.command('ping')
         logger.info("✅ MongoDB Atlas connected successfully!")
 
         # Test database access
-        db = client.get_database('SaultoChat')
+        db = mongo_client.get_database('SaultoChat')
         logger.info(f"✅ Database 'SaultoChat' accessible")
 
+        ensure_indexes(mongo.db)
+        backfill_listing_fields(mongo.db)
+
     except Exception as e:
         logger.error(f"❌ MongoDB connection test failed: {str(e)}")
 
@@ -63,14 +103,7 @@ except Exception as e:
     logger.error(f"❌ PyMongo initialization failed: {str(e)}")
     mongo = None
 
-# Login Manager Setup
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = "login"
-
-# OAuth Setup - Microsoft Only (ONLY ONE REGISTRATION)
-oauth = OAuth(app)
-
+message_store = MessageStore(mongo.db) if mongo else None
 
 # File upload configuration
 UPLOAD_FOLDER = 'uploads'
@@ -84,20 +117,194 @@ app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 # Ensure upload directory exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Let a fronting proxy stream downloads: '' (send from the app), 'x-accel' (nginx) or 'x-sendfile'
+DOWNLOAD_OFFLOAD = os.environ.get("DOWNLOAD_OFFLOAD", "") or None
+DOWNLOAD_ACCEL_PREFIX = os.environ.get("DOWNLOAD_ACCEL_PREFIX", "/protected-uploads/")
+
+# Text extracted from uploads, keyed by content hash
+text_cache = ExtractedTextCache(
+    mongo.db if mongo else None,
+    max_bytes=int(os.environ.get("TEXT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+)
+
+# Attachments longer than this are chunked and only the most relevant chunks are sent
+ATTACHMENT_INLINE_CHARS = int(os.environ.get("ATTACHMENT_INLINE_CHARS", "10000"))
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "4"))
+
+retriever = create_retriever(
+    os.path.join(UPLOAD_FOLDER, 'index'),
+    embedding_model=os.environ.get("RETRIEVAL_EMBEDDING_MODEL")
+)
+
+# PDF/Office documents are converted to text by background worker processes
+extraction_service = ExtractionService(
+    text_cache,
+    retriever=retriever,
+    index_min_chars=ATTACHMENT_INLINE_CHARS,
+    max_workers=int(os.environ.get("EXTRACTION_WORKERS", "2")),
+    timeout=int(os.environ.get("EXTRACTION_TIMEOUT", "60")),
+    memory_limit_mb=int(os.environ.get("EXTRACTION_MEMORY_LIMIT_MB", "512"))
+)
+
+# Login Manager Setup
+login_manager = LoginManager()
+login_manager.init_app(app)
+login_manager.login_view = "login"
+
+# OAuth Setup - Microsoft Only (ONLY ONE REGISTRATION)
+oauth = OAuth(app)
+
+
+# Frontend assets: precompressed and content-hashed by `python -m backend.static_assets`
+static_assets = StaticAssets(
+    os.path.join(app.root_path, 'static', 'react-build'),
+    os.path.join(app.root_path, 'static', 'dist')
+)
+
+# Uploads are stored content-addressed: identical files share one blob on disk
+blob_store = BlobStore(mongo.db if mongo else None, UPLOAD_FOLDER)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Initialize OpenAI client
+def wants_event_stream():
+    """Whether the client asked for a server-sent event response (``stream=1`` or ``Accept: text/event-stream``)"""
+    stream_flag = request.values.get('stream', '').lower()
+    if stream_flag in ('1', 'true', 'yes'):
+        return True
+    return 'text/event-stream' in request.headers.get('Accept', '')
+
+# Prompt context budget: system prompt + latest message + as many recent turns as fit
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "8000"))
+context_builder = ContextWindowBuilder(
+    CONTEXT_TOKEN_BUDGET,
+    TokenCounter(os.environ.get("CONTEXT_TOKENIZER", "o200k_base"))
+)
+
+# Completion API connection pool and timeouts (seconds); the stream timeout is the longest gap between chunks
+AZURE_OPENAI_CONNECT_TIMEOUT = float(os.environ.get("AZURE_OPENAI_CONNECT_TIMEOUT", "5"))
+AZURE_OPENAI_READ_TIMEOUT = float(os.environ.get("AZURE_OPENAI_READ_TIMEOUT", "60"))
+AZURE_OPENAI_STREAM_TIMEOUT = float(os.environ.get("AZURE_OPENAI_STREAM_TIMEOUT", "30"))
+AZURE_OPENAI_POOL_TIMEOUT = float(os.environ.get("AZURE_OPENAI_POOL_TIMEOUT", "10"))
+
+# Completion backend: azure (default), openai (any OpenAI-compatible server) or fake (local, for benchmarks)
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "azure")
+
 try:
-    client = AzureOpenAI(
-        api_key=os.getenv("AZURE_OPENAI_KEY"),
-        api_version="2024-12-01-preview",
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-    )
-    logger.info("Azure OpenAI client initialized successfully")
+    if LLM_BACKEND == 'fake':
+        llm_backend = FakeBackend(
+            ttft_ms=float(os.environ.get("FAKE_LLM_TTFT_MS", "300")),
+            token_delay_ms=float(os.environ.get("FAKE_LLM_TOKEN_DELAY_MS", "30")),
+            tokens=int(os.environ.get("FAKE_LLM_TOKENS", "100")),
+            error_rate=float(os.environ.get("FAKE_LLM_ERROR_RATE", "0")),
+            rate_limit_rate=float(os.environ.get("FAKE_LLM_RATE_LIMIT_RATE", "0")),
+            stream_error_rate=float(os.environ.get("FAKE_LLM_STREAM_ERROR_RATE", "0")),
+            seed=int(os.environ.get("FAKE_LLM_SEED", "0"))
+        )
+    else:
+        http_client = create_http_client(
+            max_connections=int(os.environ.get("AZURE_OPENAI_MAX_CONNECTIONS", "100")),
+            max_keepalive=int(os.environ.get("AZURE_OPENAI_MAX_KEEPALIVE", "20")),
+            connect_timeout=AZURE_OPENAI_CONNECT_TIMEOUT,
+            read_timeout=AZURE_OPENAI_READ_TIMEOUT,
+            pool_timeout=AZURE_OPENAI_POOL_TIMEOUT
+        )
+        if LLM_BACKEND == 'openai':
+            llm_backend = OpenAICompatibleBackend(
+                os.environ.get("OPENAI_BASE_URL", "http://localhost:8000/v1"),
+                os.environ.get("OPENAI_MODEL", "default"),
+                api_key=os.environ.get("OPENAI_API_KEY"),
+                http_client=http_client
+            )
+        else:
+            llm_backend = AzureBackend(
+                os.getenv("AZURE_OPENAI_ENDPOINT"),
+                os.getenv("AZURE_OPENAI_KEY"),
+                os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
+                http_client=http_client
+            )
+    logger.info(f"Completion backend '{llm_backend.name}' initialized with model {llm_backend.model}")
 except Exception as e:
-    logger.error(f"Error initializing Azure OpenAI client: {str(e)}")
-    client = None
+    logger.error(f"Error initializing completion backend '{LLM_BACKEND}': {str(e)}")
+    llm_backend = None
+
+# Every completion call goes through the gateway: timeouts, retries with backoff, in-flight accounting
+completions = CompletionGateway(
+    llm_backend,
+    max_retries=int(os.environ.get("AZURE_OPENAI_MAX_RETRIES", "3")),
+    connect_timeout=AZURE_OPENAI_CONNECT_TIMEOUT,
+    read_timeout=AZURE_OPENAI_READ_TIMEOUT,
+    stream_timeout=AZURE_OPENAI_STREAM_TIMEOUT,
+    pool_timeout=AZURE_OPENAI_POOL_TIMEOUT
+)
+
+# Generation parameters shared by every chat completion call (and part of the response cache key)
+COMPLETION_PARAMS = {"max_tokens": 1000, "temperature": 0.7}
+
+# Opt-in: identical prompts within a company are answered from a per-worker cache
+response_cache = ResponseCache(
+    enabled=os.environ.get("RESPONSE_CACHE_ENABLED", "0") == "1",
+    ttl=int(os.environ.get("RESPONSE_CACHE_TTL", "3600")),
+    max_entries=int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "1000")),
+    max_bytes=int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+)
+
+# One structured record per completion, written off the request thread; bodies only on a sample
+telemetry = CompletionTelemetry(
+    payload_sample_rate=float(os.environ.get("TELEMETRY_PAYLOAD_SAMPLE_RATE", "0.01")),
+    payload_chars=int(os.environ.get("TELEMETRY_PAYLOAD_CHARS", "500"))
+)
+
+# Identical prompts arriving while the first is still generating share its stream
+coalescer = StreamCoalescer(enabled=os.environ.get("COALESCE_COMPLETIONS", "1") == "1")
+
+# Streamed replies are checkpointed and finalized through a batched background writer
+message_writer = WriteBehindWriter(
+    mongo.db,
+    flush_interval=int(os.environ.get("WRITE_BEHIND_FLUSH_MS", "250")) / 1000,
+    max_batch=int(os.environ.get("WRITE_BEHIND_MAX_BATCH", "500"))
+) if mongo else None
+STREAM_CHECKPOINT_SECONDS = float(os.environ.get("STREAM_CHECKPOINT_SECONDS", "2"))
+# A reply still streaming without a checkpoint for this long lost its worker; it is marked interrupted
+STALE_REPLY_SECONDS = float(os.environ.get("STALE_REPLY_SECONDS", "300"))
+STALE_REPLY_SWEEP_SECONDS = float(os.environ.get("STALE_REPLY_SWEEP_SECONDS", "60"))
+
+
+def sweep_stale_replies():
+    """Interrupt replies orphaned by dead workers, at startup and then every ``STALE_REPLY_SWEEP_SECONDS``"""
+    while True:
+        try:
+            count = message_store.interrupt_stale(STALE_REPLY_SECONDS)
+            if count:
+                logger.info(f"Marked {count} orphaned streaming replies as interrupted")
+        except Exception as e:
+            logger.error(f"Error sweeping stale replies: {str(e)}")
+        time.sleep(STALE_REPLY_SWEEP_SECONDS)
+
+
+if message_store and STALE_REPLY_SWEEP_SECONDS > 0:
+    threading.Thread(target=sweep_stale_replies, name='stale-reply-sweep', daemon=True).start()
+
+# Streamed replies run off the request; their frames are kept so a dropped connection can resume with Last-Event-ID
+replay_store = create_replay_store(
+    os.environ.get("REPLAY_REDIS_URL") or None,
+    max_frames=int(os.environ.get("REPLAY_MAX_FRAMES", "4096")),
+    ttl=int(os.environ.get("REPLAY_TTL_SECONDS", "300"))
+)
+REPLAY_ABANDON_SECONDS = float(os.environ.get("REPLAY_ABANDON_SECONDS", "30"))
+# Deltas are merged into at most one SSE frame per SSE_FLUSH_MS (or per SSE_FLUSH_BYTES); 0 sends one per delta
+SSE_FLUSH_MS = float(os.environ.get("SSE_FLUSH_MS", "50"))
+SSE_FLUSH_BYTES = int(os.environ.get("SSE_FLUSH_BYTES", "1024"))
+
+# Older turns are folded into a running summary stored on the conversation
+summarizer = ConversationSummarizer(
+    mongo.db if mongo else None,
+    completions if completions.enabled and os.environ.get("SUMMARY_ENABLED", "1") == "1" else None,
+    completions.model,
+    keep_recent=int(os.environ.get("SUMMARY_KEEP_RECENT", "12")),
+    min_batch=int(os.environ.get("SUMMARY_MIN_BATCH", "6")),
+    stale_reply_seconds=STALE_REPLY_SECONDS
+)
 
 # User class for Flask-Login
 class User(UserMixin):
@@ -129,13 +336,23 @@ class User(UserMixin):
         company_name = domain.split('.')[0].capitalize()
         return company_name
     
-@login_manager.user_loader
-def load_user(user_id):
+def fetch_user(user_id):
     user_data = mongo.db.users.find_one({"_id": ObjectId(user_id)})
     if not user_data:
         return None
     return User(user_data)
 
+# Users are cached per worker; writes elsewhere become visible within USER_CACHE_TTL seconds
+user_cache = UserCache(
+    fetch_user,
+    ttl=float(os.environ.get("USER_CACHE_TTL", "30")),
+    max_entries=int(os.environ.get("USER_CACHE_MAX_ENTRIES", "10000"))
+)
+
+@login_manager.user_loader
+def load_user(user_id):
+    return user_cache.get(user_id)
+
 # Authentication routes
 @app.route('/login')
 def login():
@@ -283,6 +500,7 @@ def microsoft_auth():
                 }}
             )
 
+            user_cache.invalidate(user_data['_id'])
             logger.info(f"Updated existing user: {email}")
 
         # Login the user
@@ -305,11 +523,11 @@ def logout():
 @app.route('/')
 @login_required
 def index():
-    return send_from_directory(app.static_folder, 'index.html')
+    return static_assets.serve('index.html')
 
 @app.route('/<path:path>')
 def serve_static(path):
-    return send_from_directory(app.static_folder, path)
+    return static_assets.serve(path)
 
 @app.route('/api/conversation', methods=['GET'])
 @login_required
@@ -322,11 +540,33 @@ def get_conversation():
             conversation = mongo.db.conversations.find_one({
                 "_id": ObjectId(conversation_id),
                 "user_id": ObjectId(current_user.id)
-            })
+            }, projection={"messages": 0})
 
             if not conversation:
                 return jsonify({"error": "Conversation not found"}), 404
 
+            since_seq = request.args.get('since_seq')
+            if since_seq is not None:
+                # Catch-up: only the messages added after the client's last known seq
+                conversation.update(message_store.since(
+                    conversation['_id'],
+                    since_seq,
+                    limit=request.args.get('limit', 200)
+                ))
+            else:
+                # With limit= or before=, return a window of the most recent messages; older ones are paged
+                # with ?before=<seq>. Without either the whole history is returned, for clients that don't
+                # page (the prebuilt page reads only ``messages``)
+                paged = 'limit' in request.args or 'before' in request.args
+                page = message_store.page(
+                    conversation['_id'],
+                    limit=request.args.get('limit', 50) if paged else None,
+                    before=request.args.get('before')
+                )
+                conversation.update(page)
+                # Seq of the newest message, for ?since_seq= on the next catch-up
+                conversation['seq'] = conversation.get('message_count', 0) - 1
+
             # Convert ObjectId to string for JSON serialization
             conversation['id'] = str(conversation['_id'])
             del conversation['_id']
@@ -341,11 +581,16 @@ def get_conversation():
             "title": f"New Conversation",
             "created_at": datetime.now(),
             "updated_at": datetime.now(),
-            "messages": []
+            "message_count": 0,
+            "pinned": False
         }
 
         conversation_id = mongo.db.conversations.insert_one(new_conversation).inserted_id
         new_conversation['id'] = str(conversation_id)
+        new_conversation['messages'] = []
+        new_conversation['has_more'] = False
+        new_conversation['before'] = None
+        new_conversation['seq'] = -1
         del new_conversation['_id']
         return jsonify(new_conversation)
 
@@ -361,20 +606,22 @@ def add_message():
         logger.info(f"File received in request: {file.filename if file else 'None'}")
 
         if file and file.filename and allowed_file(file.filename):
-            # Generate a secure filename with UUID to prevent collisions
             filename = secure_filename(file.filename)
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
 
-            # Save the file
-            file.save(file_path)
+            # Stream the file to disk, hashing it on the way
+            upload = blob_store.save(file, ObjectId(current_user.id), filename)
+            observe_upload(upload['size'])
+            file_path = upload['path']
 
             # Create file info for storing in the message
             file_info = {
                 'name': filename,
                 'path': file_path,
                 'type': file.content_type,
-                'size': os.path.getsize(file_path)
+                'size': upload['size'],
+                'upload_id': upload['id'],
+                # Extract the text once (documents in the background) instead of re-reading the file on every turn
+                'content_hash': extraction_service.process_upload(file_path, filename, file.content_type, upload['content_hash'])
             }
             logger.info(f"File uploaded: {filename} ({file_info['size']} bytes), path: {file_path}, type: {file.content_type}")
         else:
@@ -396,7 +643,7 @@ def add_message():
         conversation = mongo.db.conversations.find_one({
             "_id": ObjectId(conversation_id),
             "user_id": ObjectId(current_user.id)
-        })
+        }, projection={"messages": 0})
 
         if not conversation:
             return jsonify({'error': 'Conversation not found or access denied'}), 404
@@ -415,48 +662,106 @@ def add_message():
         # Generate AI response
         message_with_file_info = message_text
         if file_info:
-            message_with_file_info = f"{message_text}\n[File attached: {file_info['name']}]"
-
-        ai_response_text = generate_ai_response(message_with_file_info, conversation.get('messages', []))
-
-        # Add AI response to the conversation with user context
-        ai_message = {
-            'id': str(uuid.uuid4()),
-            'text': ai_response_text,
-            'sender': 'bot',
-            'for_user_id': str(current_user.id),  # Track which user this response was generated for
-            'timestamp': datetime.now().isoformat()
-        }
+            # Include the new attachment (or its most relevant chunks) in this turn's prompt
+            message_with_file_info = format_history_message(user_message, query=message_text)['content']
+
+        # Turns up to summary_seq are covered by the stored summary
+        summary = conversation.get('summary')
+        history = message_store.iter_recent(conversation['_id'], after=conversation.get('summary_seq'))
+
+        def store_turn(ai_response_text):
+            # Add AI response to the conversation with user context
+            ai_message = {
+                'id': str(uuid.uuid4()),
+                'text': ai_response_text,
+                'sender': 'bot',
+                'for_user_id': str(current_user.id),  # Track which user this response was generated for
+                'timestamp': datetime.now().isoformat()
+            }
 
-        # Update the conversation with both messages - ensure user can only modify their own conversations
-        mongo.db.conversations.update_one(
-            {
-                "_id": ObjectId(conversation_id),
-                "user_id": ObjectId(current_user.id)  # Critical security check
-            },
-            {
-                "$push": {"messages": {"$each": [user_message, ai_message]}},
-                "$set": {
+            # Store both messages - ensure user can only modify their own conversations
+            stored = message_store.append(
+                {
+                    "_id": ObjectId(conversation_id),
+                    "user_id": ObjectId(current_user.id)  # Critical security check
+                },
+                [user_message, ai_message],
+                extra_set={
                     "updated_at": datetime.now(),
                     "last_accessed_by": current_user.email,  # Track for audit purposes
                     "access_timestamp": datetime.now()
                 }
-            }
-        )
+            )
+            if stored is not None:
+                summarizer.refresh_in_background(conversation['_id'])
+            return stored
+
+        # Streaming mode: forward deltas as server-sent events, then persist the same two messages
+        if wants_event_stream():
+            def generate_stream():
+                start_time = time.time()
+                ttft_ms = None
+                ai_response_text = ""
+                batcher = DeltaBatcher(SSE_FLUSH_MS, SSE_FLUSH_BYTES)
 
-        # Retrieve the updated conversation - with user verification
-        updated_conversation = mongo.db.conversations.find_one({
-            "_id": ObjectId(conversation_id),
-            "user_id": ObjectId(current_user.id)  # Ensure we only return the user's own conversation
-        })
-        
-        if not updated_conversation:
+                try:
+                    for content in stream_ai_response(message_with_file_info, history, summary, batcher.timeout):
+                        # None: no delta within the batching window, so whatever is buffered is due
+                        if content is None:
+                            text = batcher.due()
+                        else:
+                            if ttft_ms is None:
+                                ttft_ms = round((time.time() - start_time) * 1000)
+                            ai_response_text += content
+                            text = batcher.add(content)
+                        if text:
+                            yield frame({'content': text})
+                    text = batcher.flush()
+                    if text:
+                        yield frame({'content': text})
+                except Exception as e:
+                    logger.error(f"Error streaming AI response: {str(e)}")
+                    ai_response_text = f"I apologize, but I encountered an error while processing your request. Please try again later. Error: {str(e)}"
+                    yield frame({'error': str(e)})
+
+                stored = store_turn(ai_response_text)
+                if stored is None:
+                    yield frame({'error': 'Conversation not found or access denied'})
+                    return
+
+                timing = {'ttft_ms': ttft_ms, 'total_ms': round((time.time() - start_time) * 1000)}
+                yield frame({'done': True, 'messages': stored, 'message': stored[-1], 'seq': stored[-1]['seq'], 'timing': timing})
+
+            return Response(
+                stream_with_context(track_stream('/api/message', generate_stream())),
+                mimetype='text/event-stream',
+                headers={
+                    'Cache-Control': 'no-cache',
+                    'X-Accel-Buffering': 'no'
+                }
+            )
+
+        start_time = time.time()
+        ai_response_text = generate_ai_response(message_with_file_info, history, summary)
+        # Without streaming the first token arrives with the full response
+        response_ms = round((time.time() - start_time) * 1000)
+
+        stored = store_turn(ai_response_text)
+
+        if stored is None:
             return jsonify({'error': 'Conversation not found or access denied'}), 404
-            
-        updated_conversation['id'] = str(updated_conversation['_id'])
-        del updated_conversation['_id']
 
-        return jsonify({'conversation': updated_conversation, 'message': ai_message})
+        # Only the new messages go back; the client appends them to its copy of the conversation
+        ai_message = stored[-1]
+
+        timing = {'ttft_ms': response_ms, 'total_ms': response_ms}
+        return jsonify({
+            'conversation_id': conversation_id,
+            'messages': stored,
+            'message': ai_message,
+            'seq': ai_message['seq'],
+            'timing': timing
+        })
 
     except Exception as e:
         logger.error(f"Error adding message: {str(e)}")
@@ -465,27 +770,49 @@ def add_message():
 @app.route('/api/conversations', methods=['GET'])
 @login_required
 def get_all_conversations():
-    # Return just the list of conversation IDs and their first message for the sidebar
-    conversation_list = []
-    user_conversations = mongo.db.conversations.find(
-        {"user_id": ObjectId(current_user.id)},
-        sort=[("updated_at", -1)]  # Sort by most recently updated
-    )
+    # Return the sidebar listing: only the denormalized listing fields, pinned conversations first
+    cursor = request.args.get('cursor')
+    # Paging is opt-in (limit= or cursor=): clients that don't follow X-Next-Cursor, like the prebuilt
+    # page, would otherwise lose every conversation past the first page
+    limit = None
+    if 'limit' in request.args or cursor:
+        try:
+            limit = max(1, min(int(request.args.get('limit', 50)), 200))
+        except ValueError:
+            return jsonify({'error': 'Invalid limit'}), 400
 
-    for conv in user_conversations:
-        first_message = ''
-        if conv.get('messages') and len(conv.get('messages')) > 0:
-            first_message = conv.get('messages')[0].get('text', 'New conversation')
-        else:
-            first_message = "New conversation"
+    query = {"user_id": ObjectId(current_user.id)}
+    if cursor:
+        try:
+            query.update(conversations_after(cursor))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    user_conversations = list(mongo.db.conversations.find(
+        query,
+        projection={"preview": 1, "title": 1, "pinned": 1, "updated_at": 1},
+        sort=[("pinned", -1), ("updated_at", -1), ("_id", -1)]
+    ).limit(limit + 1 if limit else 0))
 
+    has_more = limit is not None and len(user_conversations) > limit
+    user_conversations = user_conversations[:limit]
+
+    conversation_list = []
+    for conv in user_conversations:
         conversation_list.append({
             'id': str(conv['_id']),
-            'preview': first_message[:50] + ('...' if len(first_message) > 50 else ''),
-            'pinned': conv.get('pinned', False)
+            'preview': conv.get('preview') or make_preview(None),
+            'title': conv.get('title', ''),
+            'pinned': conv.get('pinned', False),
+            'updated_at': conv.get('updated_at')
         })
 
-    return jsonify(conversation_list)
+    response = jsonify(conversation_list)
+    # The body stays a plain list; the next page is reached via ?cursor=<X-Next-Cursor>
+    if has_more:
+        last = user_conversations[-1]
+        response.headers['X-Next-Cursor'] = encode_cursor(last.get('pinned', False), last.get('updated_at'), last['_id'])
+    return response
 
 @app.route('/api/conversation', methods=['DELETE'])
 @login_required
@@ -505,6 +832,12 @@ def delete_conversation():
         if result.deleted_count == 0:
             return jsonify({'error': 'Conversation not found or access denied'}), 404
 
+        # Drop the conversation's messages and its references to uploaded blobs
+        upload_ids = message_store.upload_ids(ObjectId(conversation_id))
+        message_store.delete(ObjectId(conversation_id))
+        for upload_id in upload_ids:
+            blob_store.release(ObjectId(upload_id))
+
         logger.info(f"Deleted conversation: {conversation_id}")
         return jsonify({'success': True})
     except Exception as e:
@@ -570,53 +903,206 @@ def upload_file():
     
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        # Add timestamp to prevent filename conflicts
-        timestamp = str(int(time.time()))
-        filename = f"{timestamp}_{filename}"
-        
-        upload_dir = os.environ.get('UPLOAD_DIR', 'uploads')
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        file_path = os.path.join(upload_dir, filename)
-        file.save(file_path)
+
+        # Stream the file to disk, hashing it on the way; the upload ID is the client's handle to it
+        upload = blob_store.save(file, ObjectId(current_user.id), filename)
+        observe_upload(upload['size'])
+        extraction_service.process_upload(upload['path'], filename, file.content_type, upload['content_hash'])
         
         return jsonify({
             'message': 'File uploaded successfully',
-            'filename': filename,
-            'originalName': file.filename
+            'filename': upload['id'],
+            'originalName': file.filename,
+            'contentHash': upload['content_hash']
         })
     
     return jsonify({'error': 'File type not allowed'}), 400
 
+def find_legacy_attachment(filename, user_id):
+    """
+    Attachment info for a file stored directly in the upload folder before
+    uploads had metadata, if one of the user's own messages references it.
+    """
+    path = os.path.join(UPLOAD_FOLDER, secure_filename(filename))
+    conversation_ids = [c['_id'] for c in mongo.db.conversations.find({"user_id": user_id}, projection={"_id": 1})]
+    message = mongo.db.messages.find_one(
+        {"conversation_id": {"$in": conversation_ids}, "file.path": path},
+        projection={"file": 1}
+    )
+    return message['file'] if message else None
+
 @app.route('/api/uploads/<filename>', methods=['GET'])
 @login_required
 def download_file(filename):
     """
-    Serve uploaded files for download
+    Serve uploaded files for download (Range and conditional requests supported)
+    """
+    user_id = ObjectId(current_user.id)
+    # Attachments link the content hash; /api/upload hands out the upload ID. Either must belong to the user.
+    if ObjectId.is_valid(filename):
+        upload = mongo.db.uploads.find_one({"_id": ObjectId(filename), "user_id": user_id})
+    else:
+        upload = mongo.db.uploads.find_one({"content_hash": filename, "user_id": user_id})
+    if upload is None:
+        upload = find_legacy_attachment(filename, user_id)
+
+    if upload is None or not os.path.isfile(upload['path']):
+        return jsonify({'error': 'File not found'}), 404
+
+    return send_upload(
+        upload['path'],
+        upload.get('name') or filename,
+        mimetype=upload.get('type'),
+        content_hash=upload.get('content_hash'),
+        upload_root=UPLOAD_FOLDER,
+        offload=DOWNLOAD_OFFLOAD,
+        accel_prefix=DOWNLOAD_ACCEL_PREFIX
+    )
+
+@app.route('/api/uploads/<upload_id>/status', methods=['GET'])
+@login_required
+def upload_status(upload_id):
+    """Report whether an upload's text has been extracted yet"""
+    if not ObjectId.is_valid(upload_id):
+        return jsonify({'error': 'Invalid upload ID'}), 400
+
+    upload = mongo.db.uploads.find_one({"_id": ObjectId(upload_id), "user_id": ObjectId(current_user.id)})
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+
+    entry = extraction_service.lookup_file(upload)
+    return jsonify({
+        'id': upload_id,
+        'name': upload['name'],
+        'status': entry['status'] if entry else 'unknown',
+        'chars': len(entry['text']) if entry and entry['text'] else 0,
+        'error': entry.get('error') if entry else None
+    })
+
+def resolve_uploaded_file(file_data, user_id):
+    """
+    Resolve the file reference sent by the streaming client into stored file info.
+
+    Args:
+        file_data (dict): The client's file object; ``uploadedPath`` is the ID returned by /api/upload
+        user_id (ObjectId): The requesting user, who must own the upload
+
+    Returns:
+        dict: File info in the same shape as message attachments, or None if the user owns no such file
     """
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    uploaded_path = file_data.get('uploadedPath', '')
+    if ObjectId.is_valid(uploaded_path):
+        upload = mongo.db.uploads.find_one({"_id": ObjectId(uploaded_path), "user_id": user_id})
+        if upload:
+            return {
+                'name': file_data.get('name') or upload['name'],
+                'path': upload['path'],
+                'type': upload.get('type', ''),
+                'size': upload['size'],
+                'upload_id': str(upload['_id']),
+                'content_hash': upload['content_hash']
+            }
 
-def generate_ai_response(user_message, conversation_history):
+    # Files uploaded before content-addressed storage were saved under their upload name; they are
+    # only usable if one of the user's own messages references them. Their text is looked up by path:
+    # a content hash stored with such a message may have come from the client
+    attachment = find_legacy_attachment(uploaded_path, user_id)
+    if attachment is None:
+        return None
+    return {
+        'name': file_data.get('name') or attachment.get('name', ''),
+        'path': attachment['path'],
+        'type': attachment.get('type', '')
+    }
+
+def attachment_excerpt(entry, query):
     """
-    Generate an AI response using Azure OpenAI.
+    Return the part of an attachment's text to put in the prompt.
+
+    Small files are sent whole; larger ones contribute only the chunks most
+    relevant to the user's question.
 
     Args:
-        user_message (str): The latest message from the user
-        conversation_history (list): List of previous messages in the conversation
+        entry (dict): The extracted-text entry for the file
+        query (str): The user's current question
 
     Returns:
-        str: The AI-generated response
+        str: The text to include
     """
-    try:
-        # For styling testing purposes, return a simple response if client is not initialized
-        if client is None:
-            logger.info("Using temporary response for styling testing")
-            return f"Hello {current_user.name} from {current_user.company}! This is a temporary response for UI styling testing. The chat functionality will be enabled once Azure OpenAI is properly configured."
+    file_content = entry['text']
+    if len(file_content) <= ATTACHMENT_INLINE_CHARS:
+        return file_content
 
-        # Format the conversation history for OpenAI
-        messages = []
+    chunks = retriever.search(entry['content_hash'], query, k=RETRIEVAL_TOP_K, text=file_content)
+    if not chunks:
+        return file_content[:ATTACHMENT_INLINE_CHARS] + "\n... (content truncated due to length)"
+
+    return "\n...\n".join(
+        f"[excerpt {chunk['position'] + 1} of {chunk['total']}]\n{chunk['text']}" for chunk in chunks
+    )
 
-        # Add system message to set up the assistant's behavior
+def format_history_message(message, query=None):
+    """
+    Convert a stored message into the OpenAI chat format, inlining attached file content.
+
+    Args:
+        message (dict): A stored conversation message
+        query (str): The user's current question, used to pick excerpts of large attachments
+
+    Returns:
+        dict: The chat message, or None for messages that are not part of the prompt
+    """
+    content = prompt_text(message)
+    if content is None:
+        return None
+
+    # If the message has a file attachment
+    if message.get('sender') == 'user' and message.get('file'):
+        try:
+            file_info = message.get('file')
+            file_name = file_info.get('name', 'unnamed-file')
+            file_type = file_info.get('type', '')
+
+            if not file_info.get('upload_id'):
+                # Hashes on legacy attachments may have come from the client; find their text by path
+                file_info = {key: value for key, value in file_info.items() if key != 'content_hash'}
+
+            try:
+                entry = extraction_service.lookup_file(file_info)
+                file_content = entry['text'] if entry else None
+                # For text-based files, include their content in the message
+                if file_content is not None:
+                    file_excerpt = attachment_excerpt(entry, query if query is not None else message.get('text', ''))
+                    content += f"\n\nFile attached: {file_name}\nContent of the file:\n```\n{file_excerpt}\n```"
+                elif entry and entry['status'] == STATUS_PENDING:
+                    content += f"\n\nFile attached: {file_name} (text extraction still in progress)"
+                elif entry and entry.get('error'):
+                    content += f"\n\nFile attached: {file_name} (could not extract text: {entry['error']})"
+                # For binary/non-text files, just mention the file
+                else:
+                    content += f"\n\nFile attached: {file_name} (binary/non-text file, type: {file_type})"
+            except FileNotFoundError:
+                content += f"\n\nFile attached: {file_name} (file not found on server)"
+        except Exception as file_err:
+            logger.error(f"Error processing file content: {str(file_err)}")
+            content += f"\n\nFile attached (unable to process content: {str(file_err)})"
+
+    # Map the sender onto a chat role
+    if message.get('sender') == 'user':
+        return {"role": "user", "content": content}
+    elif message.get('sender') == 'bot':
+        return {"role": "assistant", "content": content}
+    return None
+
+def build_system_prompt(personal=True):
+    """
+    System prompt for the current user.
+
+    The company-level prompt (``personal=False``) leaves out the user's name, job title and department.
+    It is used while the response cache is enabled, so colleagues at the same company send identical
+    prompts and a shared answer is never addressed to someone else.
+    """
+    if personal:
         system_message = f"""You are a helpful Sumersault assistant for {current_user.name}"""
         if current_user.company:
             system_message += f" at {current_user.company}"
@@ -624,158 +1110,210 @@ def generate_ai_response(user_message, conversation_history):
             system_message += f", who works as {current_user.job_title}"
         if current_user.department:
             system_message += f" in the {current_user.department} department"
+    else:
+        system_message = "You are a helpful Sumersault assistant"
+        if current_user.company:
+            system_message += f" at {current_user.company}"
 
-        system_message += """. You are branded with green colors and provide accurate, professional, and concise information to help the user. When users upload files, analyze their content and provide relevant insights or assistance."""
+    system_message += """. You are branded with green colors and provide accurate, professional, and concise information to help the user. When users upload files, analyze their content and provide relevant insights or assistance."""
+    return system_message
 
-        messages.append({
-            "role": "system",
-            "content": system_message
-        })
+def build_ai_messages(user_message, recent_history, summary=None):
+    """
+    Build the chat completion messages for a user turn within the context token budget.
 
-        # Process conversation history
-        for message in conversation_history:
-            content = message.get('text', '')
+    Args:
+        user_message (str): The latest message from the user
+        recent_history (iterable): Previous messages in the conversation, newest first
+        summary (str): Running summary of the turns before ``recent_history``
 
-            # If the message has a file attachment
-            if message.get('sender') == 'user' and message.get('file'):
-                try:
-                    file_info = message.get('file')
-                    file_path = file_info.get('path', '')
-                    file_name = file_info.get('name', 'unnamed-file')
-                    file_type = file_info.get('type', '')
-
-                    if os.path.exists(file_path):
-                        # For text-based files, include their content in the message
-                        if file_type and ('text/' in file_type or file_name.lower().endswith(('.txt', '.md', '.csv', '.json', '.py', '.js', '.html', '.css', '.c', '.cpp', '.h', '.xml'))):
-                            try:
-                                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                                    file_content = f.read()
-                                    file_excerpt = file_content[:10000]  # Limit to 10K chars to avoid token limits
-                                    content += f"\n\nFile attached: {file_name}\nContent of the file:\n```\n{file_excerpt}"
-                                    if len(file_content) > 10000:
-                                        content += "\n... (content truncated due to length)"
-                                    content += "\n```"
-                            except Exception as read_err:
-                                logger.error(f"Error reading file content: {str(read_err)}")
-                                content += f"\n\nFile attached: {file_name} (error reading content: {str(read_err)})"
-                        # For binary/non-text files, just mention the file
-                        else:
-                            content += f"\n\nFile attached: {file_name} (binary/non-text file, type: {file_type})"
-                    else:
-                        content += f"\n\nFile attached: {file_name} (file not found on server)"
-                except Exception as file_err:
-                    logger.error(f"Error processing file content: {str(file_err)}")
-                    content += f"\n\nFile attached (unable to process content: {str(file_err)})"
-
-            # Add to messages based on sender
-            if message.get('sender') == 'user':
-                messages.append({"role": "user", "content": content})
-            elif message.get('sender') == 'bot':
-                messages.append({"role": "assistant", "content": content})
-
-        # Add the latest user message if it's not already in history
-        if not conversation_history or conversation_history[-1].get('sender') != 'user' or conversation_history[-1].get('text') != user_message:
-            messages.append({"role": "user", "content": user_message})
-
-        # ========== DETAILED LOGGING STARTS HERE ==========
-
-        logger.info("=" * 80)
-        logger.info("🚀 AZURE OPENAI API REQUEST")
-        logger.info("=" * 80)
-
-        # Log request details
-        logger.info(f"📍 Endpoint: {os.getenv('AZURE_OPENAI_ENDPOINT')}")
-        logger.info(f"🤖 Model: {os.getenv('AZURE_OPENAI_DEPLOYMENT_NAME')}")
-        logger.info(f"👤 User: {current_user.name} ({current_user.email})")
-        logger.info(f"💬 Total Messages: {len(messages)}")
-        logger.info(f"📝 Latest User Message: {user_message[:100]}...")
-
-        # Log the full payload (be careful with sensitive data)
-        logger.info("📦 REQUEST PAYLOAD:")
-        request_payload = {
-            "model": os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
-            "messages": messages,
-            "max_tokens": 1000,
-            "temperature": 0.7
-        }
+    Returns:
+        dict: The assembled context with ``messages`` in the OpenAI chat format and their ``token_count``
+    """
+    # Add system message to set up the assistant's behavior
+    system_message = build_system_prompt(personal=not response_cache.enabled)
+
+    formatted_history = (format_history_message(message, query=user_message) for message in recent_history)
+    context = context_builder.build(
+        system_message,
+        (message for message in formatted_history if message),
+        user_message,
+        summary=summary
+    )
+    return context
+
+def response_cache_key(messages, scope):
+    """Cache key for a prompt within a sharing scope (see ``cache_scope``)"""
+    return response_cache.make_key(scope, completions.model, messages, COMPLETION_PARAMS)
+
+def record_cache_hit(route, cached, started):
+    """Record a request answered from the response cache, for the admin stats and Prometheus"""
+    elapsed_ms = (time.time() - started) * 1000
+    response_cache.observe_hit(elapsed_ms)
+    observe_cache_hit(route, cached['tokens'], elapsed_ms)
+
+def completion_deltas(messages):
+    """Stream the content deltas of one completion call; the generator's return value is the finish reason"""
+    response = completions.create(
+        messages=messages,
+        stream=True,
+        **COMPLETION_PARAMS
+    )
+    finish_reason = None
+    try:
+        for chunk in response:
+            if chunk.choices:
+                choice = chunk.choices[0]
+                if choice.delta is not None and choice.delta.content:
+                    yield choice.delta.content
+                finish_reason = choice.finish_reason or finish_reason
+    finally:
+        response.close()
+    return finish_reason
+
+def replay_chunks(text, size=64):
+    """Split a cached response into stream-sized deltas so cache hits use the same SSE protocol"""
+    for start in range(0, len(text), size):
+        yield text[start:start + size]
+
+def record_completion(route, context, started, ttft_ms=None, response_text='', finish_reason=None, usage=None,
+                      cached=False, coalesced=False, error=None):
+    """Emit the single telemetry record for a completion; token counts are estimated when the API reports no usage"""
+    latency_ms = (time.time() - started) * 1000
+    messages = context['messages'] if context else []
+    completion_tokens = usage.completion_tokens if usage else context_builder.counter.count(response_text or '')
+    observe_completion(route, latency_ms, latency_ms if ttft_ms is None else ttft_ms, completion_tokens,
+                       cached=cached, coalesced=coalesced, error=error)
+    telemetry.record(
+        route,
+        completions.model,
+        latency_ms,
+        ttft_ms=latency_ms if ttft_ms is None else ttft_ms,
+        prompt_tokens=usage.prompt_tokens if usage else (context['token_count'] if context else None),
+        completion_tokens=completion_tokens,
+        tokens_estimated=usage is None,
+        finish_reason=finish_reason,
+        prompt_chars=sum(len(message['content']) for message in messages),
+        history_messages=context['included'] if context else None,
+        response_chars=len(response_text or ''),
+        cached=cached,
+        coalesced=coalesced,
+        error=error,
+        prompt=messages[-1]['content'] if messages else None,
+        response=response_text
+    )
 
-        # Log each message in the conversation
-        for i, msg in enumerate(messages):
-            logger.info(f"  Message {i+1} ({msg['role']}): {msg['content'][:150]}...")
+def generate_ai_response(user_message, conversation_history, summary=None):
+    """
+    Generate an AI response using Azure OpenAI.
 
-        logger.info(f"⚙️  Parameters: max_tokens=1000, temperature=0.7")
+    Args:
+        user_message (str): The latest message from the user
+        conversation_history (iterable): Previous messages in the conversation, newest first
+        summary (str): Running summary of the turns before ``conversation_history``
 
-        # Record start time
-        import time
-        start_time = time.time()
+    Returns:
+        str: The AI-generated response
+    """
+    started = time.time()
+    context = None
+    try:
+        # For styling testing purposes, return a simple response if no completion backend is configured
+        if not completions.enabled:
+            logger.info("Using temporary response for styling testing")
+            return f"Hello {current_user.name} from {current_user.company}! This is a temporary response for UI styling testing. The chat functionality will be enabled once Azure OpenAI is properly configured."
+
+        context = build_ai_messages(user_message, conversation_history, summary)
+        messages = context['messages']
 
-        logger.info("⏳ Sending request to Azure OpenAI...")
+        cache_key = response_cache_key(messages, cache_scope(current_user.company, current_user.id))
+        cached = response_cache.get(cache_key)
+        if cached:
+            record_cache_hit('/api/message', cached, started)
+            record_completion('/api/message', context, started, response_text=cached['text'], finish_reason='stop', cached=True)
+            return cached['text']
 
-        # Call the Azure OpenAI API with streaming enabled
-        response = client.chat.completions.create(
-            model=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
+        # Call the Azure OpenAI API; streaming callers use stream_ai_response instead
+        response = completions.create(
             messages=messages,
-            stream=True,
-            max_tokens=1000,
-            temperature=0.7
+            stream=False,
+            **COMPLETION_PARAMS
         )
 
-        # Calculate response time
-        response_time = time.time() - start_time
-
-        # ========== DETAILED RESPONSE LOGGING ==========
+        ai_response = response.choices[0].message.content
+        finish_reason = response.choices[0].finish_reason
+        usage = getattr(response, 'usage', None)
+        record_completion('/api/message', context, started, response_text=ai_response, finish_reason=finish_reason, usage=usage)
 
-        logger.info("=" * 80)
-        logger.info("📥 AZURE OPENAI API RESPONSE")
-        logger.info("=" * 80)
+        if finish_reason == 'stop':
+            tokens = usage.total_tokens if usage else context['token_count'] + context_builder.counter.count(ai_response)
+            response_cache.put(cache_key, ai_response, tokens)
 
-        logger.info(f"⏱️  Response Time: {response_time:.2f} seconds")
-        logger.info(f"🆔 Request ID: {getattr(response, 'id', 'N/A')}")
-        logger.info(f"🏷️  Model Used: {getattr(response, 'model', 'N/A')}")
-        logger.info(f"📊 Usage Stats:")
+        return ai_response
 
-        # Log token usage if available
-        if hasattr(response, 'usage') and response.usage:
-            usage = response.usage
-            logger.info(f"   📝 Prompt Tokens: {usage.prompt_tokens}")
-            logger.info(f"   🔤 Completion Tokens: {usage.completion_tokens}")
-            logger.info(f"   🔢 Total Tokens: {usage.total_tokens}")
+    except Exception as e:
+        logger.exception(f"Azure OpenAI request failed for user {current_user.id}: {str(e)}")
+        record_completion('/api/message', context, started, error=f"{type(e).__name__}: {str(e)}")
+        return f"I apologize, but I encountered an error while processing your request. Please try again later. Error: {str(e)}"
 
-        # Extract and log the response
-        ai_response = response.choices[0].message.content
-        finish_reason = response.choices[0].finish_reason
+def stream_ai_response(user_message, conversation_history, summary=None, timeout=None):
+    """
+    Stream an AI response from Azure OpenAI, yielding content deltas as they arrive.
 
-        logger.info(f"🏁 Finish Reason: {finish_reason}")
-        logger.info(f"💭 AI Response Length: {len(ai_response)} characters")
-        logger.info(f"🤖 AI Response Preview: {ai_response[:200]}...")
+    Args:
+        user_message (str): The latest message from the user
+        conversation_history (iterable): Previous messages in the conversation, newest first
+        summary (str): Running summary of the turns before ``conversation_history``
+        timeout: Callable giving the longest wait for the next delta (see ``Subscription.poll``)
 
-        # Log full response (be careful in production)
-        logger.info("📄 FULL AI RESPONSE:")
-        logger.info(f"{ai_response}")
+    Yields:
+        str: Content deltas of the AI response, or None when a wait for the next delta timed out
+    """
+    if not completions.enabled:
+        yield generate_ai_response(user_message, conversation_history, summary)
+        return
 
-        logger.info("=" * 80)
-        logger.info("✅ AZURE OPENAI REQUEST COMPLETED SUCCESSFULLY")
-        logger.info("=" * 80)
+    started = time.time()
+    context = build_ai_messages(user_message, conversation_history, summary)
+    messages = context['messages']
 
-        return ai_response
+    cache_key = response_cache_key(messages, cache_scope(current_user.company, current_user.id))
+    cached = response_cache.get(cache_key)
+    if cached:
+        yield from replay_chunks(cached['text'])
+        record_cache_hit('/api/message', cached, started)
+        record_completion('/api/message', context, started, response_text=cached['text'], finish_reason='stop', cached=True)
+        return
 
+    # Attach to an identical generation that is already running, or start one
+    subscription = coalescer.stream(cache_key, lambda: completion_deltas(messages))
+    ai_response = ""
+    ttft_ms = None
+    error = None
+    try:
+        for content in subscription.poll(timeout):
+            if content is None:
+                yield None
+                continue
+            if ttft_ms is None:
+                ttft_ms = (time.time() - started) * 1000
+            ai_response += content
+            yield content
+    except GeneratorExit:
+        error = 'client disconnected'
+        raise
     except Exception as e:
-        logger.error("=" * 80)
-        logger.error("❌ AZURE OPENAI API ERROR")
-        logger.error("=" * 80)
-        logger.error(f"🚨 Error Type: {type(e).__name__}")
-        logger.error(f"📝 Error Message: {str(e)}")
-        logger.error(f"👤 User: {current_user.name} ({current_user.email})")
-        logger.error(f"💬 User Message: {user_message}")
-
-        # Log full traceback
-        import traceback
-        logger.error(f"🔍 Full Traceback:")
-        logger.error(traceback.format_exc())
-        logger.error("=" * 80)
+        error = f"{type(e).__name__}: {str(e)}"
+        raise
+    finally:
+        subscription.close()
+        record_completion('/api/message', context, started, ttft_ms, ai_response, subscription.result,
+                          coalesced=subscription.shared, error=error)
+
+    # Only complete answers are cached
+    if subscription.result == 'stop':
+        response_cache.put(cache_key, ai_response, context['token_count'] + context_builder.counter.count(ai_response))
 
-        return f"I apologize, but I encountered an error while processing your request. Please try again later. Error: {str(e)}"
-        
 # Admin routes for user management (protected by role check)
 @app.route('/admin/users', methods=['GET'])
 @login_required
@@ -827,11 +1365,44 @@ def admin_update_role(user_id):
         if result.matched_count == 0:
             return jsonify({"error": "User not found"}), 404
 
+        user_cache.invalidate(user_id)
         return jsonify({"success": True})
     except Exception as e:
         logger.error(f"Error updating user role: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/admin/cache/stats', methods=['GET'])
+@login_required
+def admin_cache_stats():
+    # Check if the current user has admin role
+    if current_user.role != 'admin':
+        return jsonify({"error": "Access denied"}), 403
+
+    return jsonify({
+        'text_cache': text_cache.stats(),
+        'user_cache': user_cache.stats(),
+        'response_cache': response_cache.stats()
+    })
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness plus pool and in-flight figures, served from in-memory counters without any network call"""
+    return jsonify({
+        'status': 'ok' if mongo is not None else 'degraded',
+        'mongo': mongo_pool_monitor.stats(),
+        'completions': completions.stats(),
+        'coalesced_streams': coalescer.stats(),
+        'write_behind': message_writer.stats() if message_writer else None,
+        'replay': replay_store.stats(),
+        'telemetry': telemetry.stats()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint, aggregated across gunicorn workers"""
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
 # Create first admin user on startup if none exists
 def ensure_admin_exists():
     admin_email = os.environ.get("ADMIN_EMAIL")
@@ -848,22 +1419,159 @@ def ensure_admin_exists():
                 {"_id": admin_user['_id']},
                 {"$set": {"role": "admin"}}
             )
+            user_cache.invalidate(admin_user['_id'])
             logger.info(f"Promoted existing user to admin: {admin_email}")
         else:
             logger.info(f"Admin user {admin_email} not found. They will be created as admin when they first log in.")
 
+def run_generation(generation_id, conversation_id, stored, context, scope, started):
+    """
+    Produce one streamed reply into the replay store, independently of the request that started it.
+
+    The reply is checkpointed while it streams and finalized when it ends. Once no client has followed the
+    generation for ``REPLAY_ABANDON_SECONDS`` the upstream call is cancelled and the partial reply is kept as
+    interrupted.
+
+    Args:
+        generation_id (str): Replay store key; the ID of the assistant message
+        conversation_id (ObjectId): Conversation the reply belongs to
+        stored (list): The stored user message and empty reply, as returned by ``message_store.append``
+        context (dict): Prompt built by ``context_builder``
+        scope (str): Response cache sharing scope
+        started (float): When the request arrived, for latency telemetry
+    """
+    messages = context['messages']
+    checkpoint = MessageCheckpoint(message_writer, conversation_id, stored[-1]['seq'],
+                                   interval=STREAM_CHECKPOINT_SECONDS)
+    # Deltas are merged into fewer frames; each flush is one replay frame and one write to the client
+    batcher = DeltaBatcher(SSE_FLUSH_MS, SSE_FLUSH_BYTES)
+
+    def send(text):
+        if text:
+            replay_store.append(generation_id, encode_json({'content': text}))
+    ai_response_text = ""
+    # Stays 'interrupted' unless the reply completes
+    status = STATUS_INTERRUPTED
+    stream_error = None
+    try:
+        try:
+            cache_key = response_cache_key(messages, scope)
+            cached = response_cache.get(cache_key) if completions.enabled else None
+            if not completions.enabled:
+                # No completion backend configured: answer with a notice over the same protocol
+                ai_response_text = "The assistant is not available yet: no completion backend is configured."
+                send(ai_response_text)
+            elif cached:
+                # Replay the cached answer with the same frames a live stream would send
+                for content in replay_chunks(cached['text']):
+                    ai_response_text += content
+                    send(batcher.add(content))
+                send(batcher.flush())
+                record_cache_hit('/api/chat/stream', cached, started)
+                record_completion('/api/chat/stream', context, started, response_text=ai_response_text,
+                                  finish_reason='stop', cached=True)
+            else:
+                # Stream from Azure OpenAI, sharing the generation with identical in-flight requests;
+                # every subscriber still persists the turn into its own conversation
+                subscription = coalescer.stream(cache_key, lambda: completion_deltas(messages))
+                deltas = subscription.poll(batcher.timeout)
+                ttft_ms = None
+                error = None
+                checked_at = time.monotonic()
+                try:
+                    for content in deltas:
+                        # None: no delta within the batching window, so whatever is buffered is due
+                        if content is None:
+                            send(batcher.due())
+                        else:
+                            if ttft_ms is None:
+                                ttft_ms = (time.time() - started) * 1000
+                            ai_response_text += content
+                            checkpoint.progress(ai_response_text)
+                            send(batcher.add(content))
+                        if time.monotonic() - checked_at >= 1:
+                            checked_at = time.monotonic()
+                            if replay_store.idle_seconds(generation_id) > REPLAY_ABANDON_SECONDS:
+                                error = 'client disconnected'
+                                break
+                except Exception as e:
+                    error = f"{type(e).__name__}: {str(e)}"
+                    raise
+                finally:
+                    # Closing the subscription cancels the upstream call if nobody else shares it
+                    deltas.close()
+                    subscription.close()
+                    send(batcher.flush())
+                    record_completion('/api/chat/stream', context, started, ttft_ms, ai_response_text,
+                                      subscription.result, coalesced=subscription.shared, error=error)
+
+                if error:
+                    logger.info(f"Abandoned generation {generation_id}: no client for {REPLAY_ABANDON_SECONDS}s")
+                    stream_error = error
+                    replay_store.append(generation_id, encode_json({'error': 'Stream abandoned'}))
+                    return
+                if subscription.result == 'stop':
+                    response_cache.put(
+                        cache_key,
+                        ai_response_text,
+                        context['token_count'] + context_builder.counter.count(ai_response_text)
+                    )
+            status = None
+        except Exception as e:
+            logger.error(f"Error in streaming: {str(e)}")
+            stream_error = f"{type(e).__name__}: {str(e)}"
+            replay_store.append(generation_id, encode_json({'error': str(e)}))
+            return
+        finally:
+            checkpoint.finish(ai_response_text, status=status, error=stream_error)
+
+        summarizer.refresh_in_background(conversation_id)
+
+        # Send completion signal with the stored messages so the client can apply them as a delta
+        stored[-1]['text'] = ai_response_text
+        del stored[-1]['status']
+        replay_store.append(generation_id, encode_json({'done': True, 'messages': stored, 'seq': stored[-1]['seq']}))
+    finally:
+        replay_store.finish(generation_id)
+
+def event_response(generation_id, after=0):
+    """SSE response following a generation from the replay store, starting after event ``after``"""
+    return Response(
+        track_stream('/api/chat/stream', event_stream(replay_store, generation_id, after)),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'Access-Control-Allow-Origin': '*',
+            'X-Accel-Buffering': 'no',
+            'X-Generation-Id': generation_id
+        }
+    )
+
+def resume_stream(generation_id, after):
+    """Resume a generation of the current user after event ``after``"""
+    if replay_store.owner(generation_id) != current_user.id:
+        return jsonify({'error': 'Stream not found'}), 404
+    if not replay_store.available(generation_id, after):
+        # The frames were evicted; the client reloads the conversation with since_seq instead
+        return jsonify({'error': 'Stream can no longer be resumed'}), 410
+    return event_response(generation_id, after)
+
 @app.route('/api/chat/stream', methods=['POST'])
 @login_required
 def chat_stream():
     """Streaming chat endpoint for thinking aloud feature"""
     try:
+        # A reconnect carrying Last-Event-ID picks up the running generation instead of starting another
+        generation_id, after = parse_event_id(request.headers.get('Last-Event-ID'))
+        if generation_id:
+            return resume_stream(generation_id, after)
+
+        started = time.time()
         data = request.get_json()
         user_message = data.get('message', '')
         conversation_id = data.get('conversation_id', '')
         
-        # Debug logging to see what data we're receiving
-        logger.info(f"Streaming request data: {data}")
-        
         if not user_message:
             return jsonify({'error': 'No message provided'}), 400
             
@@ -874,120 +1582,117 @@ def chat_stream():
         conversation = mongo.db.conversations.find_one({
             "_id": ObjectId(conversation_id),
             "user_id": ObjectId(current_user.id)
-        })
+        }, projection={"messages": 0})
         
         if not conversation:
             return jsonify({'error': 'Conversation not found or access denied'}), 404
+
+        user_id = ObjectId(current_user.id)
+        history = message_store.iter_recent(conversation['_id'], after=conversation.get('summary_seq'))
+
+        user_msg = {
+            "id": str(ObjectId()),
+            "text": user_message,
+            "sender": "user",
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        
+        # Add file info if present
+        file_info = None
+        if 'file' in data and data['file']:
+            # Where the file is stored and what it hashes to is only ever resolved server-side
+            user_msg["file"] = {key: value for key, value in data['file'].items()
+                                if key not in ('path', 'upload_id', 'content_hash', 'contentHash')}
+            if 'uploadedPath' in data['file']:
+                file_info = resolve_uploaded_file(data['file'], user_id)
+                if file_info is None:
+                    return jsonify({'error': 'Attached file not found'}), 404
+                user_msg["file"].update(file_info)
+        
+        # Prepare messages for the AI
+        if current_user and hasattr(current_user, 'username') and hasattr(current_user, 'company'):
+            system_message = f"You are a helpful Sumersault assistant for {current_user.username} at {current_user.company}. You are branded with green colors and provide accurate, professional, and helpful assistance."
+        else:
+            system_message = "You are a helpful Sumersault assistant. You are branded with green colors and provide accurate, professional, and helpful assistance."
+        
+        roles = {'user': 'user', 'bot': 'assistant'}
         
-        def generate_stream():
+        # Add the current user message with file content if present
+        message_content = user_message
+        if file_info:
+            # Read file content if it's a text file
             try:
-                # Save the user message first
-                user_msg = {
-                    "id": str(ObjectId()),
-                    "text": user_message,
-                    "sender": "user",
-                    "timestamp": datetime.utcnow().isoformat()
-                }
-                
-                # Add file info if present
-                if 'file' in data and data['file']:
-                    user_msg["file"] = data['file']
-                
-                # Prepare messages for the AI
-                if current_user and hasattr(current_user, 'username') and hasattr(current_user, 'company'):
-                    system_message = f"You are a helpful Sumersault assistant for {current_user.username} at {current_user.company}. You are branded with green colors and provide accurate, professional, and helpful assistance."
+                entry = extraction_service.lookup_file(file_info)
+                file_content = entry['text'] if entry else None
+                if file_content is not None:
+                    file_excerpt = attachment_excerpt(entry, user_message)
+                    message_content = f"{user_message}\n\nHere is the content of the attached file '{data['file']['name']}':\n\n```\n{file_excerpt}\n```"
+                elif entry and entry['status'] == STATUS_PENDING:
+                    message_content = f"{user_message}\n\nFile attached: {data['file']['name']} (text extraction still in progress)"
                 else:
-                    system_message = "You are a helpful Sumersault assistant. You are branded with green colors and provide accurate, professional, and helpful assistance."
-                
-                messages = [{"role": "system", "content": system_message}]
-                
-                # Add conversation history
-                for msg in conversation.get('messages', []):
-                    if msg.get('sender') == 'user':
-                        messages.append({"role": "user", "content": msg.get('text', '')})
-                    elif msg.get('sender') == 'bot':
-                        messages.append({"role": "assistant", "content": msg.get('text', '')})
-                
-                # Add the current user message with file content if present
-                message_content = user_message
-                if 'file' in data and data['file'] and 'uploadedPath' in data['file']:
-                    # Read file content if it's a text file
-                    file_path = os.path.join(os.environ.get('UPLOAD_DIR', 'uploads'), data['file']['uploadedPath'])
-                    if os.path.exists(file_path):
-                        try:
-                            # Try to read as text file
-                            with open(file_path, 'r', encoding='utf-8') as f:
-                                file_content = f.read()
-                            message_content = f"{user_message}\n\nHere is the content of the attached file '{data['file']['name']}':\n\n```\n{file_content}\n```"
-                        except UnicodeDecodeError:
-                            # If not a text file, just mention the file
-                            message_content = f"{user_message}\n\nFile attached: {data['file']['name']} (binary file, cannot display content)"
-                        except Exception as e:
-                            logger.error(f"Error reading file: {e}")
-                            message_content = f"{user_message}\n\nFile attached: {data['file']['name']} (error reading file: {str(e)})"
-                    else:
-                        message_content = f"{user_message}\n\nFile '{data['file']['name']}' was attached but file not found on server"
-                        
-                logger.info(f"Final message content being sent to AI: {message_content[:200]}...")
-                
-                messages.append({"role": "user", "content": message_content})
-                
-                # Call Azure OpenAI with streaming
-                response = client.chat.completions.create(
-                    model=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
-                    messages=messages,
-                    stream=True,
-                    max_tokens=1000,
-                    temperature=0.7
-                )
-                
-                # Collect the streamed response
-                ai_response_text = ""
-                
-                # Stream the response
-                for chunk in response:
-                    if hasattr(chunk, 'choices') and len(chunk.choices) > 0:
-                        delta = chunk.choices[0].delta
-                        if hasattr(delta, 'content') and delta.content is not None:
-                            content = delta.content
-                            ai_response_text += content
-                            yield f"data: {json.dumps({'content': content})}\n\n"
-                
-                # Save both messages to the database
-                ai_msg = {
-                    "id": str(ObjectId()),
-                    "text": ai_response_text,
-                    "sender": "bot",
-                    "timestamp": datetime.utcnow().isoformat()
-                }
-                
-                # Update the conversation with both messages
-                mongo.db.conversations.update_one(
-                    {"_id": ObjectId(conversation_id)},
-                    {"$push": {"messages": {"$each": [user_msg, ai_msg]}}}
-                )
-                
-                # Send completion signal
-                yield f"data: {json.dumps({'done': True})}\n\n"
-                
+                    # If not a text file, just mention the file
+                    message_content = f"{user_message}\n\nFile attached: {data['file']['name']} (binary file, cannot display content)"
+            except FileNotFoundError:
+                message_content = f"{user_message}\n\nFile '{data['file']['name']}' was attached but file not found on server"
             except Exception as e:
-                logger.error(f"Error in streaming: {str(e)}")
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
-        
-        return Response(
-            generate_stream(),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'Access-Control-Allow-Origin': '*'
-            }
+                logger.error(f"Error reading file: {e}")
+                message_content = f"{user_message}\n\nFile attached: {data['file']['name']} (error reading file: {str(e)})"
+                
+        # Add as much recent conversation history as fits in the token budget
+        context = context_builder.build(
+            system_message,
+            (
+                {"role": roles[msg['sender']], "content": prompt_text(msg)}
+                for msg in history
+                # Replies still streaming (this user's concurrent turns) are not part of the prompt yet
+                if msg.get('sender') in roles and prompt_text(msg) is not None
+            ),
+            message_content,
+            summary=conversation.get('summary')
         )
+
+        # Store the user message and an empty reply up front (the history above is already read);
+        # the reply's text is checkpointed while it streams and finalized through the write-behind queue
+        ai_msg = {
+            "id": str(ObjectId()),
+            "text": "",
+            "sender": "bot",
+            "timestamp": datetime.utcnow().isoformat(),
+            "status": STATUS_STREAMING
+        }
+        stored = message_store.append(
+            {"_id": ObjectId(conversation_id), "user_id": user_id},
+            [user_msg, ai_msg],
+            extra_set={"updated_at": datetime.now()}
+        )
+        if stored is None:
+            return jsonify({'error': 'Conversation not found or access denied'}), 404
+
+        # The reply is generated off the request, so a dropped connection can resume it with Last-Event-ID
+        generation_id = ai_msg['id']
+        replay_store.create(generation_id, current_user.id)
+        threading.Thread(
+            target=run_generation,
+            args=(generation_id, conversation['_id'], stored, context,
+                  cache_scope(current_user.company, current_user.id), started),
+            name='generation',
+            daemon=True
+        ).start()
+        return event_response(generation_id)
         
     except Exception as e:
         logger.error(f"Error in streaming chat endpoint: {str(e)}")
         return jsonify({'error': 'Failed to process streaming chat request'}), 500
 
+@app.route('/api/chat/stream/<generation_id>', methods=['GET'])
+@login_required
+def resume_chat_stream(generation_id):
+    """Resume a streamed reply after Last-Event-ID (or ``last_event_id``, for clients that cannot set headers)"""
+    _, after = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id', '0'))
+    if after is None:
+        return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+    return resume_stream(generation_id, after)
+
 if __name__ == "__main__":
     # Ensure admin user exists on startup
     ensure_admin_exists()
@@ -1,2 +1,3 @@
 #!/bin/bash
-gunicorn --bind 0.0.0.0:5000 --reuse-port --reload backend.main:app
\ No newline at end of file
+# Worker class and count come from gunicorn.conf.py; set SERVER_MODE=async for gevent workers
+gunicorn --bind 0.0.0.0:5000 --reuse-port --reload main:app
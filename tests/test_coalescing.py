@@ -0,0 +1,150 @@
+import threading
+import time
+
+import pytest
+
+from backend.coalescing import StreamCoalescer
+
+
+def gated_deltas(gate, deltas, result='stop'):
+    """A start callable whose generation waits for ``gate`` before producing anything"""
+    def start():
+        gate.wait(5)
+        yield from deltas
+        return result
+    return start
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_identical_requests_share_one_generation():
+    coalescer = StreamCoalescer()
+    gate = threading.Event()
+    calls = []
+
+    def start():
+        calls.append(1)
+        return gated_deltas(gate, ['a', 'b', 'c'])()
+
+    first = coalescer.stream('key', start)
+    second = coalescer.stream('key', start)
+    gate.set()
+
+    assert list(first) == ['a', 'b', 'c']
+    # A late subscriber still replays the whole response
+    assert list(second) == ['a', 'b', 'c']
+    assert len(calls) == 1
+    assert (first.shared, second.shared) == (False, True)
+    assert first.result == second.result == 'stop'
+    stats = coalescer.stats()
+    assert (stats['started'], stats['joined']) == (1, 1)
+
+
+def test_different_keys_do_not_share():
+    coalescer = StreamCoalescer()
+    first = coalescer.stream('a', lambda: iter(['1']))
+    second = coalescer.stream('b', lambda: iter(['2']))
+
+    assert (list(first), list(second)) == (['1'], ['2'])
+    assert not second.shared
+
+
+def test_disabled_coalescer_never_shares():
+    coalescer = StreamCoalescer(enabled=False)
+    first = coalescer.stream('key', lambda: iter(['x']))
+    second = coalescer.stream('key', lambda: iter(['x']))
+
+    assert not second.shared
+    assert list(first) == list(second) == ['x']
+
+
+def test_errors_reach_every_subscriber():
+    coalescer = StreamCoalescer()
+
+    def start():
+        yield 'partial'
+        raise RuntimeError('upstream failed')
+
+    subscription = coalescer.stream('key', start)
+    received = []
+    with pytest.raises(RuntimeError, match='upstream failed'):
+        for delta in subscription:
+            received.append(delta)
+    assert received == ['partial']
+
+
+def test_poll_yields_none_when_a_wait_times_out():
+    coalescer = StreamCoalescer()
+    gate = threading.Event()
+    subscription = coalescer.stream('key', gated_deltas(gate, ['a']))
+    # Like ``DeltaBatcher.timeout``: the time left until buffered text is due
+    remaining = [0.02]
+
+    def timeout():
+        left, remaining[0] = remaining[0], 0
+        return left
+
+    deltas = subscription.poll(timeout)
+
+    assert next(deltas) is None
+    gate.set()
+    assert [delta for delta in deltas if delta is not None] == ['a']
+
+
+def test_closing_an_unstarted_poll_unsubscribes():
+    coalescer = StreamCoalescer()
+    gate = threading.Event()
+    closed = threading.Event()
+
+    def start():
+        try:
+            gate.wait(5)
+            while True:
+                yield 'delta'
+        finally:
+            closed.set()
+
+    subscription = coalescer.stream('key', start)
+    # Never advanced: the generator's own cleanup would not run
+    subscription.poll().close()
+    subscription.close()
+    subscription.close()
+    gate.set()
+
+    # With nobody left, the producer stops paying for the upstream call
+    assert closed.wait(5)
+    assert wait_until(lambda: coalescer.stats()['in_flight'] == 0)
+
+
+def test_last_subscriber_leaving_cancels_the_generation():
+    coalescer = StreamCoalescer()
+    gate = threading.Event()
+    closed = threading.Event()
+
+    def start():
+        try:
+            gate.wait(5)
+            while True:
+                yield 'delta'
+        finally:
+            closed.set()
+
+    first = coalescer.stream('key', start)
+    second = coalescer.stream('key', start)
+    first.close()
+    gate.set()
+    deltas = iter(second)
+    assert next(deltas) == 'delta'
+    assert not closed.is_set()
+
+    deltas.close()
+    assert closed.wait(5)
+    # A new request starts a fresh generation instead of joining the cancelled one
+    assert not coalescer.stream('key', lambda: iter([])).shared
@@ -0,0 +1,141 @@
+import time
+from email.utils import formatdate
+
+import httpx
+import openai
+import pytest
+
+from backend.completions import CompletionGateway, retry_after_seconds
+
+
+def response(status=429, **headers):
+    return httpx.Response(status, headers=headers, request=httpx.Request('POST', 'https://example.test/chat'))
+
+
+@pytest.mark.parametrize('headers, expected', [
+    ({'retry-after-ms': '1500'}, 1.5),
+    ({'retry-after': '7'}, 7.0),
+    ({'retry-after-ms': '250', 'retry-after': '9'}, 0.25),
+    ({}, None),
+    ({'retry-after': 'soon'}, None)
+])
+def test_retry_after_seconds(headers, expected):
+    assert retry_after_seconds(response(**headers)) == expected
+
+
+def test_retry_after_http_date():
+    delay = retry_after_seconds(response(**{'retry-after': formatdate(time.time() + 30, usegmt=True)}))
+    assert 25 <= delay <= 31
+
+
+def test_retry_after_http_date_in_the_past():
+    assert retry_after_seconds(response(**{'retry-after': formatdate(time.time() - 30, usegmt=True)})) == 0.0
+
+
+def test_retry_after_without_response():
+    assert retry_after_seconds(None) is None
+
+
+class Backend:
+    """Completion backend failing with the queued errors before it answers"""
+    name = 'stub'
+    model = 'stub-model'
+
+    def __init__(self, *errors, result='answer'):
+        self.errors = list(errors)
+        self.result = result
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.result
+
+
+def status_error(status, **headers):
+    return openai.APIStatusError('failed', response=response(status, **headers), body=None)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(time, 'sleep', delays.append)
+    return delays
+
+
+def test_retries_throttled_calls_after_retry_after(sleeps):
+    backend = Backend(status_error(429, **{'retry-after': '2'}))
+    gateway = CompletionGateway(backend, backoff_base=0.5)
+
+    assert gateway.create(messages=[]) == 'answer'
+    assert backend.calls == 2
+    assert 2 <= sleeps[0] <= 2.5
+    stats = gateway.stats()
+    assert (stats['retries'], stats['failures'], stats['in_flight']) == (1, 0, 0)
+
+
+def test_does_not_retry_client_errors(sleeps):
+    backend = Backend(status_error(400))
+    gateway = CompletionGateway(backend)
+
+    with pytest.raises(openai.APIStatusError):
+        gateway.create(messages=[])
+    assert backend.calls == 1
+    assert gateway.stats()['failures'] == 1
+
+
+def test_gives_up_when_retry_after_is_too_long(sleeps):
+    backend = Backend(status_error(429, **{'retry-after': '120'}))
+    gateway = CompletionGateway(backend, max_retry_after=30)
+
+    with pytest.raises(openai.APIStatusError):
+        gateway.create(messages=[])
+    assert sleeps == []
+
+
+def test_stops_after_max_retries(sleeps):
+    backend = Backend(*[status_error(503) for _ in range(5)])
+    gateway = CompletionGateway(backend, max_retries=2)
+
+    with pytest.raises(openai.APIStatusError):
+        gateway.create(messages=[])
+    assert backend.calls == 3
+    assert len(sleeps) == 2
+
+
+class Stream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = 0
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed += 1
+
+
+def test_stream_releases_its_slot_when_exhausted():
+    stream = Stream(['a', 'b'])
+    gateway = CompletionGateway(Backend(result=stream))
+
+    chunks = gateway.create(messages=[], stream=True)
+    assert gateway.stats()['in_flight'] == 1
+
+    assert list(chunks) == ['a', 'b']
+    assert gateway.stats()['in_flight'] == 0
+    assert stream.closed == 1
+
+
+def test_stream_closed_before_iteration_releases_its_slot():
+    stream = Stream(['a'])
+    gateway = CompletionGateway(Backend(result=stream))
+
+    chunks = gateway.create(messages=[], stream=True)
+    chunks.close()
+    chunks.close()
+
+    assert gateway.stats()['in_flight'] == 0
+    assert stream.closed == 1
+    assert list(chunks) == []
@@ -0,0 +1,105 @@
+import pytest
+
+from backend import context_window
+from backend.context_window import (CHARS_PER_TOKEN, TOKENS_PER_MESSAGE, TOKENS_PER_REPLY, ContextWindowBuilder,
+                                    TokenCounter)
+
+
+@pytest.fixture
+def counter(monkeypatch):
+    # The length-based estimate keeps budgets exact without a tokenizer download
+    monkeypatch.setattr(context_window, 'tiktoken', None)
+    return TokenCounter()
+
+
+def turn(role, tokens):
+    return {"role": role, "content": 'x' * (tokens * CHARS_PER_TOKEN)}
+
+
+def history(*turns):
+    """Chat-format turns given oldest first, returned newest first like the routes pass them"""
+    return list(reversed(turns))
+
+
+def test_includes_everything_that_fits(counter):
+    builder = ContextWindowBuilder(budget=1000, counter=counter)
+    turns = [turn('user', 10), turn('assistant', 10), turn('user', 10), turn('assistant', 10)]
+
+    window = builder.build('system', history(*turns), 'latest')
+
+    assert window['included'] == 4
+    assert window['messages'][0] == {"role": "system", "content": 'system'}
+    assert window['messages'][1:5] == turns
+    assert window['messages'][-1] == {"role": "user", "content": 'latest'}
+    assert window['token_count'] == TOKENS_PER_REPLY + sum(counter.count_message(m) for m in window['messages'])
+
+
+def test_drops_the_oldest_turns_over_budget(counter):
+    turns = [turn('user', 50), turn('assistant', 50), turn('user', 50), turn('assistant', 50)]
+    base = ContextWindowBuilder(budget=10 ** 6, counter=counter).build('system', [], 'latest')['token_count']
+    per_turn = counter.count_message(turns[0])
+    builder = ContextWindowBuilder(budget=base + 2 * per_turn + per_turn // 2, counter=counter)
+
+    window = builder.build('system', history(*turns), 'latest')
+
+    assert window['included'] == 2
+    assert window['messages'][1:3] == turns[2:]
+    assert window['token_count'] <= builder.budget
+
+
+def test_does_not_open_on_an_orphaned_reply(counter):
+    turns = [turn('user', 50), turn('assistant', 50), turn('user', 50), turn('assistant', 50)]
+    base = ContextWindowBuilder(budget=10 ** 6, counter=counter).build('system', [], 'latest')['token_count']
+    per_turn = counter.count_message(turns[0])
+    # Room for three turns would start the window on an assistant reply
+    builder = ContextWindowBuilder(budget=base + 3 * per_turn, counter=counter)
+
+    window = builder.build('system', history(*turns), 'latest')
+
+    assert window['included'] == 2
+    assert window['messages'][1]['role'] == 'user'
+    assert window['token_count'] == base + sum(counter.count_message(message) for message in turns[2:])
+
+
+def test_stops_at_the_first_turn_that_does_not_fit(counter):
+    builder = ContextWindowBuilder(budget=300, counter=counter)
+    consumed = []
+
+    def newest_first():
+        for message in history(turn('user', 5), turn('assistant', 500), turn('user', 5), turn('assistant', 5)):
+            consumed.append(message)
+            yield message
+
+    window = builder.build('system', newest_first(), 'latest')
+
+    # Older turns that would still fit are not pulled in past the gap
+    assert window['included'] == 2
+    assert len(consumed) == 3
+
+
+def test_adds_the_summary_after_the_system_prompt(counter):
+    builder = ContextWindowBuilder(budget=1000, counter=counter)
+
+    window = builder.build('system', [], 'latest', summary='earlier turns')
+
+    assert window['messages'][1] == {"role": "system", "content": "Summary of the earlier conversation:\nearlier turns"}
+    assert len(window['messages']) == 3
+
+
+def test_truncates_an_oversized_latest_message(counter):
+    builder = ContextWindowBuilder(budget=100, counter=counter)
+
+    window = builder.build('system', [turn('user', 5)], 'y' * 4000)
+
+    latest = window['messages'][-1]
+    assert window['included'] == 0
+    assert 0 < len(latest['content']) < 4000
+    assert window['token_count'] <= builder.budget
+
+
+def test_count_estimates_from_length_without_a_tokenizer(counter):
+    assert counter.count('') == 0
+    assert counter.count('abcde') == 2
+    assert counter.count_message({"role": "user", "content": 'abcd'}) == TOKENS_PER_MESSAGE + 1 + 1
+    assert counter.truncate('abcdefghij', 2) == 'abcdefgh'
+    assert counter.truncate('abc', 0) == ''
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from bson.objectid import ObjectId
+
+from backend.pagination import conversations_after, decode_cursor, encode_cursor
+
+SIDEBAR_SORT = [("pinned", -1), ("updated_at", -1), ("_id", -1)]
+
+
+def test_cursor_round_trip():
+    conversation_id = ObjectId()
+    updated_at = datetime(2025, 5, 1, 12, 30, 15, 123000)
+
+    cursor = encode_cursor(True, updated_at, conversation_id)
+
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == (True, updated_at, conversation_id)
+
+
+def test_cursor_without_updated_at():
+    conversation_id = ObjectId()
+    assert decode_cursor(encode_cursor(False, None, conversation_id)) == (False, None, conversation_id)
+
+
+@pytest.mark.parametrize('cursor', ['', 'not a cursor', encode_cursor(False, None, ObjectId())[:-4]])
+def test_malformed_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_pages_cover_every_conversation_once():
+    conversations = mongomock.MongoClient().db.conversations
+    user_id = ObjectId()
+    start = datetime(2025, 1, 1)
+    for number in range(23):
+        conversations.insert_one({
+            "user_id": user_id,
+            "pinned": number % 5 == 0,
+            # Several conversations share a timestamp, so the _id tie-breaker matters
+            "updated_at": start + timedelta(minutes=number // 3)
+        })
+    expected = [doc['_id'] for doc in conversations.find({"user_id": user_id}).sort(SIDEBAR_SORT)]
+
+    seen = []
+    cursor = None
+    while True:
+        query = {"user_id": user_id}
+        if cursor:
+            query.update(conversations_after(cursor))
+        page = list(conversations.find(query).sort(SIDEBAR_SORT).limit(4))
+        seen.extend(doc['_id'] for doc in page)
+        if len(page) < 4:
+            break
+        last = page[-1]
+        cursor = encode_cursor(last['pinned'], last['updated_at'], last['_id'])
+
+    assert seen == expected
@@ -0,0 +1,105 @@
+import threading
+
+import pytest
+
+from backend.replay import ReplayStore, event_stream, parse_event_id
+
+
+def finished_generation(store, generation_id, payloads):
+    store.create(generation_id, 'owner')
+    for payload in payloads:
+        store.append(generation_id, payload)
+    store.finish(generation_id)
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('gen-1:12', ('gen-1', 12)),
+    (' abc:def:3 ', ('abc:def', 3)),
+    (':4', (None, 4)),
+    ('gen-1', (None, None)),
+    ('gen-1:x', (None, None)),
+    (None, (None, None))
+])
+def test_parse_event_id(value, expected):
+    assert parse_event_id(value) == expected
+
+
+def test_follow_replays_frames_after_the_cursor():
+    store = ReplayStore()
+    finished_generation(store, 'g', ['a', 'b', 'c'])
+
+    assert list(store.follow('g')) == [(1, 'a'), (2, 'b'), (3, 'c')]
+    assert list(store.follow('g', 2)) == [(3, 'c')]
+    assert list(store.follow('g', 3)) == []
+    assert list(store.follow('unknown')) == []
+
+
+def test_follow_waits_for_a_running_generation():
+    store = ReplayStore()
+    store.create('g', 'owner')
+    store.append('g', 'a')
+    frames = []
+    follower = threading.Thread(target=lambda: frames.extend(store.follow('g')))
+    follower.start()
+
+    store.append('g', 'b')
+    store.finish('g')
+    follower.join(5)
+
+    assert not follower.is_alive()
+    assert frames == [(1, 'a'), (2, 'b')]
+
+
+def test_follow_stops_at_evicted_frames():
+    store = ReplayStore(max_frames=2)
+    finished_generation(store, 'g', ['a', 'b', 'c', 'd'])
+
+    # Frames 1 and 2 are gone: a reply with a gap must not be sent
+    assert list(store.follow('g', 1)) == []
+    assert list(store.follow('g', 2)) == [(3, 'c'), (4, 'd')]
+
+
+def test_available():
+    store = ReplayStore(max_frames=2)
+    finished_generation(store, 'g', ['a', 'b', 'c', 'd'])
+
+    assert not store.available('g', 0)
+    assert not store.available('g', 1)
+    assert store.available('g', 2)
+    assert store.available('g', 4)
+    assert not store.available('unknown', 0)
+
+
+def test_event_stream_frames():
+    store = ReplayStore()
+    finished_generation(store, 'g', ['{"content":"a"}'])
+
+    assert list(event_stream(store, 'g')) == ['id: g:1\ndata: {"content":"a"}\n\n']
+
+
+def test_finished_generations_expire(monkeypatch):
+    from backend import replay
+
+    now = [100.0]
+    monkeypatch.setattr(replay.time, 'monotonic', lambda: now[0])
+    store = ReplayStore(ttl=10)
+    finished_generation(store, 'old', ['a'])
+    store.create('running', 'owner')
+
+    now[0] += 11
+    store.create('new', 'owner')
+
+    assert store.owner('old') is None
+    assert store.owner('running') == 'owner'
+    assert store.stats()['generations'] == 2
+
+
+def test_oldest_finished_generations_are_dropped_first():
+    store = ReplayStore(max_generations=2)
+    finished_generation(store, 'first', ['a'])
+    finished_generation(store, 'second', ['b'])
+
+    store.create('third', 'owner')
+
+    assert store.owner('first') is None
+    assert store.owner('second') == 'owner'
@@ -0,0 +1,88 @@
+from backend import response_cache as response_cache_module
+from backend.response_cache import ResponseCache, cache_scope, normalize_content
+
+MESSAGES = [{"role": "system", "content": "You are helpful."}, {"role": "user", "content": "What is  our PTO policy?"}]
+PARAMS = {"max_tokens": 800, "temperature": 0.7}
+
+
+def test_key_ignores_whitespace_and_case():
+    cache = ResponseCache(enabled=True)
+    variant = [MESSAGES[0], {"role": "user", "content": "  what is our pto POLICY? "}]
+
+    assert normalize_content(" A\n\tb ") == 'a b'
+    assert cache.make_key('user:1', 'gpt-4o', MESSAGES, PARAMS) == cache.make_key('user:1', 'gpt-4o', variant, PARAMS)
+
+
+def test_key_depends_on_scope_model_params_and_roles():
+    cache = ResponseCache(enabled=True)
+    key = cache.make_key('user:1', 'gpt-4o', MESSAGES, PARAMS)
+
+    assert key != cache.make_key('user:2', 'gpt-4o', MESSAGES, PARAMS)
+    assert key != cache.make_key('user:1', 'gpt-4o-mini', MESSAGES, PARAMS)
+    assert key != cache.make_key('user:1', 'gpt-4o', MESSAGES, dict(PARAMS, temperature=0))
+    assert key != cache.make_key('user:1', 'gpt-4o', [MESSAGES[0], dict(MESSAGES[1], role='assistant')], PARAMS)
+
+
+def test_scope():
+    assert cache_scope('Sumersault', 'u1') == cache_scope('sumersault', 'u2') == 'company:sumersault'
+    assert cache_scope('', 'u1') == 'user:u1'
+    assert cache_scope(None, 'u1') != cache_scope(None, 'u2')
+
+
+def test_hit_and_miss_counts():
+    cache = ResponseCache(enabled=True)
+    assert cache.get('k') is None
+
+    cache.put('k', 'answer', tokens=120)
+    entry = cache.get('k')
+
+    assert entry['text'] == 'answer'
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['tokens_saved']) == (1, 1, 120)
+
+
+def test_disabled_cache_stores_nothing():
+    cache = ResponseCache(enabled=False)
+    cache.put('k', 'answer', tokens=1)
+    assert cache.get('k') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_empty_and_oversized_responses_are_not_cached():
+    cache = ResponseCache(enabled=True, max_bytes=10)
+    cache.put('empty', '', tokens=1)
+    cache.put('big', 'x' * 11, tokens=1)
+    assert cache.stats()['entries'] == 0
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache_module.time, 'monotonic', lambda: now[0])
+    cache = ResponseCache(enabled=True, ttl=60)
+    cache.put('k', 'answer', tokens=1)
+
+    now[0] += 59
+    assert cache.get('k') is not None
+    now[0] += 2
+    assert cache.get('k') is None
+    assert cache.stats()['bytes'] == 0
+
+
+def test_evicts_least_recently_used():
+    cache = ResponseCache(enabled=True, max_entries=2)
+    cache.put('a', 'first', tokens=1)
+    cache.put('b', 'second', tokens=1)
+    cache.get('a')
+    cache.put('c', 'third', tokens=1)
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+
+
+def test_evicts_by_total_size():
+    cache = ResponseCache(enabled=True, max_bytes=10)
+    cache.put('a', 'x' * 6, tokens=1)
+    cache.put('b', 'y' * 6, tokens=1)
+
+    assert cache.get('a') is None
+    assert cache.stats()['bytes'] == 6
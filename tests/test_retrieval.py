@@ -0,0 +1,80 @@
+from backend.retrieval import BM25Backend, ChunkRetriever, chunk_text, tokenize
+
+
+def test_tokenize():
+    assert tokenize("Q3 Revenue, up 12%!") == ['q3', 'revenue', 'up', '12']
+
+
+def test_small_paragraphs_are_packed_together():
+    text = "first paragraph\n\nsecond paragraph\n  \nthird paragraph"
+    assert chunk_text(text, chunk_chars=40, overlap=5) == ["first paragraph\n\nsecond paragraph", "third paragraph"]
+
+
+def test_long_paragraphs_are_cut_with_overlap():
+    paragraph = ''.join(chr(ord('a') + n % 26) for n in range(250))
+    chunks = chunk_text(f"intro\n\n{paragraph}", chunk_chars=100, overlap=20)
+
+    assert chunks[0] == 'intro'
+    pieces = chunks[1:]
+    assert all(len(piece) <= 100 for piece in pieces)
+    for previous, piece in zip(pieces, pieces[1:]):
+        assert previous[-20:] == piece[:20]
+    assert pieces[-1].endswith(paragraph[-10:])
+    # The last piece ends the paragraph instead of repeating a fully overlapped tail
+    assert len(pieces) == 3
+
+
+def test_chunk_empty_text():
+    assert chunk_text('') == []
+    assert chunk_text('\n\n  \n\n') == []
+
+
+def test_bm25_ranks_matching_chunks_first():
+    backend = BM25Backend()
+    chunks = [
+        "The office is closed on public holidays.",
+        "Vacation requests need manager approval two weeks ahead.",
+        "Vacation days roll over; unused vacation expires in March."
+    ]
+    index = backend.build(chunks)
+
+    scores = backend.score(index, "vacation expires")
+
+    assert scores[0] == 0
+    assert scores[2] > scores[1] > 0
+
+
+def test_bm25_ignores_unknown_terms():
+    backend = BM25Backend()
+    index = backend.build(["alpha beta", "gamma"])
+    assert backend.score(index, "delta") == [0.0, 0.0]
+
+
+def test_search_returns_top_chunks_in_document_order(tmp_path):
+    retriever = ChunkRetriever(str(tmp_path), chunk_chars=40, overlap=5)
+    paragraphs = ["intro to the handbook", "parking is in lot b", "expense reports are due monthly",
+                  "parking permits cost nothing", "closing remarks"]
+    text = "\n\n".join(paragraphs)
+
+    results = retriever.search('a' * 64, "where is parking", k=2, text=text)
+
+    assert [result['text'] for result in results] == ["parking is in lot b", "parking permits cost nothing"]
+    assert all(result['total'] == 5 for result in results)
+
+
+def test_index_is_persisted_and_reloaded(tmp_path):
+    content_hash = 'b' * 64
+    ChunkRetriever(str(tmp_path)).index(content_hash, "budget review\n\nhiring plan")
+
+    results = ChunkRetriever(str(tmp_path)).search(content_hash, "hiring", k=1)
+
+    assert [result['text'] for result in results] == ["budget review\n\nhiring plan"]
+
+
+def test_search_without_an_index_or_query(tmp_path):
+    retriever = ChunkRetriever(str(tmp_path), chunk_chars=20, overlap=5)
+
+    assert retriever.search('c' * 64, "anything") == []
+    # With no query the head of the file is kept
+    results = retriever.search('c' * 64, '', k=1, text="first part\n\nsecond part\n\nthird part")
+    assert [result['position'] for result in results] == [0]
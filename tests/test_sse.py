@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+from backend.sse import DeltaBatcher, encode_json, frame
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, ms):
+        self.now += ms / 1000
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_frame():
+    payload = {'content': 'héllo "there"\n'}
+    text = frame(payload)
+
+    assert text.startswith('data: ') and text.endswith('\n\n')
+    assert json.loads(text[len('data: '):]) == payload
+    assert json.loads(encode_json({'done': True})) == {'done': True}
+
+
+def test_first_delta_is_sent_immediately(clock):
+    batcher = DeltaBatcher(50, 1024, clock=clock)
+    assert batcher.add('Hello') == 'Hello'
+
+
+def test_deltas_inside_the_window_are_merged(clock):
+    batcher = DeltaBatcher(50, 1024, clock=clock)
+    batcher.add('a')
+
+    clock.advance(10)
+    assert batcher.add('b') is None
+    clock.advance(10)
+    assert batcher.add('c') is None
+    assert batcher.timeout() == pytest.approx(0.03)
+    assert batcher.due() is None
+
+    clock.advance(30)
+    assert batcher.timeout() == 0
+    assert batcher.due() == 'bc'
+    assert batcher.timeout() is None
+
+
+def test_slow_streams_are_not_delayed(clock):
+    batcher = DeltaBatcher(50, 1024, clock=clock)
+    for delta in ['a', 'b', 'c']:
+        assert batcher.add(delta) == delta
+        clock.advance(60)
+
+
+def test_flushes_early_at_max_bytes(clock):
+    batcher = DeltaBatcher(50, 8, clock=clock)
+    batcher.add('x')
+
+    assert batcher.add('ééé') is None
+    # Six UTF-8 bytes so far; two more reach the limit
+    assert batcher.add('yz') == 'éééyz'
+
+
+def test_flush_returns_everything_buffered(clock):
+    batcher = DeltaBatcher(50, 1024, clock=clock)
+    assert batcher.add('a') == 'a'
+    batcher.add('b')
+    batcher.add('c')
+
+    assert batcher.flush() == 'bc'
+    assert batcher.flush() is None
+    # Even an empty flush starts a new window
+    assert batcher.add('d') is None
+
+
+def test_zero_delay_disables_batching(clock):
+    batcher = DeltaBatcher(0, 1024, clock=clock)
+    assert [batcher.add(delta) for delta in ['a', 'b', 'c']] == ['a', 'b', 'c']
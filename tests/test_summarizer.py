@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import mongomock
+import pytest
+
+from backend.message_store import INTERRUPTED_NOTE, STATUS_INTERRUPTED, STATUS_STREAMING
+from backend.summarizer import ConversationSummarizer
+
+
+class StubGateway:
+    """Completion gateway that records every call and answers with a numbered summary"""
+
+    def __init__(self):
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        content = f"summary {len(self.calls)}"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    def prompt(self, call=-1):
+        return self.calls[call]['messages'][1]['content']
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+def add_conversation(db, texts, overrides=None):
+    conversation_id = db.conversations.insert_one({"message_count": len(texts)}).inserted_id
+    db.messages.insert_many([{
+        "conversation_id": conversation_id,
+        "seq": seq,
+        "sender": 'user' if seq % 2 == 0 else 'bot',
+        "text": text,
+        **(overrides or {}).get(seq, {})
+    } for seq, text in enumerate(texts)])
+    return conversation_id
+
+
+def make_summarizer(db, gateway):
+    return ConversationSummarizer(db, gateway, 'test-model', keep_recent=4, min_batch=3, max_batch=10)
+
+
+def test_folds_turns_that_left_the_recent_window(db):
+    gateway = StubGateway()
+    conversation_id = add_conversation(db, [f"turn {seq}" for seq in range(10)])
+
+    assert make_summarizer(db, gateway).refresh(conversation_id)
+
+    conversation = db.conversations.find_one({"_id": conversation_id})
+    assert conversation['summary'] == 'summary 1'
+    assert conversation['summary_seq'] == 5
+    assert gateway.calls[0]['model'] == 'test-model'
+    assert gateway.calls[0]['stream'] is False
+    prompt = gateway.prompt()
+    assert "User: turn 0" in prompt and "Assistant: turn 5" in prompt
+    # The most recent messages stay out of the summary
+    assert "turn 6" not in prompt
+
+
+def test_refresh_extends_the_previous_summary(db):
+    gateway = StubGateway()
+    summarizer = make_summarizer(db, gateway)
+    conversation_id = add_conversation(db, [f"turn {seq}" for seq in range(10)])
+    summarizer.refresh(conversation_id)
+
+    db.messages.insert_many([{
+        "conversation_id": conversation_id, "seq": seq, "sender": 'user', "text": f"turn {seq}"
+    } for seq in range(10, 14)])
+    db.conversations.update_one({"_id": conversation_id}, {"$set": {"message_count": 14}})
+
+    assert summarizer.refresh(conversation_id)
+    prompt = gateway.prompt()
+    assert prompt.startswith("Existing summary:\nsummary 1")
+    assert "turn 5" not in prompt and "turn 6" in prompt and "turn 9" in prompt
+    assert db.conversations.find_one({"_id": conversation_id})['summary_seq'] == 9
+
+
+def test_skips_the_model_below_min_batch(db):
+    gateway = StubGateway()
+    conversation_id = add_conversation(db, [f"turn {seq}" for seq in range(6)])
+
+    assert not make_summarizer(db, gateway).refresh(conversation_id)
+    assert gateway.calls == []
+
+
+def test_stops_before_a_streaming_reply(db):
+    gateway = StubGateway()
+    texts = [f"turn {seq}" for seq in range(12)]
+    conversation_id = add_conversation(db, texts, {5: {"status": STATUS_STREAMING}})
+
+    assert make_summarizer(db, gateway).refresh(conversation_id)
+
+    # Folding past seq 5 would leave its final text out of the summary for good
+    assert db.conversations.find_one({"_id": conversation_id})['summary_seq'] == 4
+    assert "turn 5" not in gateway.prompt()
+
+
+def test_folds_a_stale_streaming_reply_as_interrupted(db):
+    gateway = StubGateway()
+    texts = [f"turn {seq}" for seq in range(12)]
+    conversation_id = add_conversation(db, texts, {
+        # Orphaned by a dead worker: never checkpointed, created long ago
+        1: {"status": STATUS_STREAMING, "text": '', "timestamp": (datetime.utcnow() - timedelta(hours=1)).isoformat()},
+        3: {"status": STATUS_STREAMING, "checkpoint_at": datetime.now() - timedelta(seconds=400)}
+    })
+
+    assert make_summarizer(db, gateway).refresh(conversation_id)
+
+    assert db.conversations.find_one({"_id": conversation_id})['summary_seq'] == 7
+    assert f"Assistant: turn 3\n\n{INTERRUPTED_NOTE}" in gateway.prompt()
+
+
+def test_keeps_interrupted_replies_marked_as_cut_off(db):
+    gateway = StubGateway()
+    texts = [f"turn {seq}" for seq in range(10)]
+    conversation_id = add_conversation(db, texts, {
+        1: {"status": STATUS_INTERRUPTED},
+        3: {"status": STATUS_INTERRUPTED, "text": ''}
+    })
+
+    assert make_summarizer(db, gateway).refresh(conversation_id)
+
+    prompt = gateway.prompt()
+    assert f"Assistant: turn 1\n\n{INTERRUPTED_NOTE}" in prompt
+    # An interrupted reply without any text contributes nothing
+    assert "Assistant: \n" not in prompt and "turn 3" not in prompt
+
+
+def test_does_not_overwrite_a_concurrent_refresh(db):
+    conversation_id = add_conversation(db, [f"turn {seq}" for seq in range(10)])
+
+    class RacingGateway(StubGateway):
+        def create(self, **kwargs):
+            # Another worker folds the same turns in while this call runs
+            db.conversations.update_one({"_id": conversation_id}, {"$set": {"summary": 'other', "summary_seq": 5}})
+            return super().create(**kwargs)
+
+    assert not make_summarizer(db, RacingGateway()).refresh(conversation_id)
+    assert db.conversations.find_one({"_id": conversation_id})['summary'] == 'other'
+
+
+def test_disabled_without_a_gateway(db):
+    conversation_id = add_conversation(db, [f"turn {seq}" for seq in range(10)])
+    summarizer = make_summarizer(db, None)
+
+    assert not summarizer.enabled
+    assert not summarizer.refresh(conversation_id)
+    assert summarizer.refresh_in_background(conversation_id) is None
@@ -0,0 +1,174 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from pymongo.errors import AutoReconnect
+
+from backend.message_store import MessageStore
+from backend.write_behind import MessageCheckpoint, WriteBehindWriter
+
+
+class Collection:
+    """
+    Applies bulk writes one update at a time (mongomock's ``bulk_write`` lags behind pymongo's ``UpdateOne``);
+    the next ``failures`` bulk writes fail with a connection error, after calling ``on_failure``.
+    """
+
+    def __init__(self, collection, failures=0, on_failure=None):
+        self.collection = collection
+        self.failures = failures
+        self.on_failure = on_failure
+        self.attempts = 0
+
+    def bulk_write(self, operations, **kwargs):
+        self.attempts += 1
+        if self.failures:
+            self.failures -= 1
+            if self.on_failure:
+                self.on_failure()
+            raise AutoReconnect('connection reset')
+        for operation in operations:
+            self.collection.update_one(operation._filter, operation._doc)
+
+
+class Database:
+    def __init__(self, db, **collections):
+        self.db = db
+        self.collections = collections
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = Collection(self.db[name])
+        return self.collections[name]
+
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient().db
+    db.messages.insert_one({"_id": 'm1', "text": ''})
+    return db
+
+
+def test_coalesces_updates_to_the_same_document(db):
+    writer = WriteBehindWriter(Database(db), flush_interval=60)
+    for text in ['a', 'ab', 'abc']:
+        writer.update('messages', {"_id": 'm1'}, {"$set": {"text": text}}, key='m1')
+    writer.update('messages', {"_id": 'm1'}, {"$set": {"seen": True}})
+
+    writer.close()
+
+    assert db.messages.find_one({"_id": 'm1'}) == {"_id": 'm1', "text": 'abc', "seen": True}
+    stats = writer.stats()
+    assert (stats['queued'], stats['coalesced'], stats['written'], stats['batches']) == (4, 2, 2, 1)
+
+
+def test_full_batch_is_written_before_the_interval(db):
+    writer = WriteBehindWriter(Database(db), flush_interval=60, max_batch=2)
+    writer.update('messages', {"_id": 'm1'}, {"$set": {"a": 1}})
+    writer.update('messages', {"_id": 'm1'}, {"$set": {"b": 2}})
+
+    for _ in range(500):
+        if writer.stats()['written'] == 2:
+            break
+        writer._thread.join(0.01)
+    assert db.messages.find_one({"_id": 'm1'})['b'] == 2
+    writer.close()
+
+
+def test_requeues_after_a_connection_error(db):
+    messages = Collection(db.messages, failures=1)
+    writer = WriteBehindWriter(Database(db, messages=messages), flush_interval=0.01)
+    writer.update('messages', {"_id": 'm1'}, {"$set": {"text": 'final'}}, key='m1')
+
+    writer.close()
+
+    assert db.messages.find_one({"_id": 'm1'})['text'] == 'final'
+    assert messages.attempts == 2
+    stats = writer.stats()
+    assert (stats['retries'], stats['written'], stats['dropped']) == (1, 1, 0)
+
+
+def test_requeue_keeps_a_newer_update_for_the_same_document(db):
+    writer = None
+
+    def newer_update_arrives():
+        writer.update('messages', {"_id": 'm1'}, {"$set": {"text": 'newer'}}, key='m1')
+
+    messages = Collection(db.messages, failures=1, on_failure=newer_update_arrives)
+    writer = WriteBehindWriter(Database(db, messages=messages), flush_interval=0.01)
+    writer.update('messages', {"_id": 'm1'}, {"$set": {"text": 'older'}}, key='m1')
+
+    writer.close()
+
+    assert db.messages.find_one({"_id": 'm1'})['text'] == 'newer'
+    assert writer.stats()['written'] == 1
+
+
+def test_drops_a_batch_after_max_retries(db):
+    messages = Collection(db.messages, failures=10)
+    writer = WriteBehindWriter(Database(db, messages=messages), flush_interval=0.01, max_retries=1)
+    writer.update('messages', {"_id": 'm1'}, {"$set": {"text": 'lost'}})
+
+    writer.close()
+
+    assert messages.attempts == 2
+    assert writer.stats()['dropped'] == 1
+    assert db.messages.find_one({"_id": 'm1'})['text'] == ''
+
+
+def test_writes_through_after_close(db):
+    writer = WriteBehindWriter(Database(db))
+    writer.close()
+
+    writer.update('messages', {"_id": 'm1'}, {"$set": {"text": 'late'}})
+
+    assert db.messages.find_one({"_id": 'm1'})['text'] == 'late'
+
+
+def test_checkpoint_finish_replaces_pending_progress(db):
+    db.conversations.insert_one({"_id": 'c1'})
+    db.messages.insert_one({"conversation_id": 'c1', "seq": 1, "text": '', "status": 'streaming'})
+    writer = WriteBehindWriter(Database(db), flush_interval=60)
+    checkpoint = MessageCheckpoint(writer, 'c1', 1, interval=0)
+
+    checkpoint.progress('partial')
+    checkpoint.finish('partial and final')
+    writer.close()
+
+    message = db.messages.find_one({"conversation_id": 'c1', "seq": 1}, projection={"_id": 0})
+    assert message == {"conversation_id": 'c1', "seq": 1, "text": 'partial and final'}
+    assert 'updated_at' in db.conversations.find_one({"_id": 'c1'})
+    assert writer.stats()['coalesced'] == 1
+
+
+def test_close_interrupts_replies_still_generating(db):
+    db.messages.insert_one({"conversation_id": 'c1', "seq": 1, "text": '', "status": 'streaming'})
+    writer = WriteBehindWriter(Database(db), flush_interval=60)
+    checkpoint = MessageCheckpoint(writer, 'c1', 1, interval=60)
+    checkpoint.progress('partial')
+    finished = MessageCheckpoint(writer, 'c1', 2)
+    finished.finish('done')
+
+    writer.close()
+
+    message = db.messages.find_one({"conversation_id": 'c1', "seq": 1})
+    assert (message['text'], message['status'], message['error']) == ('partial', 'interrupted', 'worker shut down')
+    assert writer._checkpoints == set()
+
+
+def test_interrupt_stale_replies(db):
+    now, utcnow = datetime.now(), datetime.utcnow()
+    db.messages.insert_many([
+        {"seq": 1, "status": 'streaming', "checkpoint_at": now - timedelta(seconds=400)},
+        {"seq": 2, "status": 'streaming', "checkpoint_at": now - timedelta(seconds=5),
+         "timestamp": (utcnow - timedelta(hours=1)).isoformat()},
+        {"seq": 3, "status": 'streaming', "timestamp": (utcnow - timedelta(seconds=400)).isoformat()},
+        {"seq": 4, "status": 'streaming', "timestamp": utcnow.isoformat()},
+        {"seq": 5, "text": 'complete', "timestamp": (utcnow - timedelta(hours=1)).isoformat()}
+    ])
+
+    assert MessageStore(db).interrupt_stale(300) == 2
+
+    statuses = {message['seq']: message.get('status') for message in db.messages.find({"seq": {"$exists": True}})}
+    assert statuses == {1: 'interrupted', 2: 'streaming', 3: 'interrupted', 4: 'streaming', 5: None}
+    assert 'checkpoint_at' not in db.messages.find_one({"seq": 1})